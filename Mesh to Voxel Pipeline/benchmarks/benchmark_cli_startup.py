@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+@author: ken
+"""
+
+
+"""
+This script measures the start up time of the voxel_pipeline command
+line: --help for the command and every subcommand, and a dry run of
+every subcommand on a small synthetic OFF tree and small synthetic
+MNIST IDX files. Each command runs in a fresh interpreter; the
+median wall-clock time of several runs is compared against a budget,
+and the heavy modules (tensorflow, trimesh, sklearn, matplotlib)
+that the command loaded are listed.
+
+The script exits with status 1 if any command is over its budget or
+loads a heavy module, so it can be used as a check.
+"""
+
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+# Budgets in seconds for the median start up time
+HELP_BUDGET = 0.3
+DRY_RUN_BUDGET = 1.0
+HEAVY_MODULES = ('tensorflow', 'trimesh', 'sklearn', 'matplotlib')
+
+# Runs the command line in-process and reports the heavy modules it
+# imported on stderr
+RUNNER = '''
+import sys
+sys.path.insert(0, sys.argv[1])
+import voxel_pipeline
+try:
+    voxel_pipeline.main(sys.argv[3:])
+except SystemExit:
+    pass
+finally:
+    sys.stderr.write("HEAVY:" + ",".join(name for name in sys.argv[2].split(",") if name in sys.modules) + "\\n")
+'''
+
+
+
+"""
+This function writes a small ModelNet style tree of OFF cubes.
+"""
+def synthetic_off_tree(root, categories=3, per_split=4):
+    cube = ("OFF\n8 6 0\n" + "".join("%d %d %d\n" % (x, y, z) for x in (0, 1) for y in (0, 1) for z in (0, 1)) +
+            "4 0 1 3 2\n4 4 6 7 5\n4 0 4 5 1\n4 2 3 7 6\n4 0 2 6 4\n4 1 5 7 3\n")
+    for c in range(categories):
+        for split in ('train', 'test'):
+            directory = os.path.join(root, 'category_%d' % c, split)
+            os.makedirs(directory)
+            for i in range(per_split):
+                with open(os.path.join(directory, 'mesh_%d.off' % i), 'w') as f:
+                    f.write(cube)
+
+
+
+"""
+This function writes small MNIST IDX files of random images.
+"""
+def synthetic_idx_files(directory, n_train=300, n_test=100):
+    sys.path.insert(0, SRC_DIR)
+    import idx_dataset
+
+    os.makedirs(directory)
+    rng = np.random.default_rng(0)
+    for prefix, n_images in (('train', n_train), ('t10k', n_test)):
+        idx_dataset.write_idx(os.path.join(directory, prefix + '-images-idx3-ubyte'),
+                              rng.integers(0, 256, size=(n_images, 28, 28), dtype=np.uint8))
+        idx_dataset.write_idx(os.path.join(directory, prefix + '-labels-idx1-ubyte'),
+                              rng.integers(0, 10, size=n_images, dtype=np.uint8))
+
+
+
+"""
+This function runs one command line several times and returns the
+median wall-clock time and the heavy modules it loaded.
+"""
+def time_command(args, repeats):
+    times = []
+    heavy = ''
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', RUNNER, SRC_DIR, ','.join(HEAVY_MODULES)] + args,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        times.append(time.perf_counter() - start)
+        heavy = [line[6:] for line in result.stderr.splitlines() if line.startswith('HEAVY:')][-1]
+    return float(np.median(times)), heavy
+
+
+
+def main():
+    repeats = 5
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        off_dir = os.path.join(tmp_dir, 'off')
+        synthetic_off_tree(off_dir)
+        commands = [(['--help'], HELP_BUDGET)]
+        commands += [([command, '--help'], HELP_BUDGET)
+                     for command in ('convert', 'voxelize', 'merge', 'preview', 'emnist-simple', 'emnist-complex')]
+        data_dir = os.path.join(tmp_dir, 'emnist_data')
+        synthetic_idx_files(data_dir)
+        open(os.path.join(tmp_dir, 'object.hdf5'), 'wb').close()
+        emnist_args = ['--data-dir', data_dir, '--train-size', '300', '--test-size', '100', '--dry-run']
+        commands += [
+            (['convert', '--input', off_dir, '--output', os.path.join(tmp_dir, 'mat'), '--dry-run'], DRY_RUN_BUDGET),
+            (['convert', '--input', off_dir, '--output', os.path.join(tmp_dir, 'pack'), '--format', 'pack', '--dry-run'],
+             DRY_RUN_BUDGET),
+            (['voxelize', '--input', off_dir, '--box-sizes', '16,32', '--dry-run'], DRY_RUN_BUDGET),
+            (['voxelize', '--input', off_dir, '--shard', '1/4', '--dry-run'], DRY_RUN_BUDGET),
+            (['preview', os.path.join(tmp_dir, 'object.hdf5'), '--dry-run'], DRY_RUN_BUDGET),
+            (['emnist-simple'] + emnist_args, DRY_RUN_BUDGET),
+            (['emnist-complex'] + emnist_args, DRY_RUN_BUDGET),
+        ]
+
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'])
+        print("Bare interpreter start up: %.0fms" % ((time.perf_counter() - start) * 1000))
+        failed = False
+        print("%-72s %10s %10s  %s" % ("command", "median", "budget", "heavy modules"))
+        for args, budget in commands:
+            elapsed, heavy = time_command(args, repeats)
+            over = elapsed > budget or bool(heavy)
+            failed = failed or over
+            label = ' '.join(arg if not arg.startswith(tmp_dir) else '...' for arg in args)
+            print("%-72s %8.0fms %8.0fms  %s%s" % (label, elapsed * 1000, budget * 1000, heavy or '-',
+                                                 '  OVER BUDGET' if over else ''))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+@author: ken
+"""
+
+
+"""
+This script compares the batch mashup of emnist_targets against the
+original 2-way float loop, on simple targets extruded from random
+28x28 uint8 images (no MNIST download needed).
+
+It checks that the halves pairing with k=2 gives the same complex
+targets as the loop, then prints the throughput of the loop and of
+the batch mashup for several k, pairings and translation offsets,
+counting only the combination (the simple targets are built once,
+up front).
+"""
+
+
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import emnist_targets
+
+
+BOX_SIZE = 28
+N_SAMPLES = 18000
+CASES = [(2, 'halves', 0), (2, 'random', 0), (2, 'cross-axis', 0), (3, 'cross-axis', 0), (4, 'random', 0),
+         (2, 'halves', 2), (3, 'cross-axis', 3)]
+
+
+
+"""
+The original mashup of complex_3D_Emnist_Mashup_target_creation.py,
+kept here unchanged as the baseline.
+"""
+def mashup_loop(x_train3d, box_size):
+    trainsize_half = int(len(x_train3d) / 2)
+    x_train3dcomplex = np.zeros((trainsize_half, box_size, box_size, box_size))
+    for i in range(trainsize_half):
+        tempcomplex = x_train3d[i] + x_train3d[i + trainsize_half]
+        tempcomplex[tempcomplex >= 1] = 255
+        x_train3dcomplex[i] = tempcomplex
+    return x_train3dcomplex
+
+
+
+"""
+This function builds the complex targets of a case the way
+write_complex_targets does, batch by batch, but from simple targets
+already in memory.
+"""
+def mashup_batches(simple, axes, k, pairing, max_shift, rng):
+    groups = emnist_targets.mashup_groups(axes, k, pairing, rng)
+    out = np.empty((len(groups), BOX_SIZE, BOX_SIZE, BOX_SIZE), dtype=np.uint8)
+    for first in range(0, len(groups), emnist_targets.EXTRUDE_BATCH):
+        batch = groups[first:first + emnist_targets.EXTRUDE_BATCH]
+        members = [simple[batch[:, j]] for j in range(k)]
+        if max_shift:
+            offsets = rng.integers(-max_shift, max_shift, size=(k, len(batch), 3), endpoint=True)
+            members = [emnist_targets.shift_targets(member, offsets[j]) for j, member in enumerate(members)]
+        out[first:first + len(batch)] = emnist_targets.mashup_batch(members)
+    return out
+
+
+
+def main():
+    rng = np.random.default_rng(0)
+    images = rng.integers(0, 256, size=(N_SAMPLES, BOX_SIZE, BOX_SIZE), dtype=np.uint8)
+    images[images < 128] = 0
+    simple = emnist_targets.extrude_targets(images, N_SAMPLES, BOX_SIZE, rng=0)
+    axes = emnist_targets.extrusion_axes(N_SAMPLES)
+
+    start = time.perf_counter()
+    expected = mashup_loop(simple.astype(np.float64), BOX_SIZE)
+    loop_time = time.perf_counter() - start
+    assert np.array_equal(emnist_targets.mashup_targets(simple), expected)
+    del expected
+
+    print("%-28s %10s %10s %14s" % ("case", "targets", "time", "targets/s"))
+    print("%-28s %10d %8.2f s %14.0f" % ("loop k=2 halves (float64)", N_SAMPLES // 2, loop_time,
+                                        N_SAMPLES // 2 / loop_time))
+    for k, pairing, max_shift in CASES:
+        start = time.perf_counter()
+        result = mashup_batches(simple, axes, k, pairing, max_shift, np.random.default_rng(1))
+        elapsed = time.perf_counter() - start
+        label = "k=%d %s%s" % (k, pairing, " shift %d" % max_shift if max_shift else "")
+        print("%-28s %10d %8.2f s %14.0f" % (label, len(result), elapsed, len(result) / elapsed))
+
+
+if __name__ == '__main__':
+    main()
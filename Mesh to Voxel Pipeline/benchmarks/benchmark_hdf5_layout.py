@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+@author: ken
+"""
+
+
+"""
+This script compares HDF5 voxel layouts and writers on synthetic
+occupancy grids (solid and hollow ellipsoids of random size and
+position):
+
+    baseline  dense int8, unchunked and uncompressed, written with one
+              h5py assignment per sample (the original writer)
+    per-call  dense int8, chunked and compressed, one h5py assignment
+              per sample
+    dense     dense int8, chunked and compressed, written by SlabWriter
+    packed    bit-packed uint8, chunked and compressed, SlabWriter
+
+For each it prints the write throughput, the file size and the
+throughput of reading contiguous batches back as dense arrays.
+"""
+
+
+import os
+import sys
+import tempfile
+import time
+import h5py
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import voxel_hdf5
+
+
+"""
+This function generates n random ellipsoid occupancy grids, half of
+them solid and half of them one voxel thick shells.
+"""
+def synthetic_grids(n, voxel_size, seed=0):
+    rng = np.random.RandomState(seed)
+    x, y, z = np.indices((voxel_size, voxel_size, voxel_size)) + 0.5
+    grids = np.zeros((n, voxel_size, voxel_size, voxel_size), dtype=np.int8)
+    for i in range(n):
+        center = rng.uniform(0.3, 0.7, 3) * voxel_size
+        radii = rng.uniform(0.15, 0.3, 3) * voxel_size
+        r = np.sqrt(((x - center[0]) / radii[0]) ** 2 + ((y - center[1]) / radii[1]) ** 2 +
+                    ((z - center[2]) / radii[2]) ** 2)
+        grids[i] = (r <= 1.0) if i % 2 == 0 else (np.abs(r - 1.0) * radii.min() <= 0.5)
+    return grids
+
+
+
+"""
+This function writes the grids into a new HDF5 file with one of the
+layouts above and returns the write throughput in samples per
+second and the file size in bytes.
+"""
+def write_file(path, grids, layout, compression):
+    start = time.perf_counter()
+    with h5py.File(path, 'w') as f:
+        if layout == 'baseline':
+            dataset = f.create_dataset('train_mat', grids.shape, np.int8)
+            for i in range(len(grids)):
+                dataset[i, ...] = grids[i]
+        elif layout == 'per-call':
+            dataset = voxel_hdf5.create_voxel_dataset(f, 'train_mat', len(grids), grids.shape[1],
+                                                      compression=compression)
+            for i in range(len(grids)):
+                dataset[i, ...] = grids[i]
+        else:
+            dataset = voxel_hdf5.create_voxel_dataset(f, 'train_mat', len(grids), grids.shape[1],
+                                                      packed=(layout == 'packed'), compression=compression)
+            with voxel_hdf5.SlabWriter(dataset) as writer:
+                for i in range(len(grids)):
+                    writer.write(i, grids[i])
+    throughput = len(grids) / (time.perf_counter() - start)
+    return throughput, os.path.getsize(path)
+
+
+
+"""
+This function reads the whole dataset back in contiguous batches and
+returns the throughput in samples per second.
+"""
+def read_throughput(path, batch_size):
+    with h5py.File(path, 'r') as f:
+        dataset = f['train_mat']
+        start = time.perf_counter()
+        for first in range(0, len(dataset), batch_size):
+            voxel_hdf5.read_voxels(dataset, slice(first, first + batch_size))
+        return len(dataset) / (time.perf_counter() - start)
+
+
+
+def main():
+    n_samples = 512
+    batch_size = 32
+    layouts = [('baseline', None), ('per-call', 'gzip'), ('dense', 'lzf'), ('dense', 'gzip'), ('packed', 'lzf'), ('packed', 'gzip')]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print("%6s %8s %6s %18s %12s %18s" % ("size", "layout", "filter", "write", "file size", "read"))
+        for voxel_size in (32, 64, 128):
+            grids = synthetic_grids(n_samples if voxel_size < 128 else n_samples // 4, voxel_size)
+            for layout, compression in layouts:
+                path = os.path.join(tmp_dir, 'voxels_%d_%s_%s.hdf5' % (voxel_size, layout, compression))
+                write_rate, size = write_file(path, grids, layout, compression)
+                read_rate = read_throughput(path, batch_size)
+                print("%6d %8s %6s %8.0f samples/s %9.1f MB %8.0f samples/s" % (
+                    voxel_size, layout, compression or '-', write_rate, size / 1024 ** 2, read_rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+@author: ken
+"""
+
+
+"""
+This script measures the cost of loading the MNIST images: the time
+from interpreter start until the train and test arrays are returned,
+the time to read every image once, and the peak RSS of the process.
+
+It writes MNIST sized IDX files of random images (60000 train and
+10000 test), uncompressed and gzipped, and loads them with
+idx_dataset in a fresh interpreter each. tf.keras.datasets.mnist is
+measured as well where tensorflow is installed (it reads its own
+cached download, or fetches it).
+"""
+
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+import idx_dataset
+
+
+# Loads the images in a fresh interpreter and prints the load time,
+# the time to read every image and the peak RSS in bytes
+RUNNER = '''
+import resource, sys, time
+start = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+if sys.argv[2] == 'tensorflow':
+    import tensorflow as tf
+    (x_train, _), (x_test, _) = tf.keras.datasets.mnist.load_data()
+else:
+    import idx_dataset
+    (x_train, _), (x_test, _) = idx_dataset.load_dataset(sys.argv[2], sys.argv[3])
+loaded = time.perf_counter()
+total = int(x_train.sum(dtype='u8')) + int(x_test.sum(dtype='u8'))
+read = time.perf_counter()
+try:
+    # ru_maxrss survives exec, so it would report the parent's peak
+    with open('/proc/self/status') as f:
+        peak = [int(line.split()[1]) * 1024 for line in f if line.startswith('VmHWM:')][0]
+except OSError:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+print(loaded - start, read - loaded, peak)
+'''
+
+
+
+"""
+This function runs one loader in a fresh interpreter and returns the
+wall-clock time from start to loaded arrays, the time to read every
+image and the peak RSS.
+"""
+def measure(*args):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', RUNNER, SRC_DIR] + list(args), capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    _, read, peak = result.stdout.split()
+    # Interpreter start up counted in, as a user would see it
+    return wall - float(read), float(read), int(peak)
+
+
+
+def main():
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for dataset, prefixes in (('mnist', ('train', 't10k')), ('letters', ('emnist-letters-train',
+                                                                             'emnist-letters-test'))):
+            for compressed in (False, True):
+                directory = os.path.join(tmp_dir, dataset + ('_gz' if compressed else ''))
+                os.makedirs(directory)
+                for prefix, n_images in zip(prefixes, (60000, 10000)):
+                    ext = '.gz' if compressed else ''
+                    idx_dataset.write_idx(os.path.join(directory, prefix + '-images-idx3-ubyte' + ext),
+                                          rng.integers(0, 256, size=(n_images, 28, 28), dtype=np.uint8))
+                    idx_dataset.write_idx(os.path.join(directory, prefix + '-labels-idx1-ubyte' + ext),
+                                          rng.integers(0, 10, size=n_images, dtype=np.uint8))
+
+        print("%-32s %12s %12s %12s" % ("loader", "load", "read all", "peak RSS"))
+        cases = [('idx mnist, uncompressed', (os.path.join(tmp_dir, 'mnist'), 'mnist')),
+                 ('idx mnist, gzipped', (os.path.join(tmp_dir, 'mnist_gz'), 'mnist')),
+                 ('idx letters, uncompressed', (os.path.join(tmp_dir, 'letters'), 'letters')),
+                 ('idx letters, gzipped', (os.path.join(tmp_dir, 'letters_gz'), 'letters')),
+                 ('tf.keras mnist', ('tensorflow',))]
+        for label, args in cases:
+            try:
+                load, read, peak = measure(*args)
+            except RuntimeError as e:
+                print("%-32s skipped: %s" % (label, e))
+                continue
+            print("%-32s %10.0fms %10.0fms %10.0fMB" % (label, load * 1000, read * 1000, peak / 1024 ** 2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+@author: ken
+"""
+
+
+"""
+This script compares ways of reading shuffled training batches from
+an HDF5 voxel file, on synthetic files laid out like the ones
+prepare_voxel_data writes (dense gzip, packed lzf, and an unchunked,
+uncompressed dense file like the original writer produced):
+
+    indexed   one h5py read per sample, in shuffled order (what a
+              trainer indexing the datasets directly does)
+    fancy     one h5py fancy-index read per batch, sorted indices
+    loader    VoxelLoader, synchronous (threads=0) and with
+              background prefetch threads
+    loader xN VoxelLoader in N worker processes, each reading its own
+              disjoint range
+
+For each it prints the throughput in samples per second. The indexed
+and fancy readers only read part of the file, as they are slow.
+"""
+
+
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import h5py
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import voxel_hdf5
+import voxel_loader
+from benchmark_hdf5_layout import synthetic_grids
+
+
+BATCH_SIZE = 32
+
+
+
+"""
+This function writes a synthetic train split with labels in one of
+the layouts.
+"""
+def write_file(path, grids, layout):
+    rng = np.random.RandomState(1)
+    with h5py.File(path, 'w') as f:
+        if layout == 'unchunked':
+            f.create_dataset('train_mat', data=grids)
+            f.create_dataset('train_label', data=rng.randint(0, 40, (len(grids), 1)).astype(np.int8))
+            return
+        packed = layout == 'packed lzf'
+        compression = 'lzf' if packed else 'gzip'
+        dataset = voxel_hdf5.create_voxel_dataset(f, 'train_mat', len(grids), grids.shape[1], packed=packed,
+                                                  compression=compression)
+        with voxel_hdf5.SlabWriter(dataset) as writer:
+            for i in range(len(grids)):
+                writer.write(i, grids[i])
+        labels = voxel_hdf5.create_sample_dataset(f, 'train_label', len(grids), (1,), np.int8, compression)
+        labels[:] = rng.randint(0, 40, (len(grids), 1))
+
+
+
+"""
+This function reads n_samples samples one h5py call per sample, in
+shuffled order, and returns the throughput.
+"""
+def indexed_throughput(path, n_samples):
+    with h5py.File(path, 'r') as f:
+        voxels, labels = f['train_mat'], f['train_label']
+        order = np.random.RandomState(0).permutation(len(voxels))[:n_samples]
+        start = time.perf_counter()
+        for first in range(0, len(order), BATCH_SIZE):
+            batch = [voxel_hdf5.read_voxels(voxels, int(i)) for i in order[first:first + BATCH_SIZE]]
+            np.stack(batch), np.array([labels[int(i)][0] for i in order[first:first + BATCH_SIZE]])
+        return len(order) / (time.perf_counter() - start)
+
+
+
+"""
+This function reads n_samples samples one fancy-index read per
+shuffled batch, and returns the throughput.
+"""
+def fancy_throughput(path, n_samples):
+    with h5py.File(path, 'r') as f:
+        voxels, labels = f['train_mat'], f['train_label']
+        order = np.random.RandomState(0).permutation(len(voxels))[:n_samples]
+        start = time.perf_counter()
+        for first in range(0, len(order), BATCH_SIZE):
+            batch = np.sort(order[first:first + BATCH_SIZE])
+            voxel_hdf5.read_voxels(voxels, batch), labels[batch]
+        return len(order) / (time.perf_counter() - start)
+
+
+
+"""
+This function reads one epoch with a VoxelLoader and returns the
+number of samples read and the throughput.
+"""
+def loader_throughput(path, threads, rank=0, world_size=1):
+    loader = voxel_loader.VoxelLoader(path, 'train', BATCH_SIZE, threads=threads, seed=0, rank=rank,
+                                      world_size=world_size)
+    start = time.perf_counter()
+    n_samples = 0
+    with loader:
+        for voxels, labels in loader:
+            n_samples += len(labels)
+    return n_samples, n_samples / (time.perf_counter() - start)
+
+
+
+def rank_epoch(args):
+    return loader_throughput(*args)[0]
+
+
+
+"""
+This function reads one epoch with a VoxelLoader in each of
+world_size processes and returns the total throughput.
+"""
+def multi_process_throughput(path, world_size):
+    start = time.perf_counter()
+    with multiprocessing.Pool(world_size) as pool:
+        n_samples = sum(pool.map(rank_epoch, [(path, 2, rank, world_size) for rank in range(world_size)]))
+    return n_samples / (time.perf_counter() - start)
+
+
+
+def main():
+    n_indexed = 1024
+    world_size = min(4, os.cpu_count() or 1)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print("%6s %12s %26s" % ("size", "layout", "throughput"))
+        for voxel_size, n_samples in ((32, 4096), (64, 1024)):
+            grids = synthetic_grids(n_samples, voxel_size)
+            for layout in ('unchunked', 'dense gzip', 'packed lzf'):
+                path = os.path.join(tmp_dir, 'voxels_%d_%s.hdf5' % (voxel_size, layout.replace(' ', '_')))
+                write_file(path, grids, layout)
+                rows = [('indexed', indexed_throughput(path, min(n_indexed, n_samples))),
+                        ('fancy', fancy_throughput(path, min(n_indexed, n_samples))),
+                        ('loader', loader_throughput(path, 0)[1]),
+                        ('loader+threads', loader_throughput(path, 2)[1])]
+                if world_size > 1:
+                    rows.append(('loader x%d' % world_size, multi_process_throughput(path, world_size)))
+                for reader, throughput in rows:
+                    print("%6d %12s %16s %8.0f samples/s" % (voxel_size, layout, reader, throughput))
+
+
+if __name__ == '__main__':
+    main()
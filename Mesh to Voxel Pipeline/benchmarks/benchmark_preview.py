@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+@author: ken
+"""
+
+
+"""
+This script measures the time to render a preview of 100 samples:
+the projections, the contact sheet and the PNG write of
+voxel_preview, in both modes, on random extruded targets of several
+box sizes (no MNIST download needed).
+
+The 3D plot of a single target with matplotlib's ax.voxels, as the
+removed --show option drew it, is measured as well where matplotlib
+is installed (headless, with the Agg backend).
+"""
+
+
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import emnist_targets
+import voxel_preview
+
+
+BOX_SIZES = (28, 32, 64)
+REPEATS = 5
+
+
+
+"""
+This function returns the best of REPEATS wall-clock times of a call.
+"""
+def best_time(function, *args):
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+
+"""
+This function plots one target with ax.voxels and saves the figure,
+the way a single target was shown before.
+"""
+def plot_voxels(volume, path):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig = plt.figure()
+    ax = fig.add_subplot(projection='3d')
+    ax.voxels(volume > 0, edgecolor='k')
+    fig.savefig(path)
+    plt.close(fig)
+
+
+
+def main():
+    rng = np.random.default_rng(0)
+    print("%-28s %10s %12s" % ("case", "samples", "time"))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'preview.png')
+        for box_size in BOX_SIZES:
+            images = rng.integers(0, 256, size=(voxel_preview.PREVIEW_SAMPLES, 28, 28), dtype=np.uint8)
+            images[images < 128] = 0
+            if box_size != 28:
+                images = np.pad(images, ((0, 0), (0, box_size - 28), (0, box_size - 28)))
+            targets = emnist_targets.extrude_targets(images, len(images), box_size, rng=0)
+            for mode in voxel_preview.PREVIEW_MODES:
+                elapsed = best_time(voxel_preview.render_preview, targets, path, mode)
+                label = "%d^3 %s" % (box_size, mode)
+                print("%-28s %10d %10.1fms" % (label, len(targets), elapsed * 1000))
+
+        try:
+            start = time.perf_counter()
+            plot_voxels(targets[0], path)
+            elapsed = time.perf_counter() - start
+        except ImportError:
+            print("%-28s skipped: matplotlib is not installed" % "ax.voxels")
+        else:
+            print("%-28s %10d %10.1fms" % ("ax.voxels %d^3" % BOX_SIZES[-1], 1, elapsed * 1000))
+
+
+if __name__ == '__main__':
+    main()
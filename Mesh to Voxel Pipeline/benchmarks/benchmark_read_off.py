@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+@author: ken
+"""
+
+
+"""
+This script compares the throughput of the vectorized read_off in 
+off_to_mat_converter against the original line-by-line parser on 
+large synthetic triangle meshes. Each mesh is written to a 
+temporary OFF file, parsed several times by both functions, and 
+the best time, vertices/s and faces/s are printed for each.
+"""
+
+
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import off_to_mat_converter
+
+
+"""
+The original read_off, kept here unchanged as the baseline.
+"""
+def read_off_line_by_line(file):
+    with open(file, 'r') as f:
+        head_line = f.readline().strip()
+        if head_line.startswith("OFF"):
+            off_label = head_line[3:]  # Extract 'OFF'
+            off_label = off_label.strip()
+            if off_label != "":
+                n_verts, n_faces, _ = map(int, off_label.split())        
+            else:            
+                n_verts, n_faces, _ = map(int, f.readline().strip().split())
+            verts = []
+            for _ in range(n_verts):
+                verts.append(list(map(float, f.readline().strip().split())))
+            faces = []
+            for _ in range(n_faces):
+                faces.append(list(map(int, f.readline().strip().split()[1:])))
+        else:
+            return None, None
+    return np.array(verts), np.array(faces)
+
+
+
+"""
+This function writes a random triangle mesh with the given number 
+of faces (and half as many vertices) to an OFF file.
+"""
+def write_synthetic_off(file, n_faces, seed=0):
+    rng = np.random.RandomState(seed)
+    n_verts = max(3, n_faces // 2)
+    verts = rng.uniform(-1.0, 1.0, size=(n_verts, 3))
+    faces = rng.randint(0, n_verts, size=(n_faces, 3))
+    with open(file, 'w') as f:
+        f.write("OFF\n%d %d 0\n" % (n_verts, n_faces))
+        np.savetxt(f, verts, fmt='%.6f')
+        np.savetxt(f, np.hstack([np.full((n_faces, 1), 3), faces]), fmt='%d')
+    return n_verts
+
+
+
+"""
+This function returns the best wall-clock time of several calls.
+"""
+def best_time(func, file, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func(file)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+
+def main():
+    face_counts = [10000, 100000, 500000]
+    repeats = 3
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print("%10s %10s %14s %14s %9s" % ("faces", "verts", "line-by-line", "vectorized", "speedup"))
+        for n_faces in face_counts:
+            file = os.path.join(tmp_dir, 'mesh_%d.off' % n_faces)
+            n_verts = write_synthetic_off(file, n_faces)
+
+            old_verts, old_faces = read_off_line_by_line(file)
+            new_verts, new_faces = off_to_mat_converter.read_off(file)
+            assert np.allclose(old_verts, new_verts, atol=1e-6)
+            assert np.array_equal(old_faces, new_faces)
+
+            old_time = best_time(read_off_line_by_line, file, repeats)
+            new_time = best_time(off_to_mat_converter.read_off, file, repeats)
+            print("%10d %10d %12.3f s %12.3f s %8.1fx" % (n_faces, n_verts, old_time, new_time, old_time / new_time))
+            print("%10s %10s %9.2f Mf/s %9.2f Mf/s" % ("", "", n_faces / old_time / 1e6, n_faces / new_time / 1e6))
+
+
+if __name__ == '__main__':
+    main()
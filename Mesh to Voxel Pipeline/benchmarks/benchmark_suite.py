@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+"""
+@author: ken
+"""
+
+
+"""
+This script is the benchmark suite of the pipeline. It needs no
+dataset: it generates OFF meshes procedurally (UV spheres, tori and
+random convex polyhedra at controlled face counts) and times every
+stage on them:
+
+    read_off            parse the OFF file
+    save_mat, loadmat   write the MAT file and read it back
+    normalize_vertices  scale the vertices to the voxel grid
+    mesh_to_voxel       voxelize at 32, 64 and 128 with each backend
+    hdf5_write          write a batch of grids, dense gzip and packed lzf
+    hdf5_read           read the batch back in batches of 32
+
+Every case is run several times and its median and best time are
+written to a JSON file, together with the platform and library
+versions:
+
+    python benchmark_suite.py run --output results.json
+
+Two result files are compared with
+
+    python benchmark_suite.py compare baseline.json results.json
+
+which prints the change of every case and exits with status 1 if a
+case got slower than the threshold (10% by default), so a
+performance change can be checked before and after. The best times
+are compared by default, as they vary the least between runs.
+"""
+
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import h5py
+import numpy as np
+import scipy
+import scipy.spatial
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import mat_to_voxel_converter
+import off_to_mat_converter
+import voxel_hdf5
+
+
+SHAPES = ('sphere', 'torus', 'polyhedron')
+FACE_COUNTS = (2000, 20000)
+VOXEL_SIZES = (32, 64, 128)
+# Number of grids written and read by the hdf5 cases
+HDF5_SAMPLES = 256
+# Changes smaller than this many seconds are never regressions, to
+# keep timer noise on the fastest cases from failing a comparison
+MIN_REGRESSION_SECONDS = 0.0005
+
+
+
+"""
+This function returns the vertices and triangles of a UV sphere of
+about n_faces faces.
+"""
+def uv_sphere(n_faces):
+    rings = max(3, int(round(np.sqrt(n_faces / 4.0) + 0.5)))
+    segments = 2 * rings
+    theta = np.pi * np.arange(1, rings) / rings
+    phi = 2 * np.pi * np.arange(segments) / segments
+    ring_verts = np.stack([np.outer(np.sin(theta), np.cos(phi)), np.outer(np.sin(theta), np.sin(phi)),
+                           np.outer(np.cos(theta), np.ones(segments))], axis=-1).reshape(-1, 3)
+    vertices = np.vstack([[0.0, 0.0, 1.0], ring_verts, [0.0, 0.0, -1.0]])
+    index = 1 + np.arange(rings - 1)[:, None] * segments + np.arange(segments)
+    following = np.roll(index, -1, axis=1)
+    bottom = len(vertices) - 1
+    faces = [np.stack([np.zeros(segments, int), index[0], following[0]], axis=1),
+             np.stack([np.full(segments, bottom), following[-1], index[-1]], axis=1)]
+    a, b, c, d = index[:-1], following[:-1], following[1:], index[1:]
+    faces += [np.stack([a, d, c], axis=-1).reshape(-1, 3), np.stack([a, c, b], axis=-1).reshape(-1, 3)]
+    return vertices, np.vstack(faces)
+
+
+
+"""
+This function returns the vertices and triangles of a torus of about
+n_faces faces.
+"""
+def torus(n_faces, major_radius=1.0, minor_radius=0.35):
+    minor = max(3, int(round(np.sqrt(n_faces / 4.0))))
+    major = max(3, n_faces // (2 * minor))
+    u = 2 * np.pi * np.arange(major) / major
+    v = 2 * np.pi * np.arange(minor) / minor
+    ring = major_radius + minor_radius * np.cos(v)
+    vertices = np.stack([np.outer(np.cos(u), ring), np.outer(np.sin(u), ring),
+                         np.outer(np.ones(major), minor_radius * np.sin(v))], axis=-1).reshape(-1, 3)
+    index = np.arange(major * minor).reshape(major, minor)
+    a = index
+    b = np.roll(index, -1, axis=0)
+    c = np.roll(b, -1, axis=1)
+    d = np.roll(index, -1, axis=1)
+    faces = np.concatenate([np.stack([a, b, c], axis=-1).reshape(-1, 3), np.stack([a, c, d], axis=-1).reshape(-1, 3)])
+    return vertices, faces
+
+
+
+"""
+This function returns the vertices and triangles of a random convex
+polyhedron of about n_faces faces: the convex hull of random points
+on an ellipsoid, with its triangles oriented outwards.
+"""
+def random_polyhedron(n_faces, seed=0):
+    rng = np.random.RandomState(seed)
+    points = rng.normal(size=(n_faces // 2 + 2, 3))
+    points /= np.linalg.norm(points, axis=1, keepdims=True)
+    points *= np.array([1.0, 0.7, 0.5])
+    faces = scipy.spatial.ConvexHull(points).simplices
+    triangles = points[faces]
+    normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    inward = np.einsum('ij,ij->i', normals, triangles.mean(axis=1)) < 0
+    faces[inward] = faces[inward][:, ::-1]
+    return points, faces
+
+
+
+MESH_GENERATORS = {'sphere': uv_sphere, 'torus': torus, 'polyhedron': random_polyhedron}
+
+
+
+"""
+This function writes a triangle mesh to an OFF file.
+"""
+def write_off(file, vertices, faces):
+    with open(file, 'w') as f:
+        f.write("OFF\n%d %d 0\n" % (len(vertices), len(faces)))
+        np.savetxt(f, vertices, fmt='%.6f')
+        np.savetxt(f, np.hstack([np.full((len(faces), 1), 3), faces]), fmt='%d')
+
+
+
+"""
+This function calls func repeats times and returns the median and
+best wall-clock times. Anything func prints is discarded.
+"""
+def time_call(func, repeats):
+    times = []
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeats):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+    return {'median': float(np.median(times)), 'best': float(np.min(times)), 'repeats': repeats}
+
+
+
+"""
+This function times the per-mesh stages on one mesh, adding the
+results to the results dict, and returns the voxel grids it made
+with the numpy backend, by size.
+"""
+def run_mesh_cases(results, tmp_dir, name, vertices, faces, voxel_sizes, repeats):
+    off_file = os.path.join(tmp_dir, name + '.off')
+    mat_file = os.path.join(tmp_dir, name + '.mat')
+    write_off(off_file, vertices, faces)
+    info = {'faces': len(faces), 'vertices': len(vertices)}
+    verts, faces = off_to_mat_converter.read_off(off_file)
+
+    def add(stage, case, timing):
+        results['%s/%s' % (stage, case)] = dict(timing, stage=stage, **info)
+
+    add('read_off', name, time_call(lambda: off_to_mat_converter.read_off(off_file), repeats))
+    add('save_mat', name, time_call(lambda: off_to_mat_converter.save_mat(mat_file, verts, faces), repeats))
+    add('loadmat', name, time_call(lambda: mat_to_voxel_converter.load_mat_file(mat_file), repeats))
+    grids = {}
+    for voxel_size in voxel_sizes:
+        case = '%s/%d' % (name, voxel_size)
+        add('normalize_vertices', case,
+            time_call(lambda: mat_to_voxel_converter.normalize_vertices(verts, voxel_size), repeats))
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            scaled = mat_to_voxel_converter.normalize_vertices(verts, voxel_size)
+        for backend, voxelizer in sorted(mat_to_voxel_converter.VOXELIZERS.items()):
+            add('mesh_to_voxel', '%s/%s' % (backend, case), time_call(lambda: voxelizer(scaled, faces, voxel_size),
+                                                                      repeats))
+        grids[voxel_size] = mat_to_voxel_converter.mesh_to_voxel_numpy(scaled, faces, voxel_size)
+    return grids
+
+
+
+"""
+This function times writing HDF5_SAMPLES grids of one size to a new
+file, and reading them back in batches of 32, in the dense gzip and
+the packed lzf layouts.
+"""
+def run_hdf5_cases(results, tmp_dir, voxel_size, grids, repeats):
+    batch = np.stack([grids[i % len(grids)] for i in range(HDF5_SAMPLES)]).astype(np.int8)
+    info = {'samples': HDF5_SAMPLES}
+    for layout, packed, compression in (('dense_gzip', False, 'gzip'), ('packed_lzf', True, 'lzf')):
+        path = os.path.join(tmp_dir, 'voxels_%d_%s.hdf5' % (voxel_size, layout))
+
+        def write():
+            with h5py.File(path, 'w') as f:
+                dataset = voxel_hdf5.create_voxel_dataset(f, 'train_mat', len(batch), voxel_size, packed=packed,
+                                                          compression=compression)
+                with voxel_hdf5.SlabWriter(dataset) as writer:
+                    for i in range(len(batch)):
+                        writer.write(i, batch[i])
+
+        def read():
+            with h5py.File(path, 'r') as f:
+                dataset = f['train_mat']
+                for start in range(0, len(dataset), 32):
+                    voxel_hdf5.read_voxels(dataset, slice(start, start + 32))
+
+        case = '%s/%d' % (layout, voxel_size)
+        results['hdf5_write/' + case] = dict(time_call(write, repeats), stage='hdf5_write', **info)
+        results['hdf5_read/' + case] = dict(time_call(read, repeats), stage='hdf5_read', **info)
+
+
+
+"""
+This function runs the whole suite and returns the result document.
+"""
+def run_suite(face_counts=FACE_COUNTS, voxel_sizes=VOXEL_SIZES, repeats=5, stages=None):
+    results = {}
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        grids = {size: [] for size in voxel_sizes}
+        for shape in SHAPES:
+            for n_faces in face_counts:
+                vertices, faces = MESH_GENERATORS[shape](n_faces)
+                name = '%s_%d' % (shape, n_faces)
+                print("timing %s (%d faces)" % (name, len(faces)))
+                mesh_grids = run_mesh_cases(results, tmp_dir, name, vertices, faces, voxel_sizes, repeats)
+                for size, grid in mesh_grids.items():
+                    grids[size].append(grid)
+        for voxel_size in voxel_sizes:
+            print("timing hdf5 at size %d" % voxel_size)
+            run_hdf5_cases(results, tmp_dir, voxel_size, grids[voxel_size], repeats)
+    if stages:
+        results = {case: result for case, result in results.items() if result['stage'] in stages}
+    meta = {'date': datetime.datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+            'platform': platform.platform(), 'cpus': os.cpu_count(), 'numpy': np.__version__,
+            'scipy': scipy.__version__, 'h5py': h5py.__version__, 'face_counts': list(face_counts),
+            'voxel_sizes': list(voxel_sizes), 'repeats': repeats, 'seconds': time.perf_counter() - started}
+    return {'meta': meta, 'results': results}
+
+
+
+"""
+This function compares two result documents case by case on the
+best or the median time, and returns the table rows (case,
+baseline, current, ratio, flag) and whether any case regressed: its
+time grew by more than the threshold (a fraction) and by more than
+MIN_REGRESSION_SECONDS.
+"""
+def compare_results(baseline, current, threshold=0.10, statistic='best'):
+    rows = []
+    regressed = False
+    for case in sorted(set(baseline['results']) | set(current['results'])):
+        old = baseline['results'].get(case)
+        new = current['results'].get(case)
+        if old is None or new is None:
+            rows.append((case, old and old[statistic], new and new[statistic], None, 'only in ' +
+                         ('current' if old is None else 'baseline')))
+            continue
+        ratio = new[statistic] / old[statistic] if old[statistic] > 0 else float('inf')
+        flag = ''
+        if ratio > 1 + threshold and new[statistic] - old[statistic] > MIN_REGRESSION_SECONDS:
+            flag = 'REGRESSION'
+            regressed = True
+        elif ratio < 1 - threshold:
+            flag = 'faster'
+        rows.append((case, old[statistic], new[statistic], ratio, flag))
+    return rows, regressed
+
+
+
+def run_command(args):
+    document = run_suite(args.faces, args.sizes, args.repeats, args.stages)
+    with open(args.output, 'w') as f:
+        json.dump(document, f, indent=1)
+    print("%-48s %12s %12s" % ("case", "median", "best"))
+    for case, result in sorted(document['results'].items()):
+        print("%-48s %10.2fms %10.2fms" % (case, result['median'] * 1000, result['best'] * 1000))
+    print("%d cases in %.0f s written to %s" % (len(document['results']), document['meta']['seconds'], args.output))
+
+
+
+def compare_command(args):
+    documents = []
+    for path in (args.baseline, args.current):
+        with open(path) as f:
+            documents.append(json.load(f))
+    rows, regressed = compare_results(documents[0], documents[1], args.threshold, args.statistic)
+    print("%-48s %12s %12s %8s" % ("case", "baseline", "current", "change"))
+    for case, old, new, ratio, flag in rows:
+        print("%-48s %12s %12s %8s  %s" % (case, '-' if old is None else '%.2fms' % (old * 1000),
+                                          '-' if new is None else '%.2fms' % (new * 1000),
+                                          '-' if ratio is None else '%+.0f%%' % ((ratio - 1) * 100), flag))
+    if regressed:
+        print("Regressions beyond %.0f%% found" % (args.threshold * 100))
+    sys.exit(1 if regressed else 0)
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline stages on procedural meshes.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run = subparsers.add_parser('run', help='run the suite and write the results to a JSON file')
+    run.add_argument('--output', default='benchmark_results.json', help='JSON file to write (default: %(default)s)')
+    run.add_argument('--faces', type=lambda value: [int(n) for n in value.split(',')], default=FACE_COUNTS,
+                     help='comma separated face counts (default: %s)' % ','.join(map(str, FACE_COUNTS)))
+    run.add_argument('--sizes', type=lambda value: [int(n) for n in value.split(',')], default=VOXEL_SIZES,
+                     help='comma separated voxel sizes (default: %s)' % ','.join(map(str, VOXEL_SIZES)))
+    run.add_argument('--repeats', type=int, default=5, help='runs per case (default: %(default)s)')
+    run.add_argument('--stages', type=lambda value: value.split(','),
+                     help='comma separated stages to keep (default: all)')
+    run.set_defaults(handler=run_command)
+    compare = subparsers.add_parser('compare', help='compare two result files and flag regressions')
+    compare.add_argument('baseline', help='baseline result file')
+    compare.add_argument('current', help='result file to check')
+    compare.add_argument('--threshold', type=float, default=0.10,
+                         help='slowdown, as a fraction, flagged as a regression (default: %(default)s)')
+    compare.add_argument('--statistic', choices=('best', 'median'), default='best',
+                         help='time compared; the best time is the least sensitive to a busy machine '
+                              '(default: %(default)s)')
+    compare.set_defaults(handler=compare_command)
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+@author: ken
+"""
+
+
+"""
+This script compares the voxelization backends of
+mat_to_voxel_converter on synthetic meshes. For each mesh and voxel
+size it prints the median per-mesh latency of convert_mat_to_voxel
+with every backend, in surface mode and in solid (fill=True) mode,
+and the IoU of each backend's grid against the trimesh grid of the
+same mode.
+"""
+
+
+import os
+import sys
+import time
+import numpy as np
+import trimesh
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import mat_to_voxel_converter
+
+
+"""
+This function builds the synthetic test meshes: spheres of
+increasing face count, a box and a randomly scaled and rotated
+capsule.
+"""
+def synthetic_meshes():
+    meshes = {}
+    for subdivisions in (2, 4, 5):
+        sphere = trimesh.creation.icosphere(subdivisions=subdivisions)
+        meshes['sphere_%d' % len(sphere.faces)] = sphere
+    meshes['box'] = trimesh.creation.box(extents=(1.0, 0.6, 0.3))
+    capsule = trimesh.creation.capsule(height=2.0, radius=0.4, count=[64, 64])
+    capsule.apply_transform(trimesh.transformations.random_rotation_matrix(np.random.RandomState(0).rand(3)))
+    meshes['capsule_%d' % len(capsule.faces)] = capsule
+    return meshes
+
+
+
+"""
+This function returns the median wall-clock time of voxelizing a
+mesh with a backend, and the grid it produced.
+"""
+def time_backend(mesh, voxel_size, backend, fill, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        voxels = mat_to_voxel_converter.convert_mat_to_voxel(mesh.vertices, mesh.faces, voxel_size,
+                                                             backend=backend, fill=fill)
+        times.append(time.perf_counter() - start)
+    return float(np.median(times)), voxels
+
+
+
+"""
+This function returns the intersection over union of two occupancy
+grids, cropped to their common shape.
+"""
+def iou(a, b):
+    shape = tuple(min(x, y) for x, y in zip(a.shape, b.shape))
+    a = a[:shape[0], :shape[1], :shape[2]] > 0
+    b = b[:shape[0], :shape[1], :shape[2]] > 0
+    union = np.count_nonzero(a | b)
+    return np.count_nonzero(a & b) / union if union else 1.0
+
+
+
+def main():
+    repeats = 3
+    modes = [(backend, fill) for backend in sorted(mat_to_voxel_converter.VOXELIZERS) for fill in (False, True)]
+    labels = ["%s/%s" % (backend, 'solid' if fill else 'surface') for backend, fill in modes]
+    print("%-16s %5s %s" % ("mesh", "size", " ".join("%15s" % label for label in labels)))
+    for name, mesh in synthetic_meshes().items():
+        for voxel_size in (32, 64):
+            timings = {}
+            grids = {}
+            for mode in modes:
+                timings[mode], grids[mode] = time_backend(mesh, voxel_size, mode[0], mode[1], repeats)
+            print("%-16s %5d %s" % (name, voxel_size, " ".join("%13.1fms" % (timings[mode] * 1000) for mode in modes)))
+            print("%-16s %5s %s" % ("", "IoU", " ".join("%15.3f" % iou(grids[mode], grids[('trimesh', mode[1])])
+                                                        for mode in modes)))
+
+
+if __name__ == '__main__':
+    main()
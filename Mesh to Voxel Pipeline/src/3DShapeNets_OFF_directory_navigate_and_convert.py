@@ -1,56 +1,79 @@
-# -*- coding: utf-8 -*-
-"""
-Created on Mon Aug 26 16:56:58 2024
-
-@author: ken
-"""
-
-
-
-"""
-This script navigates from an input folder to all the lowest level
-directories containing only off files and converts them to MAT files
-and then stores the MAT files in the corresponding arrangement of 
-directories in the output directory given.
-"""
-
-
-import os
-import off_to_mat_converter
-
-
-# Default path if user input is invalid
-default_input_path = 'ModelNet40/ModelNet40_off'
-default_output_path = 'ModelNet40/ModelNet40_Mat'
-
-# Ask the user to input the directory paths
-input_path = input(f"Please enter the directory path containing OFF data (Default Path is '{default_input_path}'): ")
-output_path = input(f"Please enter the output directory path containing MAT data (Default Path is '{default_output_path}'): ")
-
-# Validate the user inputs
-if not os.path.isdir(input_path):
-    print(f"Invalid input directory: {input_path}. Using default input path: {default_input_path}")
-    input_path = default_input_path
-    
-if not os.path.isdir(output_path):
-    print(f"Invalid output directory: {output_path}. Using default output path: {default_output_path}")
-    out_path = default_output_path    
-
-
-
-for item in os.listdir(input_path):
-    if item != '.DS_Store' and item != 'README.txt' and item != '' and item != 'airplane' and item != 'bathtub' and item != 'bed' and item != 'bench' and item != 'bookshelf' and item != 'bottle' and item != 'bowl' and item != 'car' and item != 'chair' and item != 'cone' and item != 'cup' and item != 'curtain' and item != 'desk' and item != 'door' and item != 'dresser' and item != 'flower_pot' and item != 'glass_box' and item != 'guitar' and item != 'keyboard' and item != 'lamp' and item != 'laptop' and item != 'mantel' and item != 'monitor' and item != 'night_stand' and item != 'person' and item != 'piano':
-    #if item != '.DS_Store' and item != 'README.txt':
-        current_path = os.path.join(input_path, item)
-        output_path = os.path.join(out_path, item)
-        print(current_path)
-        for file in os.listdir(current_path):
-            if file != '.DS_Store':
-                current_train_path = os.path.join(current_path, 'train')
-                output_path_train = os.path.join(output_path, 'train')
-                off_to_mat_converter.convert_off_to_mat(current_train_path, output_path_train)
-
-                current_test_path = os.path.join(current_path, 'test')
-                output_path_test = os.path.join(output_path, 'test')
-                off_to_mat_converter.convert_off_to_mat(current_test_path, output_path_test)
-print("End of Program")                
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Aug 26 16:56:58 2024
+
+@author: ken
+"""
+
+
+
+"""
+This script navigates from an input folder to all the lowest level
+directories containing only off files and converts them to MAT files
+and then stores the MAT files in the corresponding arrangement of 
+directories in the output directory given.
+
+The tree is listed through a dataset index (see dataset_index), kept 
+in the input directory and refreshed incrementally, and the 
+categories to convert are chosen with an optional category filter 
+file. The full list of files to convert is built once and then spread 
+across a process pool (one worker per CPU by default). MAT files 
+that are already newer than their OFF source are skipped, so 
+re-running after an interruption only converts what is missing.
+
+With the 'pack' output format, each split is instead written to a 
+single packed mesh store file (train.meshpack / test.meshpack) in 
+the output directory.
+
+The work itself is done by off_to_mat_converter.convert_directory_tree, 
+which the voxel_pipeline command line ('voxel_pipeline convert') 
+calls as well.
+"""
+
+
+import os
+import dataset_index
+import off_to_mat_converter
+
+
+# Default path if user input is invalid
+default_input_path = 'ModelNet40/ModelNet40_off'
+default_output_path = 'ModelNet40/ModelNet40_Mat'
+default_output_format = 'mat'
+
+
+
+def main():
+    # Ask the user to input the directory paths
+    input_path = input(f"Please enter the directory path containing OFF data (Default Path is '{default_input_path}'): ")
+    out_path = input(f"Please enter the output directory path containing MAT data (Default Path is '{default_output_path}'): ")
+    output_format = input(f"Please enter the output format, 'mat' or 'pack' (Default format is '{default_output_format}'): ").strip().lower()
+    filter_path = input("Please enter a category filter file, a JSON file with 'include' and/or 'exclude' category lists (Default converts every category): ").strip()
+
+    # Validate the user inputs
+    if not os.path.isdir(input_path):
+        print(f"Invalid input directory: {input_path}. Using default input path: {default_input_path}")
+        input_path = default_input_path
+        
+    if not os.path.isdir(out_path):
+        print(f"Invalid output directory: {out_path}. Using default output path: {default_output_path}")
+        out_path = default_output_path    
+
+    if output_format not in off_to_mat_converter.OUTPUT_FORMATS:
+        print(f"Invalid output format. Using default output format '{default_output_format}'.")
+        output_format = default_output_format
+
+    category_filter = None
+    if filter_path:
+        try:
+            category_filter = dataset_index.CategoryFilter.from_file(filter_path)
+        except (OSError, ValueError) as e:
+            print(f"Invalid category filter file: {e}. Converting every category.")
+
+    off_to_mat_converter.convert_directory_tree(input_path, out_path, output_format, category_filter=category_filter)
+    print("End of Program")                
+
+
+# The guard keeps worker processes from re-running the prompts
+if __name__ == '__main__':
+    main()
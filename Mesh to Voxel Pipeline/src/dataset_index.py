@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+@author: ken
+"""
+
+
+"""
+This module keeps an index of a ModelNet style dataset tree
+(category/train, category/test) of OFF or MAT files, so that the
+conversion and voxelization steps do not list the whole tree on
+every run.
+
+The index records the category, split, name, size and mtime of
+every mesh file. It is stored as a JSON file (by default
+.dataset_index.json in the dataset root) and refreshed
+incrementally: the root is listed with os.scandir, and a split
+directory is only listed again if its mtime has changed, which
+happens whenever a file in it is added, removed or renamed.
+Unchanged directories cost a single stat. Files edited in place do
+not change their directory's mtime; refresh(full=True) rescans
+everything.
+
+CategoryFilter selects categories by include and exclude lists of
+shell-style patterns (e.g. 'chair', 'night_*'), given as options or
+read from a JSON file such as
+
+    {"include": ["chair", "sofa", "table"], "exclude": []}
+"""
+
+
+import fnmatch
+import json
+import os
+import tempfile
+
+
+# Bumped whenever the index file layout changes
+INDEX_VERSION = 1
+INDEX_FILE_NAME = '.dataset_index.json'
+SPLIT_DIRS = ('train', 'test')
+MESH_EXTENSIONS = ('.off', '.mat')
+
+
+
+"""
+This class selects categories by name. A category is selected if it
+matches one of the include patterns (or there are none) and none of
+the exclude patterns.
+"""
+class CategoryFilter:
+
+    def __init__(self, include=None, exclude=()):
+        self.include = list(include) if include else None
+        self.exclude = list(exclude or ())
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path) as f:
+            config = json.load(f)
+        unknown = set(config) - {'include', 'exclude'}
+        if unknown:
+            raise ValueError(f"Unknown keys in category filter {path}: {', '.join(sorted(unknown))}")
+        return cls(config.get('include'), config.get('exclude'))
+
+    @classmethod
+    def from_options(cls, include=None, exclude=None, path=None):
+        # Patterns given as options are added to the ones in the file
+        category_filter = cls.from_file(path) if path else cls()
+        if include:
+            category_filter.include = (category_filter.include or []) + list(include)
+        if exclude:
+            category_filter.exclude += list(exclude)
+        return category_filter
+
+    def matches(self, category):
+        if self.include is not None and not any(fnmatch.fnmatchcase(category, p) for p in self.include):
+            return False
+        return not any(fnmatch.fnmatchcase(category, p) for p in self.exclude)
+
+    def to_dict(self):
+        return {'include': self.include, 'exclude': self.exclude}
+
+
+
+"""
+This class is the dataset index of one tree. It is loaded from the
+index file (if present and written for the same tree) and refreshed
+when created; pass index_path=False to keep it in memory only, or
+read_only=True to use the index file without writing it back.
+"""
+class DatasetIndex:
+
+    def __init__(self, root, index_path=None, full=False, read_only=False):
+        self.root = root
+        self.index_path = os.path.join(root, INDEX_FILE_NAME) if index_path is None else index_path
+        self.read_only = read_only
+        self.categories_data = {}
+        self.scanned = 0
+        self.reused = 0
+        if self.index_path and not full:
+            self.load()
+        self.refresh(full)
+
+    def load(self):
+        try:
+            with open(self.index_path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version') == INDEX_VERSION and data.get('root') == os.path.abspath(self.root):
+            self.categories_data = data['categories']
+
+    def save(self):
+        data = {'version': INDEX_VERSION, 'root': os.path.abspath(self.root), 'categories': self.categories_data}
+        directory = os.path.dirname(os.path.abspath(self.index_path))
+        # Write to a temporary file first so an interrupted save never
+        # leaves a truncated index
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            print(f"Could not save the dataset index {self.index_path}: {e}")
+
+    def refresh(self, full=False):
+        categories = {}
+        changed = False
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.name.startswith('.') or not entry.is_dir():
+                    continue
+                old_splits = {} if full else self.categories_data.get(entry.name, {})
+                splits = {}
+                for split in SPLIT_DIRS:
+                    split_path = os.path.join(entry.path, split)
+                    try:
+                        mtime = os.stat(split_path).st_mtime_ns
+                    except OSError:
+                        continue
+                    old_split = old_splits.get(split)
+                    if old_split is not None and old_split['mtime'] == mtime:
+                        splits[split] = old_split
+                        self.reused += 1
+                    else:
+                        splits[split] = {'mtime': mtime, 'files': scan_split(split_path)}
+                        self.scanned += 1
+                        changed = True
+                categories[entry.name] = splits
+        changed = changed or set(categories) != set(self.categories_data)
+        self.categories_data = categories
+        if changed and self.index_path and not self.read_only:
+            self.save()
+
+    def categories(self, category_filter=None):
+        return [category for category in sorted(self.categories_data)
+                if category_filter is None or category_filter.matches(category)]
+
+    def files(self, category, split, extension=None):
+        split_data = self.categories_data.get(category, {}).get(split)
+        if split_data is None:
+            return []
+        return [(os.path.join(self.root, category, split, name), size, mtime)
+                for name, size, mtime in split_data['files']
+                if extension is None or name.endswith(extension)]
+
+    def paths(self, category, split, extension=None):
+        return [path for path, _, _ in self.files(category, split, extension)]
+
+    def __len__(self):
+        return sum(len(split_data['files']) for splits in self.categories_data.values() for split_data in splits.values())
+
+    def report(self):
+        print(f"Dataset index {self.index_path or '(in memory)'}: {len(self.categories_data)} categories, "
+              f"{len(self)} files, {self.scanned} directories scanned, {self.reused} reused")
+
+
+
+"""
+This function lists the mesh files of one split directory as
+sorted [name, size, mtime] entries. Hidden files are skipped.
+"""
+def scan_split(split_path):
+    files = []
+    with os.scandir(split_path) as entries:
+        for entry in entries:
+            if entry.name.endswith(MESH_EXTENSIONS) and not entry.name.startswith('.') and entry.is_file():
+                stat = entry.stat()
+                files.append([entry.name, stat.st_size, stat.st_mtime_ns])
+    files.sort()
+    return files
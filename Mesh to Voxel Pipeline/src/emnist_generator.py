@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+@author: ken
+"""
+
+
+"""
+This module generates EMNIST targets on demand, without building or
+storing a dataset.
+
+Every target is a pure function of its source image and a few random
+draws (extrusion start, length and axis). TargetGenerator makes
+those draws with a counter-based generator: each draw is a SplitMix64
+hash of the seed and of a counter made from the sample index and the
+draw slot, so sample i is the same whichever samples were generated
+before it, in any order, on any process. get(i) builds one target
+and get_batch(indices) builds any batch with the vectorized
+extrusion of emnist_targets, so a training job can stream fresh
+targets at a memory cost of one batch, and any sample it saw can be
+rebuilt from (seed, i).
+
+With n_samples set, the generator follows the rules of the target
+scripts for a dataset of that size: simple sample i extrudes image i
+along the axis of its third of the samples, and complex sample i
+combines simple samples i and i + n_samples // 2. Without it the
+stream is unlimited: each simple sample draws its image and axis as
+well, and complex sample i combines simple samples 2i and 2i + 1.
+
+The draws are not those of the numpy Generator used by
+create_simple_targets and create_complex_targets, so the same seed
+gives different (but identically distributed) targets.
+"""
+
+
+import numpy as np
+
+import emnist_targets
+
+
+MASK64 = 2 ** 64 - 1
+GAMMA = 0x9E3779B97F4A7C15
+# Draw slots of a simple sample: start, length, axis and image
+DRAW_SLOTS = 4
+START_SLOT, LENGTH_SLOT, AXIS_SLOT, IMAGE_SLOT = range(DRAW_SLOTS)
+
+
+
+"""
+This function applies the SplitMix64 finalizer to an array of
+uint64 values (wrapping arithmetic), or to a Python int.
+"""
+def splitmix64(z):
+    if isinstance(z, int):
+        z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9 & MASK64
+        z = (z ^ (z >> 27)) * 0x94D049BB133111EB & MASK64
+        return z ^ (z >> 31)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+
+"""
+This function returns one uniform integer from low to high
+(inclusive) per index: draw slot of the counter-based stream keyed
+by seed.
+"""
+def counter_integers(seed, indices, slot, low, high):
+    key = splitmix64(seed & MASK64)
+    counters = np.asarray(indices, dtype=np.uint64) * np.uint64(DRAW_SLOTS) + np.uint64(slot)
+    z = splitmix64(counters * np.uint64(GAMMA) + np.uint64(key))
+    # The top 53 bits as a float in [0, 1)
+    uniform = (z >> np.uint64(11)).astype(np.float64) * 2.0 ** -53
+    return low + (uniform * (high - low + 1)).astype(np.int64)
+
+
+
+"""
+This class generates simple (extrusion) or complex (mashup) EMNIST
+targets of box_size^3 uint8 voxels from an array of 2D images, by
+sample index. images may be a memory-mapped array; only the images
+of the requested samples are read. seed=None picks a random seed,
+kept in the seed attribute so the stream can be reproduced.
+"""
+class TargetGenerator:
+
+    def __init__(self, images, box_size=emnist_targets.DEFAULT_BOX_SIZE, seed=None, mashup=False, n_samples=None):
+        self.images = images
+        self.box_size = box_size
+        self.seed = int(np.random.SeedSequence().entropy) & MASK64 if seed is None else int(seed)
+        self.mashup = mashup
+        self.n_samples = n_samples
+        if n_samples is not None and n_samples > len(images):
+            raise ValueError(f"Only {len(images)} images for {n_samples} samples")
+
+    def __len__(self):
+        if self.n_samples is None:
+            raise TypeError("An unlimited target generator has no length")
+        return int(self.n_samples / 2) if self.mashup else self.n_samples
+
+    def simple_plan(self, indices):
+        # The extrusion of each simple sample: starts, ends, axes and images
+        starts = counter_integers(self.seed, indices, START_SLOT, 0, self.box_size - 3)
+        lengths = counter_integers(self.seed, indices, LENGTH_SLOT, emnist_targets.MIN_LENGTH,
+                                     emnist_targets.MAX_LENGTH)
+        if self.n_samples is None:
+            axes = counter_integers(self.seed, indices, AXIS_SLOT, 0, 2)
+            image_indices = counter_integers(self.seed, indices, IMAGE_SLOT, 0, len(self.images) - 1)
+        else:
+            axes = emnist_targets.extrusion_axes(self.n_samples, indices)
+            image_indices = indices
+        return starts, np.minimum(starts + lengths, self.box_size), axes, image_indices
+
+    def simple_batch(self, indices):
+        starts, ends, axes, image_indices = self.simple_plan(indices)
+        # Memory-mapped images are read fastest in sorted order
+        order = np.argsort(image_indices, kind='stable')
+        images = np.empty((len(indices),) + self.images.shape[1:], dtype=self.images.dtype)
+        images[order] = self.images[image_indices[order]]
+        return emnist_targets.extrude_batch(images, starts, ends, axes, self.box_size)
+
+    def get_batch(self, indices):
+        indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+        if len(indices) and indices.min() < 0:
+            raise IndexError(f"Negative sample index {indices.min()}")
+        if len(indices) and self.n_samples is not None and indices.max() >= len(self):
+            raise IndexError(f"Sample index {indices.max()} out of range for {len(self)} samples")
+        if not self.mashup:
+            return self.simple_batch(indices)
+        if self.n_samples is None:
+            first, second = 2 * indices, 2 * indices + 1
+        else:
+            first, second = indices, indices + int(self.n_samples / 2)
+        return emnist_targets.mashup_pair(self.simple_batch(first), self.simple_batch(second))
+
+    def get(self, index):
+        return self.get_batch([index])[0]
+
+    def batches(self, batch_size=emnist_targets.EXTRUDE_BATCH, start=0, stop=None):
+        # Consecutive batches from start to stop (or len(self)), without
+        # end for an unlimited generator
+        if stop is None and self.n_samples is not None:
+            stop = len(self)
+        first = start
+        while stop is None or first < stop:
+            last = first + batch_size if stop is None else min(first + batch_size, stop)
+            yield self.get_batch(np.arange(first, last))
+            first = last
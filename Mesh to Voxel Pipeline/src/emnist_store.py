@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+@author: ken
+"""
+
+
+"""
+This module stores the EMNIST targets of emnist_targets on disk and
+memory-maps them back.
+
+A target set is a directory holding one .npy file per array (e.g.
+x_train3d.npy and x_test3d.npy) and a targets.json manifest with the
+box size, the layout and the sample count of every array. Two layouts are
+supported, as in voxel_hdf5:
+
+    dense   (n_samples, size, size, size) uint8, 0 or 255 per voxel
+            (the MNIST intensity for simple targets)
+    packed  (n_samples, size, size, ceil(size / 8)) uint8, the
+            occupancy bits of each sample packed along the last
+            axis
+
+TargetWriter writes the .npy header of each array and then the
+targets, a batch at a time, with plain file writes, so memory use is
+bounded by the batch size and not by the number of samples (pages
+written through a writable memory map would stay resident). Every
+file is written under a temporary name and renamed when complete.
+
+load_targets memory-maps a finished set. TargetArray indexes one
+array like a numpy array: dense samples come back as views into the
+map without copying, packed samples are unpacked, and with
+as_float=True the samples are returned as float32 model input of
+shape (..., size, size, size, 1) scaled to [0, 1], the layout of the
+former pickle files.
+"""
+
+
+import json
+import os
+import numpy as np
+
+from voxel_hdf5 import pack_voxels, unpack_voxels
+
+
+MANIFEST = 'targets.json'
+VERSION = 1
+
+
+
+"""
+This class writes a target set. Each array is declared with
+create(name, n_samples) and then filled with write(name, start,
+targets) in batches of dense uint8 targets, which are packed on the
+way in for a packed set. close() (or leaving the writer as a context
+manager) checks that every array was filled, renames the files into
+place and writes the manifest last.
+"""
+class TargetWriter:
+
+    def __init__(self, path, box_size, packed=False, **metadata):
+        self.path = path
+        self.box_size = box_size
+        self.packed = packed
+        self.metadata = metadata
+        self.files = {}
+        self.header_bytes = {}
+        self.n_samples = {}
+        self.written = {}
+        os.makedirs(path, exist_ok=True)
+        # An existing manifest would describe the files being replaced
+        if os.path.exists(os.path.join(path, MANIFEST)):
+            os.remove(os.path.join(path, MANIFEST))
+
+    def sample_shape(self):
+        last = (self.box_size + 7) // 8 if self.packed else self.box_size
+        return (self.box_size, self.box_size, last)
+
+    def create(self, name, n_samples):
+        shape = (n_samples,) + self.sample_shape()
+        f = open(os.path.join(self.path, name + '.npy.tmp'), 'wb')
+        np.lib.format.write_array_header_1_0(f, {'descr': np.dtype(np.uint8).str, 'fortran_order': False,
+                                                 'shape': shape})
+        self.files[name] = f
+        self.header_bytes[name] = f.tell()
+        self.n_samples[name] = n_samples
+        self.written[name] = 0
+        f.truncate(f.tell() + int(np.prod(shape)))
+
+    def write(self, name, start, targets):
+        data = np.ascontiguousarray(pack_voxels(targets) if self.packed else targets, dtype=np.uint8)
+        if data.shape[1:] != self.sample_shape() or start + len(data) > self.n_samples[name]:
+            raise ValueError(f"Cannot write {data.shape} at {start} into {name} of "
+                             f"{(self.n_samples[name],) + self.sample_shape()}")
+        f = self.files[name]
+        f.seek(self.header_bytes[name] + start * data[0].nbytes)
+        f.write(data.tobytes())
+        self.written[name] += len(data)
+
+    def close(self):
+        manifest = {'version': VERSION, 'box_size': self.box_size, 'packed': self.packed, 'arrays': {},
+                    **self.metadata}
+        for name, n_samples in self.n_samples.items():
+            if self.written[name] != n_samples:
+                self.discard()
+                raise ValueError(f"Only {self.written[name]} of {n_samples} samples of {name} were written")
+        for name in list(self.files):
+            f = self.files.pop(name)
+            f.close()
+            os.replace(f.name, os.path.join(self.path, name + '.npy'))
+            manifest['arrays'][name] = {'file': name + '.npy', 'n_samples': self.n_samples[name]}
+        with open(os.path.join(self.path, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=1)
+
+    def discard(self):
+        for name in list(self.files):
+            f = self.files.pop(name)
+            f.close()
+            os.remove(f.name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+
+"""
+This class gives array-style access to one memory-mapped target
+array. data is the stored array itself (dense or packed); indexing
+returns dense uint8 targets, or float32 model input with
+as_float=True.
+"""
+class TargetArray:
+
+    def __init__(self, data, box_size, packed=False, as_float=False):
+        self.data = data
+        self.box_size = box_size
+        self.packed = packed
+        self.as_float = as_float
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def shape(self):
+        shape = (len(self.data), self.box_size, self.box_size, self.box_size)
+        return shape + (1,) if self.as_float else shape
+
+    def __getitem__(self, index):
+        targets = self.data[index]
+        if self.packed:
+            targets = unpack_voxels(targets, self.box_size).view(np.uint8) * np.uint8(255)
+        if self.as_float:
+            return np.expand_dims(targets, -1).astype(np.float32) / 255
+        return targets
+
+    def __array__(self, dtype=None, copy=None):
+        targets = self[:]
+        return targets if dtype is None else targets.astype(dtype)
+
+
+
+"""
+This function reads the manifest of a target set.
+"""
+def read_manifest(path):
+    manifest_path = os.path.join(path, MANIFEST)
+    if not os.path.exists(manifest_path):
+        raise ValueError(f"Not a complete target set (no {MANIFEST}): {path}")
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get('version') != VERSION:
+        raise ValueError(f"Not a version {VERSION} target set: {path}")
+    return manifest
+
+
+
+"""
+This function memory-maps a target set and returns a TargetArray
+per stored array, by name, e.g.
+
+    targets = load_targets('simple3DEmnistExtrusionTargets')
+    x_train3d = targets['x_train3d']                # uint8 views
+    x_train3d = load_targets(path, as_float=True)['x_train3d']
+    batch = x_train3d[0:32]                         # float32 (32, 28, 28, 28, 1)
+"""
+def load_targets(path, as_float=False):
+    manifest = read_manifest(path)
+    return {name: TargetArray(np.load(os.path.join(path, spec['file']), mmap_mode='r'), manifest['box_size'],
+                              manifest['packed'], as_float)
+            for name, spec in manifest['arrays'].items()}
@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+"""
+@author: ken
+"""
+
+
+"""
+This module creates the 3D EMNIST targets from the 2D MNIST (or
+EMNIST) images.
+
+Simple targets extrude each 2D image in one of the three dimensions
+over a random start and length: the first third of the samples
+along the first axis, the second third along the second axis and
+the last third along the third axis. The starts, lengths and axes
+of all samples are drawn as arrays from a numpy Generator, and the
+targets are built a batch at a time from broadcast masks of their
+extruded slices, so no Python loop runs per sample or per slice.
+
+Complex (mashup) targets combine k simple targets (by default the
+first half of the simple targets with the second half, so the two
+extrusions usually run along different axes) with a boolean OR: any
+non-zero voxel is set to 255. The groups can also be drawn at random
+or across the three axes, and each simple target can be translated
+by a random offset first; see mashup_groups and shift_targets.
+
+The targets are written a batch at a time into memory-mapped uint8
+(or bit-packed) .npy files of a target set directory, so memory use
+does not grow with the number of samples; for complex targets the
+simple targets are never stored at all. emnist_store.load_targets
+maps a target set back, with an optional float32 view in the
+(n, box_size, box_size, box_size, 1) model input layout.
+
+The images are read from local IDX files by idx_dataset, with numpy
+only. Previews are PNG contact sheets rendered headless by
+voxel_preview. The scripts in 'EMNIST Mashup' and the voxel_pipeline
+command line ('voxel_pipeline emnist-simple', 'voxel_pipeline
+emnist-complex') both call create_simple_targets and
+create_complex_targets.
+"""
+
+
+import numpy as np
+
+
+DEFAULT_TRAIN_SIZE = 27000
+DEFAULT_TEST_SIZE = 3000
+DEFAULT_BOX_SIZE = 28
+SIMPLE_TARGETS_DIR = 'simple3DEmnistExtrusionTargets'
+COMPLEX_TARGETS_DIR = 'complex3DMashupTargets'
+# Extrusion lengths are drawn from MIN_LENGTH to MAX_LENGTH inclusive
+MIN_LENGTH = 3
+MAX_LENGTH = 8
+# Number of targets built at once
+EXTRUDE_BATCH = 1024
+# Ways of choosing the simple targets combined by a mashup
+PAIRINGS = ('halves', 'random', 'cross-axis')
+
+
+
+"""
+This function loads the train and test images of an MNIST or EMNIST
+dataset from its IDX files in data_dir (see idx_dataset; by default
+$EMNIST_DATA_DIR or ./emnist_data). Uncompressed files are
+memory-mapped, so only the images used are read.
+"""
+def load_images(data_dir=None, dataset='mnist'):
+    import idx_dataset
+    (x_train, _), (x_test, _) = idx_dataset.load_dataset(data_dir, dataset)
+    return x_train, x_test
+
+
+
+"""
+This function returns the extrusion axis of each of n_samples
+samples: 0 for the first third, 1 for the second third and 2 for
+the rest. With indices, only the axes of those samples are
+returned.
+"""
+def extrusion_axes(n_samples, indices=None):
+    size_third = int(n_samples / 3)
+    if indices is None:
+        indices = np.arange(n_samples)
+    return np.searchsorted([size_third, 2 * size_third], indices, side='right')
+
+
+
+"""
+This function draws the random extrusion starts and lengths of
+n_samples samples: starts uniform from 0 to box_size - 3 and
+lengths uniform from MIN_LENGTH to MAX_LENGTH, the same rule as
+the original per-sample random.randint calls. It returns the
+starts and the ends, clipped to the box.
+"""
+def draw_extrusions(n_samples, box_size, rng):
+    starts = rng.integers(0, box_size - 3, size=n_samples, endpoint=True)
+    lengths = rng.integers(MIN_LENGTH, MAX_LENGTH, size=n_samples, endpoint=True)
+    return starts, np.minimum(starts + lengths, box_size)
+
+
+
+"""
+This function draws the extrusions of n_samples samples and returns
+them as an extrusion plan (starts, ends, axes), a few integers per
+sample, from which any of the targets can be built later.
+"""
+def extrusion_plan(n_samples, box_size, rng):
+    starts, ends = draw_extrusions(n_samples, box_size, rng)
+    return starts, ends, extrusion_axes(n_samples)
+
+
+
+"""
+This function extrudes a batch of 2D images of box_size x box_size
+pixels into 3D objects: image k is repeated over the slices
+starts[k] to ends[k] (exclusive) along axes[k]. The slice masks of
+all samples are one broadcast comparison against the slice indices;
+the (sample, slice) pairs they select are then written with one
+scatter per axis, so only the extruded slices are touched. The
+result has the images' dtype, and is written into out if given.
+"""
+def extrude_batch(images, starts, ends, axes, box_size, out=None):
+    images = np.asarray(images)
+    if images.shape[1:] != (box_size, box_size):
+        raise ValueError(f"Images of shape {images.shape[1:]} cannot be extruded into a box of size {box_size}")
+    if out is None:
+        out = np.zeros((len(images), box_size, box_size, box_size), dtype=images.dtype)
+    else:
+        out[...] = 0
+    slices = np.arange(box_size)
+    masks = (slices >= starts[:, None]) & (slices < ends[:, None])
+    samples, extruded = np.nonzero(masks)
+    sample_axes = axes[samples]
+    for axis in range(3):
+        group = sample_axes == axis
+        if not group.any():
+            continue
+        index = [samples[group], slice(None), slice(None)]
+        index.insert(axis + 1, extruded[group])
+        out[tuple(index)] = images[samples[group]]
+    return out
+
+
+
+"""
+This function builds the simple targets of the samples selected by
+index (a slice or an index array) of an extrusion plan.
+"""
+def extrude_samples(images, plan, index, box_size, out=None):
+    starts, ends, axes = plan
+    return extrude_batch(images[index], starts[index], ends[index], axes[index], box_size, out)
+
+
+
+"""
+This function extrudes the first n_samples 2D images into 3D
+objects of box_size^3 voxels, with the images' dtype (uint8 for
+MNIST). Each image is repeated over a random start and a random
+length from 3 to 8 along the first, second or third axis, for the
+first, second and last third of the samples. The random draws come
+from rng (a numpy Generator, or a seed), so a seeded rng always
+gives the same targets. The targets are built EXTRUDE_BATCH at a
+time.
+"""
+def extrude_targets(images, n_samples, box_size, rng=None):
+    rng = np.random.default_rng(rng)
+    check_image_count(images, n_samples)
+    plan = extrusion_plan(n_samples, box_size, rng)
+    targets = np.empty((n_samples, box_size, box_size, box_size), dtype=images.dtype)
+    # Batches keep the gathered image copies of the scatter small
+    for first in range(0, n_samples, EXTRUDE_BATCH):
+        batch = slice(first, first + EXTRUDE_BATCH)
+        extrude_samples(images, plan, batch, box_size, out=targets[batch])
+    return targets
+
+
+
+"""
+This function raises an error if there are fewer images than
+samples to build from them.
+"""
+def check_image_count(images, n_samples):
+    if len(images) < n_samples:
+        raise ValueError(f"Only {len(images)} images for {n_samples} samples")
+
+
+
+"""
+This function returns the simple sample indices combined into each
+complex target, as an (n_complex, k) array, for the pairing
+strategy:
+
+    halves      the samples are cut into k equal parts and complex
+                target i combines sample i of each part (for k=2,
+                sample i with sample i + n_samples // 2, the
+                original rule)
+    random      a random permutation of the samples, cut into
+                groups of k
+    cross-axis  every group combines samples extruded along
+                different axes (k <= 3): complex target i takes its
+                j-th sample from the (i + j) % 3 axis, drawn at
+                random without replacement
+
+Every simple sample is used at most once. axes are the extrusion
+axes of the simple samples.
+"""
+def mashup_groups(axes, k, pairing='halves', rng=None):
+    n_samples = len(axes)
+    if k < 2:
+        raise ValueError(f"A mashup combines at least 2 targets, not {k}")
+    if pairing == 'halves':
+        n_complex = n_samples // k
+        return np.arange(n_complex)[:, None] + n_complex * np.arange(k)
+    if pairing == 'random':
+        n_complex = n_samples // k
+        return rng.permutation(n_samples)[:n_complex * k].reshape(n_complex, k)
+    if pairing != 'cross-axis':
+        raise ValueError(f"Unknown pairing '{pairing}', expected one of {PAIRINGS}")
+    if k > 3:
+        raise ValueError(f"Cross-axis mashups combine at most 3 targets, not {k}")
+    group_axes = (np.arange(n_samples // k)[:, None] + np.arange(k)) % 3
+    pools = [rng.permutation(np.flatnonzero(axes == axis)) for axis in range(3)]
+    # Keep as many groups as every axis has samples for
+    used = np.stack([np.cumsum((group_axes == axis).sum(axis=1)) for axis in range(3)])
+    n_complex = int(np.sum(np.all(used <= np.array([len(pool) for pool in pools])[:, None], axis=0)))
+    group_axes = group_axes[:n_complex]
+    groups = np.empty((n_complex, k), dtype=np.int64)
+    for axis, pool in enumerate(pools):
+        selected = group_axes == axis
+        groups[selected] = pool[:np.count_nonzero(selected)]
+    return groups
+
+
+
+"""
+This function translates each target of a batch by its own offset
+(an (n, 3) integer array of voxels per axis). Voxels moved out of
+the box are dropped and the uncovered ones are 0. The batch is
+padded once by the largest offset, and every shifted target is then
+a window of its padded copy, all gathered with one fancy index.
+"""
+def shift_targets(targets, offsets):
+    box_size = targets.shape[1]
+    pad = int(np.abs(offsets).max()) if len(offsets) else 0
+    if pad == 0:
+        return targets
+    padded = np.zeros((len(targets),) + (box_size + 2 * pad,) * 3, dtype=targets.dtype)
+    padded[:, pad:-pad, pad:-pad, pad:-pad] = targets
+    windows = np.lib.stride_tricks.sliding_window_view(padded, (box_size,) * 3, axis=(1, 2, 3))
+    corners = pad - offsets
+    return windows[np.arange(len(targets)), corners[:, 0], corners[:, 1], corners[:, 2]]
+
+
+
+"""
+This function combines a sequence of k batches of targets into one
+batch of complex targets, with a boolean OR: a voxel becomes 255 if
+it is non-zero in any of them, and 0 otherwise. Packed target sets
+are combined dense as well and packed once by the TargetWriter,
+which is cheaper than packing every member.
+"""
+def mashup_batch(members):
+    combined = np.logical_or(members[0], members[1])
+    for member in members[2:]:
+        np.logical_or(combined, member, out=combined)
+    return combined.view(np.uint8) * np.uint8(255)
+
+
+
+"""
+This function combines two batches of simple targets.
+"""
+def mashup_pair(first, second):
+    return mashup_batch([first, second])
+
+
+
+"""
+This function combines the simple targets k at a time with the
+halves pairing: for k=2 the first half with the second half.
+"""
+def mashup_targets(targets, k=2):
+    groups = mashup_groups(np.zeros(len(targets)), k)
+    return mashup_batch([targets[groups[:, j]] for j in range(k)])
+
+
+
+"""
+This function extrudes the first n_samples images and writes the
+simple targets to the array name of a TargetWriter, EXTRUDE_BATCH
+at a time, so only one batch is ever held in memory. It returns the
+extrusion plan.
+"""
+def write_simple_targets(writer, name, images, n_samples, box_size, rng):
+    check_image_count(images, n_samples)
+    plan = extrusion_plan(n_samples, box_size, rng)
+    buffer = np.empty((min(n_samples, EXTRUDE_BATCH), box_size, box_size, box_size), dtype=np.uint8)
+    writer.create(name, n_samples)
+    for first in range(0, n_samples, EXTRUDE_BATCH):
+        batch = slice(first, min(first + EXTRUDE_BATCH, n_samples))
+        writer.write(name, first, extrude_samples(images, plan, batch, box_size, out=buffer[:batch.stop - first]))
+    return plan
+
+
+
+"""
+This function extrudes the first n_samples images and writes the
+complex targets combining them k at a time (see mashup_groups for
+the pairings) to the array name of a TargetWriter. With max_shift,
+every simple target is first translated by a random offset of up to
+max_shift voxels along each axis. Each batch of complex targets is
+built from its k batches of simple targets, so the simple targets
+are never stored. It returns the extrusion plan of the simple
+targets.
+"""
+def write_complex_targets(writer, name, images, n_samples, box_size, rng, k=2, pairing='halves', max_shift=0):
+    check_image_count(images, n_samples)
+    plan = extrusion_plan(n_samples, box_size, rng)
+    groups = mashup_groups(plan[2], k, pairing, rng)
+    n_complex = len(groups)
+    offsets = rng.integers(-max_shift, max_shift, size=(n_complex, k, 3), endpoint=True) if max_shift else None
+    shape = (min(n_complex, EXTRUDE_BATCH), box_size, box_size, box_size)
+    buffers = [np.empty(shape, dtype=np.uint8) for _ in range(k)]
+    writer.create(name, n_complex)
+    for first in range(0, n_complex, EXTRUDE_BATCH):
+        batch = slice(first, min(first + EXTRUDE_BATCH, n_complex))
+        count = batch.stop - first
+        members = [extrude_samples(images, plan, groups[batch, j], box_size, out=buffers[j][:count])
+                   for j in range(k)]
+        if offsets is not None:
+            members = [shift_targets(member, offsets[batch, j]) for j, member in enumerate(members)]
+        writer.write(name, first, mashup_batch(members))
+    return plan
+
+
+
+"""
+This function creates the simple extrusion targets from the images
+of dataset in data_dir and writes them to the target set output (a
+directory, see emnist_store), packed if packed=True. With preview
+set to a PNG path, a contact sheet of some of the train targets is
+rendered there (see voxel_preview).
+"""
+def create_simple_targets(train_size=DEFAULT_TRAIN_SIZE, test_size=DEFAULT_TEST_SIZE, box_size=DEFAULT_BOX_SIZE,
+                          output=SIMPLE_TARGETS_DIR, seed=None, packed=False, data_dir=None, dataset='mnist',
+                          preview=None, preview_mode='mip'):
+    from emnist_store import TargetWriter
+
+    rng = np.random.default_rng(seed)
+    x_train, x_test = load_images(data_dir, dataset)
+
+    with TargetWriter(output, box_size, packed, kind='simple', seed=seed) as writer:
+        write_simple_targets(writer, 'x_train3d', x_train, train_size, box_size, rng)
+        write_simple_targets(writer, 'x_test3d', x_test, test_size, box_size, rng)
+    print(f"Saved {train_size} train and {test_size} test simple targets to {output}")
+
+    if preview:
+        import voxel_preview
+        voxel_preview.preview_targets(output, preview, 'x_train3d', mode=preview_mode)
+
+
+
+"""
+This function creates the simple extrusion targets, combines them k
+at a time into complex mashup targets (see write_complex_targets)
+and writes those to the target set output, packed if packed=True.
+With preview set to a PNG path, a contact sheet of some of the train
+targets is rendered there.
+"""
+def create_complex_targets(train_size=DEFAULT_TRAIN_SIZE, test_size=DEFAULT_TEST_SIZE, box_size=DEFAULT_BOX_SIZE,
+                           output=COMPLEX_TARGETS_DIR, seed=None, packed=False, k=2, pairing='halves', max_shift=0,
+                           data_dir=None, dataset='mnist', preview=None, preview_mode='mip'):
+    from emnist_store import TargetWriter, load_targets
+
+    rng = np.random.default_rng(seed)
+    x_train, x_test = load_images(data_dir, dataset)
+
+    options = {'k': k, 'pairing': pairing, 'max_shift': max_shift}
+    with TargetWriter(output, box_size, packed, kind='complex', seed=seed, **options) as writer:
+        write_complex_targets(writer, 'x_train3dcomplex', x_train, train_size, box_size, rng, **options)
+        write_complex_targets(writer, 'x_test3dcomplex', x_test, test_size, box_size, rng, **options)
+    targets = load_targets(output)
+    n_train, n_test = len(targets['x_train3dcomplex']), len(targets['x_test3dcomplex'])
+    print(f"Saved {n_train} train and {n_test} test complex targets to {output}")
+
+    if preview:
+        import voxel_preview
+        voxel_preview.preview_targets(output, preview, 'x_train3dcomplex', mode=preview_mode)
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+@author: ken
+"""
+
+
+"""
+This module reads the MNIST and EMNIST datasets from their IDX files
+in a local directory, with numpy only.
+
+An IDX file is a 4 byte magic number (two zero bytes, a dtype code
+and the number of dimensions), one big-endian uint32 per dimension
+and the array data in C order. The files can be kept as downloaded
+(gzipped, '.gz') or uncompressed. Uncompressed files are
+memory-mapped, so opening them reads only the header and the images
+are paged in when used; gzipped files are decompressed once into a
+read-only array.
+
+Datasets and their file names (train and t10k / test, images and
+labels):
+
+    mnist       train-images-idx3-ubyte, t10k-labels-idx1-ubyte, ...
+                (the original MNIST digits)
+    letters, balanced, byclass, bymerge, digits
+                emnist-<name>-train-images-idx3-ubyte, ...
+                (the EMNIST splits)
+
+EMNIST stores every image transposed; load_dataset returns the
+EMNIST images as transposed views, so they are upright like MNIST
+without copying.
+"""
+
+
+import gzip
+import os
+import struct
+import numpy as np
+
+
+DATASETS = ('mnist', 'letters', 'balanced', 'byclass', 'bymerge', 'digits')
+# Directory searched when none is given
+DEFAULT_DATA_DIR = os.environ.get('EMNIST_DATA_DIR', 'emnist_data')
+# IDX dtype codes
+IDX_DTYPES = {0x08: '>u1', 0x09: '>i1', 0x0B: '>i2', 0x0C: '>i4', 0x0D: '>f4', 0x0E: '>f8'}
+
+
+
+"""
+This function reads the header of an open IDX file and returns the
+dtype and the shape of its array.
+"""
+def read_header(f, path):
+    magic = f.read(4)
+    if len(magic) != 4 or magic[:2] != b'\0\0' or magic[2] not in IDX_DTYPES:
+        raise ValueError(f"Not an IDX file: {path}")
+    ndim = magic[3]
+    shape = struct.unpack('>' + 'I' * ndim, f.read(4 * ndim))
+    return np.dtype(IDX_DTYPES[magic[2]]), shape
+
+
+
+"""
+This function returns the shape of the array of an IDX file, from
+its header only.
+"""
+def idx_shape(path):
+    with (gzip.open if path.endswith('.gz') else open)(path, 'rb') as f:
+        return read_header(f, path)[1]
+
+
+
+"""
+This function reads the array of an IDX file: memory-mapped
+(read-only) for an uncompressed file, decompressed into memory for
+a gzipped one.
+"""
+def read_idx(path):
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rb') as f:
+            dtype, shape = read_header(f, path)
+            data = f.read()
+        if len(data) != int(np.prod(shape)) * dtype.itemsize:
+            raise ValueError(f"Truncated IDX file: {path}")
+        return np.frombuffer(data, dtype=dtype).reshape(shape)
+    with open(path, 'rb') as f:
+        dtype, shape = read_header(f, path)
+        offset = f.tell()
+    if os.path.getsize(path) != offset + int(np.prod(shape)) * dtype.itemsize:
+        raise ValueError(f"Truncated IDX file: {path}")
+    if int(np.prod(shape)) == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+
+
+"""
+This function writes an array as an IDX file, gzipped if the path
+ends with '.gz'.
+"""
+def write_idx(path, array):
+    array = np.asarray(array)
+    codes = {np.dtype(dtype).newbyteorder('>'): code for code, dtype in IDX_DTYPES.items()}
+    dtype = array.dtype.newbyteorder('>')
+    if dtype not in codes:
+        raise ValueError(f"IDX files cannot hold {array.dtype} arrays")
+    header = b'\0\0' + bytes([codes[dtype], array.ndim]) + struct.pack('>' + 'I' * array.ndim, *array.shape)
+    with (gzip.open if path.endswith('.gz') else open)(path, 'wb') as f:
+        f.write(header + np.ascontiguousarray(array, dtype=dtype).tobytes())
+
+
+
+"""
+This function returns the path of one IDX file of a dataset (split
+'train' or 'test', kind 'images' or 'labels') in a directory,
+uncompressed or gzipped, and with the '-idx' or '.idx' spelling of
+the mirrors.
+"""
+def idx_path(directory, dataset, split, kind):
+    if dataset not in DATASETS:
+        raise ValueError(f"Unknown dataset '{dataset}', expected one of {DATASETS}")
+    prefix = {'train': 'train', 'test': 't10k'}[split] if dataset == 'mnist' else f"emnist-{dataset}-{split}"
+    ndim = 3 if kind == 'images' else 1
+    candidates = [f"{prefix}-{kind}{sep}idx{ndim}-ubyte{ext}" for sep in ('-', '.') for ext in ('', '.gz')]
+    for name in candidates:
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"No {dataset} {split} {kind} file ({candidates[0]} or {candidates[1]}) in {directory}")
+
+
+
+"""
+This function loads a dataset from its IDX files in directory and
+returns (x_train, y_train), (x_test, y_test) like
+tf.keras.datasets.mnist.load_data(): uint8 images of shape
+(n, 28, 28) and uint8 labels. Uncompressed files are memory-mapped
+and the images are views into the maps.
+"""
+def load_dataset(directory=None, dataset='mnist'):
+    directory = DEFAULT_DATA_DIR if directory is None else directory
+    splits = []
+    for split in ('train', 'test'):
+        images = read_idx(idx_path(directory, dataset, split, 'images'))
+        labels = read_idx(idx_path(directory, dataset, split, 'labels'))
+        if len(images) != len(labels):
+            raise ValueError(f"{len(images)} images but {len(labels)} labels in the {dataset} {split} files")
+        if dataset != 'mnist':
+            images = images.transpose(0, 2, 1)
+        splits.append((images, labels))
+    return tuple(splits)
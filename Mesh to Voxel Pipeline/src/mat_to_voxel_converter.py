@@ -13,6 +13,15 @@ voxels. It normalizes the vertices of the mesh, voxelizes the
 3D model, and resizes it to a specified voxel size. The final 
 voxel grid is optionally padded to fit a target shape.
 
+Two voxelization backends are available and selected by name in 
+convert_mat_to_voxel: 'trimesh' (the original mesh.voxelized path) 
+and 'numpy', a pure numpy surface rasterizer that samples all 
+triangles of a mesh in batched array operations and writes 
+directly into a voxel_size x voxel_size x voxel_size grid.
+
+Both backends produce surface shells. With fill=True the interior 
+of the shell is marked as well, giving solid occupancy grids.
+
 
 ### Note to Users:
 # 
@@ -35,10 +44,14 @@ voxel grid is optionally padded to fit a target shape.
 """
 
 
+import logging
+import time
 import numpy as np
 import scipy.io
-import trimesh
-import skimage.measure
+import scipy.ndimage
+
+# Messages go to the pipeline logger (see run_report)
+logger = logging.getLogger('voxel_pipeline')
 
 
 """
@@ -65,7 +78,6 @@ def normalize_vertices(vertices, voxel_size):
     max_bounds = np.max(vertices, axis=0)
     normalized_vertices = (vertices - min_bounds) / (max_bounds - min_bounds)
     scaled_vertices = normalized_vertices * (voxel_size - 1)
-    print(f"scaled_vertices: {scaled_vertices}")
     return scaled_vertices
 
 
@@ -74,9 +86,13 @@ def normalize_vertices(vertices, voxel_size):
 This function converts the 3D mesh, defined by the vertices 
 and faces, into a voxel grid using a specified voxel size.
 It downsamples or resizes the voxel grid to match the desired
-resolution if necessary.
+resolution if necessary. trimesh and scikit-image are imported
+here, so the numpy backend needs neither.
 """
 def mesh_to_voxel(vertices, faces, voxel_size):
+    import trimesh
+    import skimage.measure
+
     # Create a trimesh object
     mesh = trimesh.Trimesh(vertices=vertices, faces=faces)
     
@@ -105,27 +121,154 @@ def mesh_to_voxel(vertices, faces, voxel_size):
     
     return voxels
 
+# Largest distance, in voxels, between neighbouring surface samples
+# of the numpy backend
+SAMPLE_SPACING = 0.5
+
+"""
+This function is the numpy voxelization backend. Every triangle is 
+sampled on a barycentric lattice fine enough that neighbouring 
+samples are at most SAMPLE_SPACING voxels apart, and each sample 
+marks the voxel it falls in. Triangles needing the same lattice 
+are processed together as one array operation, in chunks of at 
+most max_points samples to bound memory. The vertices must already 
+be scaled to [0, voxel_size - 1] (see normalize_vertices), so the 
+result has exactly the shape (voxel_size, voxel_size, voxel_size).
+"""
+def mesh_to_voxel_numpy(vertices, faces, voxel_size, max_points=1 << 22):
+    triangles = np.asarray(vertices, dtype=np.float64)[np.asarray(faces, dtype=np.int64)]
+    origin = triangles[:, 0]
+    edge1 = triangles[:, 1] - origin
+    edge2 = triangles[:, 2] - origin
+    longest_edge = np.sqrt(np.max([np.einsum('ij,ij->i', e, e) for e in
+                                   (edge1, edge2, edge2 - edge1)], axis=0))
+    lattice_steps = np.maximum(1, np.ceil(longest_edge / SAMPLE_SPACING)).astype(np.int64)
+
+    voxels = np.zeros((voxel_size, voxel_size, voxel_size), dtype=bool)
+    for steps in np.unique(lattice_steps):
+        # Barycentric weights (u, w) with u + w <= 1 on a steps x steps lattice
+        u, w = np.meshgrid(np.arange(steps + 1), np.arange(steps + 1), indexing='ij')
+        inside = u + w <= steps
+        u = u[inside] / steps
+        w = w[inside] / steps
+
+        group = np.flatnonzero(lattice_steps == steps)
+        chunk = max(1, max_points // len(u))
+        for start in range(0, len(group), chunk):
+            tri = group[start:start + chunk]
+            points = (origin[tri, None, :]
+                      + u[None, :, None] * edge1[tri, None, :]
+                      + w[None, :, None] * edge2[tri, None, :])
+            index = np.clip(np.rint(points.reshape(-1, 3)), 0, voxel_size - 1).astype(np.intp)
+            voxels[index[:, 0], index[:, 1], index[:, 2]] = True
+
+    return voxels.astype(np.float32)
+
+
+
+# Voxelization backends selectable by name in convert_mat_to_voxel
+VOXELIZERS = {
+    'trimesh': mesh_to_voxel,
+    'numpy': mesh_to_voxel_numpy,
+}
+
+
+
 # File path to the .mat file
 #file_path = 'ModelNet10/Mat/chair/train/chair_0001.mat'
 
 # Load the vertices and faces
 #vertices, faces = load_mat_file(file_path)
 
+"""
+This function fills the interior of a surface voxel grid. The 
+exterior is flood filled from the grid border (6-connected, which 
+cannot leak through a 26-connected surface shell) and everything 
+it does not reach is marked as occupied. The flood fill runs as 
+whole-grid array operations in scipy.ndimage rather than a Python 
+loop over voxels.
+"""
+def fill_voxels(voxels):
+    return scipy.ndimage.binary_fill_holes(voxels > 0).astype(voxels.dtype)
+
+
+
+"""
+This function reduces a cubic voxel grid to voxel_size per side by 
+max pooling non-overlapping blocks, so a coarse voxel is occupied 
+if any of the fine voxels it covers is. The grid size must be a 
+multiple of voxel_size.
+"""
+def downsample_voxels(voxels, voxel_size):
+    factor = voxels.shape[0] // voxel_size
+    if factor * voxel_size != voxels.shape[0]:
+        raise ValueError(f"Grid size {voxels.shape[0]} is not a multiple of {voxel_size}")
+    if factor == 1:
+        return voxels
+    blocks = voxels.reshape(voxel_size, factor, voxel_size, factor, voxel_size, factor)
+    return blocks.max(axis=(1, 3, 5))
+
+
+
+"""
+This function builds a multi-resolution pyramid from a grid 
+voxelized at the largest requested size. Each smaller size is 
+max pooled from the previous (finer) level when it divides it, 
+otherwise from the full grid. Returns a dict of size -> grid.
+"""
+def voxel_pyramid(voxels, voxel_sizes):
+    pyramid = {}
+    level = voxels
+    for voxel_size in sorted(voxel_sizes, reverse=True):
+        source = level if level.shape[0] % voxel_size == 0 else voxels
+        level = downsample_voxels(source, voxel_size)
+        pyramid[voxel_size] = level
+    return pyramid
+
+
+
 """
 This function is the main function that handles user input for 
 the intended voxel size and defaults to 32 if the input is 
 invalid. It normalizes vertices, voxelizes the mesh, and then 
-pads the voxel grid to ensure it matches the target shape.
+pads the voxel grid to ensure it matches the target shape. The 
+backend argument names the voxelization backend in VOXELIZERS, 
+and fill=True also marks the voxels inside the mesh surface. If a 
+VoxelCache (see voxel_cache) is given, the result is looked up in 
+it first and stored in it after a miss. If a timings dict is given, 
+the wall-clock time of each stage (cache, normalize, voxelize, pad, 
+fill) is added to it, in seconds.
 """
-def convert_mat_to_voxel(vertices, faces, voxel_size):
+def convert_mat_to_voxel(vertices, faces, voxel_size, backend='trimesh', fill=False, cache=None, timings=None):
+    if backend not in VOXELIZERS:
+        raise ValueError(f"Unknown voxelization backend '{backend}', expected one of {sorted(VOXELIZERS)}")
+    timings = {} if timings is None else timings
+
+    if cache is not None:
+        start = time.perf_counter()
+        key = cache.key(vertices, faces, voxel_size, backend=backend, fill=fill)
+        found, voxels = cache.get(key, voxel_size)
+        timings['cache'] = timings.get('cache', 0.0) + time.perf_counter() - start
+        if not found:
+            voxels = convert_mat_to_voxel(vertices, faces, voxel_size, backend=backend, fill=fill, timings=timings)
+            start = time.perf_counter()
+            cache.put(key, voxels)
+            timings['cache'] += time.perf_counter() - start
+        return voxels
+
     # Normalize and scale vertices to fit within the voxel grid     
+    start = time.perf_counter()
     scaled_vertices = normalize_vertices(vertices, voxel_size)
+    timings['normalize'] = time.perf_counter() - start
     # Convert the mesh to voxels
     if np.isnan(scaled_vertices).any() or np.isnan(faces).any() or scaled_vertices.size == 0 or faces.size == 0:
-        print("\nnan found\n")
+        logger.warning("nan found, the mesh cannot be voxelized")
         return None
     
-    voxels = mesh_to_voxel(scaled_vertices, faces, voxel_size)    
+    start = time.perf_counter()
+    voxels = VOXELIZERS[backend](scaled_vertices, faces, voxel_size)    
+    timings['voxelize'] = time.perf_counter() - start
+    start = time.perf_counter()
     
     # Define the target shape
     target_shape = (voxel_size, voxel_size, voxel_size)
@@ -137,6 +280,12 @@ def convert_mat_to_voxel(vertices, faces, voxel_size):
     
     # Apply padding to the voxel array
     padded_voxels = np.pad(voxels, pad_width, mode='constant', constant_values=0)
+    timings['pad'] = time.perf_counter() - start
+    
+    if fill:
+        start = time.perf_counter()
+        padded_voxels = fill_voxels(padded_voxels)
+        timings['fill'] = time.perf_counter() - start
     
     #print("Original shape:", voxels.shape)
     #print("Padded shape:", padded_voxels.shape)
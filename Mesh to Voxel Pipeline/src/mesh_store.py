@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+@author: ken
+"""
+
+
+"""
+This module implements a packed mesh store: a single file per
+dataset split holding every mesh of that split, as an alternative
+to one .mat file per mesh.
+
+File layout (all offsets in bytes, arrays little-endian and
+aligned to 64 bytes):
+
+    magic       8 bytes   b'MESHPACK'
+    version     uint32
+    header_len  uint32
+    header      JSON      n_meshes, categories, mesh names and the
+                          offset/dtype/shape of every array below
+    vertices    float32   (total_vertices, 3) all meshes concatenated
+    faces       int32     (total_faces, 3) indices local to each mesh
+    vert_offset int64     (n_meshes,) first vertex row of each mesh
+    vert_count  int64     (n_meshes,)
+    face_offset int64     (n_meshes,) first face row of each mesh
+    face_count  int64     (n_meshes,)
+    labels      int32     (n_meshes,) index into categories
+
+MeshStoreWriter streams meshes into the file one at a time, so
+memory use does not grow with the split size. MeshStore memory-maps
+a finished file and hands out per-mesh views without copying.
+"""
+
+
+import json
+import os
+import shutil
+import struct
+import numpy as np
+
+
+MAGIC = b'MESHPACK'
+VERSION = 1
+ALIGNMENT = 64
+EXTENSION = '.meshpack'
+
+
+
+"""
+This class writes a packed mesh store. Meshes are added one at a
+time with add(); vertex and face data are spooled to temporary
+files next to the output and the final file is assembled on close().
+"""
+class MeshStoreWriter:
+
+    def __init__(self, path, categories):
+        self.path = path
+        self.categories = list(categories)
+        self.names = []
+        self.labels = []
+        self.vert_counts = []
+        self.face_counts = []
+        self.verts_tmp = open(path + '.vertices.tmp', 'wb')
+        self.faces_tmp = open(path + '.faces.tmp', 'wb')
+
+    def add(self, name, label, verts, faces):
+        verts = np.ascontiguousarray(verts, dtype='<f4').reshape(-1, 3)
+        faces = np.ascontiguousarray(faces, dtype='<i4').reshape(-1, 3)
+        self.verts_tmp.write(verts.tobytes())
+        self.faces_tmp.write(faces.tobytes())
+        self.names.append(name)
+        self.labels.append(int(label))
+        self.vert_counts.append(len(verts))
+        self.face_counts.append(len(faces))
+
+    def close(self):
+        self.verts_tmp.close()
+        self.faces_tmp.close()
+
+        vert_count = np.array(self.vert_counts, dtype='<i8')
+        face_count = np.array(self.face_counts, dtype='<i8')
+        index_arrays = [
+            ('vert_offset', np.concatenate(([0], np.cumsum(vert_count)[:-1])).astype('<i8')),
+            ('vert_count', vert_count),
+            ('face_offset', np.concatenate(([0], np.cumsum(face_count)[:-1])).astype('<i8')),
+            ('face_count', face_count),
+            ('labels', np.array(self.labels, dtype='<i4')),
+        ]
+        array_specs = [('vertices', '<f4', (int(vert_count.sum()), 3)),
+                       ('faces', '<i4', (int(face_count.sum()), 3))]
+        array_specs += [(name, array.dtype.str, array.shape) for name, array in index_arrays]
+
+        # The header size depends on the offsets it records, so lay the
+        # arrays out after a generous estimate of its length
+        header = {'n_meshes': len(self.names), 'categories': self.categories,
+                  'names': self.names, 'arrays': {}}
+        data_start = align(16 + len(json.dumps(header)) + 128 * len(array_specs))
+        position = data_start
+        for name, dtype, shape in array_specs:
+            header['arrays'][name] = {'offset': position, 'dtype': dtype, 'shape': list(shape)}
+            position = align(position + int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        header_bytes = json.dumps(header).encode('utf-8')
+        assert 16 + len(header_bytes) <= data_start
+
+        with open(self.path, 'wb') as f:
+            f.write(MAGIC + struct.pack('<II', VERSION, len(header_bytes)) + header_bytes)
+            for name, tmp_path in (('vertices', self.verts_tmp.name), ('faces', self.faces_tmp.name)):
+                f.seek(header['arrays'][name]['offset'])
+                with open(tmp_path, 'rb') as tmp:
+                    shutil.copyfileobj(tmp, f, 16 * 1024 * 1024)
+                os.remove(tmp_path)
+            for name, array in index_arrays:
+                f.seek(header['arrays'][name]['offset'])
+                f.write(array.tobytes())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.verts_tmp.close()
+            self.faces_tmp.close()
+            for tmp_path in (self.verts_tmp.name, self.faces_tmp.name):
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+
+
+"""
+This class reads a packed mesh store. The file is memory-mapped once
+and get(i) returns the vertices and faces of mesh i as read-only
+views into the map, so nothing is copied until the data is used.
+"""
+class MeshStore:
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic = f.read(8)
+            version, header_len = struct.unpack('<II', f.read(8))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"Not a version {VERSION} mesh store: {path}")
+            header = json.loads(f.read(header_len).decode('utf-8'))
+        self.categories = header['categories']
+        self.names = header['names']
+        self.buffer = np.memmap(path, dtype=np.uint8, mode='r')
+
+        arrays = {}
+        for name, spec in header['arrays'].items():
+            shape = tuple(spec['shape'])
+            if int(np.prod(shape)) == 0:
+                arrays[name] = np.zeros(shape, dtype=spec['dtype'])
+            else:
+                arrays[name] = np.ndarray(shape, dtype=spec['dtype'], buffer=self.buffer, offset=spec['offset'])
+        self.vertices = arrays['vertices']
+        self.faces = arrays['faces']
+        self.vert_offset = arrays['vert_offset']
+        self.vert_count = arrays['vert_count']
+        self.face_offset = arrays['face_offset']
+        self.face_count = arrays['face_count']
+        self.labels = arrays['labels']
+
+    def __len__(self):
+        return len(self.names)
+
+    def get(self, index):
+        v_start = self.vert_offset[index]
+        f_start = self.face_offset[index]
+        return (self.vertices[v_start:v_start + self.vert_count[index]],
+                self.faces[f_start:f_start + self.face_count[index]])
+
+
+
+"""
+This function rounds a byte offset up to the array alignment.
+"""
+def align(position):
+    return (position + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+
+"""
+This function returns the path of the store for a split inside a
+directory, e.g. 'ModelNet40/ModelNet40_Pack/train.meshpack'.
+"""
+def split_path(directory, split):
+    return os.path.join(directory, split + EXTENSION)
@@ -1,88 +1,415 @@
-# -*- coding: utf-8 -*-
-"""
-Created on Tue Jul 16 01:25:15 2024
-
-@author: ken
-"""
-
-
-"""
-This script converts all files in a single directory containing
-3D geometry data from OFF files into a format compatible with 
-MATLAB (MAT files), and save them to a specified directory. The 
-main function, convert_off_to_mat, handles the conversion process, 
-iterating over OFF files in the input directory and saving the 
-converted MAT files to the output directory.
-
-The main function, convert_off_to_mat is called from another 
-program which provides parameters of the input directory containing
-the OFF files and the output directory to save the MAT files to, 
-this program converts the OFF files in the input directory to MAT
-files and stores them in the output directory.
-"""
-
-
-import os
-import numpy as np
-from scipy.io import savemat
-import glob
-
-
-
-"""
-This function reads an OFF file, extracting vertices and faces 
-data. It checks for a valid OFF header, reads the number of 
-vertices and faces, and stores them as numpy arrays.
-"""
-def read_off(file):
-    with open(file, 'r') as f:
-        head_line = f.readline().strip()
-        if head_line.startswith("OFF"):
-            off_label = head_line[3:]  # Extract 'OFF'
-            off_label = off_label.strip()
-            if off_label != "":
-                n_verts, n_faces, _ = map(int, off_label.split())        
-            else:            
-                n_verts, n_faces, _ = map(int, f.readline().strip().split())
-            verts = []
-            for _ in range(n_verts):
-                verts.append(list(map(float, f.readline().strip().split())))
-            faces = []
-            for _ in range(n_faces):
-                faces.append(list(map(int, f.readline().strip().split()[1:])))
-        else:
-            return None, None
-    return np.array(verts), np.array(faces)
-
-
-
-"""
-This function saves the vertices and faces data into a MAT file 
-using scipy.io.savemat, making it compatible with MATLAB.
-"""
-def save_mat(file, verts, faces):
-    savemat(file, {'vertices': verts, 'faces': faces})
-
-
-
-"""
-This functions converts all OFF files in a specified directory to MAT files,
-saving them in a designated output directory. It also ensures 
-the output directory exists.
-"""
-def convert_off_to_mat(input_dir, output_dir):
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    
-    # find all files with the .off extension in the input_dir
-    off_files = glob.glob(os.path.join(input_dir, '*.off'))
-    
-    for off_file in off_files:
-        verts, faces = read_off(off_file)
-        if verts is not None and faces is not None:
-            mat_file = os.path.join(output_dir, os.path.splitext(os.path.basename(off_file))[0] + '.mat')
-            save_mat(mat_file, verts, faces)
-            #print(f'Converted {off_file} to {mat_file}')
-
-                
-                
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Jul 16 01:25:15 2024
+
+@author: ken
+"""
+
+
+"""
+This script converts all files in a single directory containing
+3D geometry data from OFF files into a format compatible with 
+MATLAB (MAT files), and save them to a specified directory. The 
+main function, convert_off_to_mat, handles the conversion process, 
+iterating over OFF files in the input directory and saving the 
+converted MAT files to the output directory.
+
+The main function, convert_off_to_mat is called from another 
+program which provides parameters of the input directory containing
+the OFF files and the output directory to save the MAT files to, 
+this program converts the OFF files in the input directory to MAT
+files and stores them in the output directory.
+
+Alternatively, convert_off_to_mesh_store writes all meshes of a 
+split into one packed mesh store file (see mesh_store).
+
+convert_directory_tree runs either conversion over a whole ModelNet 
+style tree (category/train, category/test) of OFF files, listed 
+through a dataset index (see dataset_index) and optionally limited 
+to some categories.
+"""
+
+
+import logging
+import os
+import re
+import warnings
+import numpy as np
+from scipy.io import savemat
+import glob
+import multiprocessing
+import time
+import dataset_index
+import mesh_store
+
+# Messages go to the pipeline logger (see run_report)
+logger = logging.getLogger('voxel_pipeline')
+
+
+
+# Matches the OFF keyword and its COFF/NOFF/CNOFF variants. Anything
+# following the keyword on the same line is the counts line, which is
+# how many ModelNet files are written (e.g. "OFF490 518 0").
+OFF_HEADER = re.compile(r'^([CN]{0,2})OFF(.*)$')
+OFF_COMMENT = re.compile(rb'#[^\n]*')
+OFF_BLANK_LINE = re.compile(rb'\n[ \t\r]*(?=\n)')
+
+OUTPUT_FORMATS = ('mat', 'pack')
+
+
+
+"""
+This function reads an OFF file, extracting vertices and faces 
+data. It checks for a valid OFF header (OFF, COFF, NOFF or CNOFF), 
+reads the number of vertices and faces, and decodes the whole 
+vertex and face blocks in one pass with numpy instead of parsing 
+them line by line. Comments are ignored, any normal/colour columns 
+are dropped, and polygons with more than three corners are fan 
+triangulated. Vertices are returned as float32 and faces as int32.
+"""
+def read_off(file):
+    with open(file, 'rb') as f:
+        data = f.read()
+    if b'#' in data:
+        data = OFF_COMMENT.sub(b'', data)
+    if OFF_BLANK_LINE.search(data):
+        data = OFF_BLANK_LINE.sub(b'', data)
+    data = data.strip()
+    if not data:
+        return None, None
+
+    # Byte offsets of every line end, so whole blocks of lines can be 
+    # sliced out of the file without splitting it into Python strings
+    line_ends = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == ord('\n'))
+    line_ends = np.append(line_ends, len(data))
+    line_starts = np.concatenate(([0], line_ends[:-1] + 1))
+
+    def block(first, last):
+        return data[line_starts[first]:line_ends[last - 1]]
+
+    header = OFF_HEADER.match(block(0, 1).decode('ascii', 'replace').strip())
+    if header is None:
+        return None, None
+    off_label = header.group(2).strip()
+    if off_label != "":
+        counts = off_label.split()
+        body_start = 1
+    else:
+        counts = block(1, 2).split() if len(line_ends) > 1 else []
+        body_start = 2
+    if len(counts) < 2:
+        raise ValueError(f"Missing vertex/face counts in OFF file: {file}")
+    n_verts, n_faces = int(counts[0]), int(counts[1])
+
+    face_start = body_start + n_verts
+    if len(line_ends) < face_start + n_faces:
+        raise ValueError(f"Truncated OFF file: {file}")
+
+    verts = decode_vertex_block(block(body_start, face_start), n_verts, file)
+    faces = decode_face_block(block(face_start, face_start + n_faces), n_faces, file)
+    return verts, faces
+
+
+
+"""
+This function parses a block of whitespace separated numbers into 
+a flat numpy array. A token that does not fit the dtype (e.g. a 
+float in an integer block) ends the parse early (older numpy) or 
+fails it (newer numpy); either way callers detect it through the 
+size of the result.
+"""
+def parse_numbers(text_block, dtype):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        try:
+            return np.fromstring(text_block, dtype=dtype, sep=' ')
+        except ValueError:
+            return np.zeros(0, dtype=dtype)
+
+
+
+"""
+This function decodes the vertex lines of an OFF file into an 
+(n_verts, 3) float32 array. Every vertex line has the same number 
+of columns, so the block is parsed as one flat array and reshaped; 
+the extra normal or colour columns of NOFF/COFF files are sliced off.
+"""
+def decode_vertex_block(vert_block, n_verts, file):
+    if n_verts == 0:
+        return np.zeros((0, 3), dtype=np.float32)
+    flat = parse_numbers(vert_block, np.float32)
+    if flat.size % n_verts != 0 or flat.size // n_verts < 3:
+        raise ValueError(f"Malformed vertex block in OFF file: {file}")
+    return np.ascontiguousarray(flat.reshape(n_verts, -1)[:, :3])
+
+
+
+"""
+This function decodes the face lines of an OFF file into an 
+(n_triangles, 3) int32 array. Pure triangle meshes (the ModelNet 
+case) are decoded with a single reshape. Otherwise each line is 
+split on its leading corner count, any trailing face colour values 
+are ignored, and polygons are fan triangulated as (v0, vj, vj+1).
+Faces with fewer than three corners are dropped.
+"""
+def decode_face_block(face_block, n_faces, file):
+    if n_faces == 0:
+        return np.zeros((0, 3), dtype=np.int32)
+    flat = parse_numbers(face_block, np.int64)
+
+    # Fast path: every line is "3 a b c"
+    if flat.size == n_faces * 4 and np.all(flat[0::4] == 3):
+        return flat.reshape(n_faces, 4)[:, 1:].astype(np.int32)
+
+    # Faces may carry trailing colour values, which are not integers
+    flat = parse_numbers(face_block, np.float64)
+    line_sizes = np.array([len(line.split()) for line in face_block.splitlines()])
+    if line_sizes.sum() != flat.size:
+        raise ValueError(f"Malformed face block in OFF file: {file}")
+    starts = np.concatenate(([0], np.cumsum(line_sizes)[:-1]))
+    arity = flat[starts].astype(np.int64)
+    if np.any(arity < 0) or np.any(arity + 1 > line_sizes):
+        raise ValueError(f"Malformed face block in OFF file: {file}")
+
+    n_tris = np.maximum(arity - 2, 0)
+    total = int(n_tris.sum())
+    if total == 0:
+        return np.zeros((0, 3), dtype=np.int32)
+    # For every output triangle, the start of its face line and its 
+    # position j (1-based) within that face's fan
+    tri_face_start = np.repeat(starts, n_tris)
+    tri_offsets = np.concatenate(([0], np.cumsum(n_tris)[:-1]))
+    j = np.arange(total) - np.repeat(tri_offsets, n_tris) + 1
+
+    faces = np.empty((total, 3), dtype=np.int32)
+    faces[:, 0] = flat[tri_face_start + 1]
+    faces[:, 1] = flat[tri_face_start + 1 + j]
+    faces[:, 2] = flat[tri_face_start + 2 + j]
+    return faces
+
+
+
+"""
+This function saves the vertices and faces data into a MAT file 
+using scipy.io.savemat, making it compatible with MATLAB.
+"""
+def save_mat(file, verts, faces):
+    savemat(file, {'vertices': verts, 'faces': faces})
+
+
+
+"""
+This function checks whether an output file can be reused: it 
+must exist, be non-empty and be at least as new as its source.
+"""
+def is_up_to_date(source_file, output_file):
+    try:
+        output_stat = os.stat(output_file)
+    except OSError:
+        return False
+    return output_stat.st_size > 0 and output_stat.st_mtime >= os.stat(source_file).st_mtime
+
+
+
+"""
+This function builds the (OFF file, MAT file) pair for every OFF 
+file in a single directory.
+"""
+def list_conversion_jobs(input_dir, output_dir):
+    off_files = sorted(glob.glob(os.path.join(input_dir, '*.off')))
+    return [(off_file, os.path.join(output_dir, os.path.splitext(os.path.basename(off_file))[0] + '.mat'))
+            for off_file in off_files]
+
+
+
+"""
+This function converts one OFF file to one MAT file. It is the 
+unit of work handed to the process pool, so it returns a status 
+('converted', 'skipped', 'invalid' or 'failed') and the number of 
+faces written instead of raising.
+"""
+def convert_one_off_to_mat(job):
+    off_file, mat_file = job
+    if is_up_to_date(off_file, mat_file):
+        return 'skipped', 0
+    try:
+        verts, faces = read_off(off_file)
+        if verts is None or faces is None:
+            return 'invalid', 0
+        os.makedirs(os.path.dirname(mat_file), exist_ok=True)
+        save_mat(mat_file, verts, faces)
+    except Exception as e:
+        print(f"Failed to convert {off_file}: {e}")
+        return 'failed', 0
+    return 'converted', len(faces)
+
+
+
+"""
+This function converts a whole work list of (OFF file, MAT file) 
+pairs across a process pool sized to the machine by default. 
+Outputs newer than their source are skipped, so an interrupted or 
+repeated run only redoes the missing files. The status counts and 
+the aggregate throughput are printed at the end and returned.
+"""
+def convert_off_to_mat_parallel(jobs, workers=None):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(jobs)))
+    counts = {'converted': 0, 'skipped': 0, 'invalid': 0, 'failed': 0}
+    total_faces = 0
+
+    start = time.perf_counter()
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    try:
+        if pool is None:
+            results = map(convert_one_off_to_mat, jobs)
+        else:
+            chunksize = max(1, len(jobs) // (workers * 16))
+            results = pool.imap_unordered(convert_one_off_to_mat, jobs, chunksize)
+        for status, n_faces in results:
+            counts[status] += 1
+            total_faces += n_faces
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    elapsed = time.perf_counter() - start
+
+    print(f"Processed {len(jobs)} files with {workers} worker(s) in {elapsed:.1f}s: "
+          f"{counts['converted']} converted, {counts['skipped']} up to date, "
+          f"{counts['invalid']} invalid, {counts['failed']} failed")
+    if elapsed > 0 and counts['converted'] > 0:
+        print(f"Throughput: {counts['converted'] / elapsed:.1f} files/s, "
+              f"{total_faces / elapsed:.0f} faces/s")
+    return counts
+
+
+
+"""
+This function reads one OFF file for the mesh store conversion. 
+Errors are reported and turned into (None, None) so one bad file 
+does not stop the pool.
+"""
+def read_off_safely(off_file):
+    try:
+        return read_off(off_file)
+    except Exception as e:
+        print(f"Failed to read {off_file}: {e}")
+        return None, None
+
+
+
+"""
+This function converts a list of (OFF file, name, label) entries 
+into a single packed mesh store file (see mesh_store) instead of 
+one MAT file per mesh. Files are parsed across a process pool and 
+appended to the store in list order by this process.
+"""
+def convert_off_to_mesh_store(entries, store_path, categories, workers=None):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(entries)))
+    store_dir = os.path.dirname(store_path)
+    if store_dir and not os.path.exists(store_dir):
+        os.makedirs(store_dir)
+
+    off_files = [off_file for off_file, _, _ in entries]
+    written = 0
+    total_faces = 0
+    start = time.perf_counter()
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    try:
+        if pool is None:
+            results = map(read_off_safely, off_files)
+        else:
+            chunksize = max(1, len(entries) // (workers * 16))
+            results = pool.imap(read_off_safely, off_files, chunksize)
+        with mesh_store.MeshStoreWriter(store_path, categories) as writer:
+            for (_, name, label), (verts, faces) in zip(entries, results):
+                if verts is not None and faces is not None:
+                    writer.add(name, label, verts, faces)
+                    written += 1
+                    total_faces += len(faces)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    elapsed = time.perf_counter() - start
+
+    print(f"Packed {written}/{len(entries)} meshes into {store_path} in {elapsed:.1f}s")
+    if elapsed > 0 and written > 0:
+        print(f"Throughput: {written / elapsed:.1f} files/s, {total_faces / elapsed:.0f} faces/s")
+    return written
+
+
+
+"""
+This function collects the (OFF file, MAT file) pairs for the train 
+and test folders of every category of a dataset index selected by 
+the category filter (all categories if there is none).
+"""
+def collect_conversion_jobs(index, out_path, category_filter=None):
+    jobs = []
+    for item in index.categories(category_filter):
+        logger.debug('Collecting %s', os.path.join(index.root, item))
+        for split in dataset_index.SPLIT_DIRS:
+            output_dir = os.path.join(out_path, item, split)
+            jobs += [(off_file, os.path.join(output_dir, os.path.splitext(os.path.basename(off_file))[0] + '.mat'))
+                     for off_file in index.paths(item, split, '.off')]
+    return jobs
+
+
+
+"""
+This function collects the (OFF file, name, label) entries of one 
+split for the packed mesh store, together with the category list 
+that the labels index into.
+"""
+def collect_store_entries(index, split, category_filter=None):
+    categories = index.categories(category_filter)
+    entries = []
+    for label, item in enumerate(categories):
+        for off_file in index.paths(item, split, '.off'):
+            entries.append((off_file, os.path.join(item, split, os.path.basename(off_file)), label))
+    return entries, categories
+
+
+
+"""
+This function converts a whole tree of OFF files, either into a 
+mirrored tree of MAT files ('mat') or into one packed mesh store 
+per split ('pack') in the output directory. Only the categories 
+selected by the category filter are converted. The tree is listed 
+through its dataset index, kept at index_path (by default in the 
+tree itself, False to keep it in memory only).
+"""
+def convert_directory_tree(input_path, out_path, output_format='mat', workers=None, category_filter=None,
+                           index_path=None):
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format '{output_format}', expected one of {OUTPUT_FORMATS}")
+    index = dataset_index.DatasetIndex(input_path, index_path)
+    index.report()
+    if output_format == 'pack':
+        for split in dataset_index.SPLIT_DIRS:
+            entries, categories = collect_store_entries(index, split, category_filter)
+            convert_off_to_mesh_store(entries, mesh_store.split_path(out_path, split), categories, workers)
+        return
+    jobs = collect_conversion_jobs(index, out_path, category_filter)
+    print(f"Found {len(jobs)} OFF files to check")
+    convert_off_to_mat_parallel(jobs, workers)
+
+
+
+"""
+This functions converts all OFF files in a specified directory to MAT files,
+saving them in a designated output directory. It also ensures 
+the output directory exists. Files whose MAT output is already up 
+to date are skipped.
+"""
+def convert_off_to_mat(input_dir, output_dir):
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    
+    for job in list_conversion_jobs(input_dir, output_dir):
+        convert_one_off_to_mat(job)
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+@author: ken
+"""
+
+
+"""
+This module runs the load and voxelize stage of prepare_voxel_data
+on a pool of worker processes.
+
+Each worker loads a sample (MAT file, OFF file or packed mesh store
+entry), voxelizes it at the largest box size and derives the smaller
+box sizes by max pooling. The results come back to the calling
+process, which is the single owner of the HDF5 file, in the same
+order as the addresses were given. At most max_pending samples are
+in flight at any time, so a slow writer holds the workers back
+instead of letting finished grids pile up in memory.
+
+Every result carries the sample's stage times, face count and the
+worker's peak memory, for the run report (see run_report).
+"""
+
+
+import collections
+import hashlib
+import multiprocessing
+import os
+import time
+import numpy as np
+import scipy.io
+
+import mat_to_voxel_converter
+import mesh_store
+import off_to_mat_converter
+import run_report
+import voxel_cache
+
+
+# Per-process state, set up by init_worker
+worker_config = None
+worker_stores = {}
+worker_cache = None
+
+
+
+"""
+This function sets up a worker process (or the calling process,
+when running without a pool) with the run configuration: a dict
+with the keys box_sizes, backend, fill, cache_path (or None),
+store_paths (split -> packed mesh store path) and optionally
+log_level. The worker's voxel cache does not evict; the calling
+process owns the cache bound.
+"""
+def init_worker(config):
+    global worker_config, worker_cache
+    worker_config = config
+    if config.get('log_level') is not None:
+        run_report.set_log_level(config['log_level'])
+    worker_stores.clear()
+    worker_cache = voxel_cache.VoxelCache(config['cache_path'], owner=False) if config['cache_path'] else None
+
+
+
+"""
+This function loads the vertices and faces of one sample. A sample
+address is either the path of a MAT file or a (split, index) pair
+referring to a mesh in one of the packed mesh stores, or the path
+of an OFF file. Read errors are raised; voxelize_sample catches
+them per sample.
+"""
+def load_mesh(address):
+    if isinstance(address, tuple):
+        split, index = address
+        if split not in worker_stores:
+            worker_stores[split] = mesh_store.MeshStore(worker_config['store_paths'][split])
+        return worker_stores[split].get(index)
+    if address.endswith('.off'):
+        return off_to_mat_converter.read_off(address)
+    mat = scipy.io.loadmat(address)
+    return mat['vertices'], mat['faces']
+
+
+
+"""
+This function returns the SHA-256 hex digest of a mesh's geometry,
+taken over its float32 vertices and int32 faces so the same mesh
+hashes the same whether it was loaded from an OFF file, a MAT file
+or a mesh store.
+"""
+def mesh_digest(vertices, faces):
+    vertices = np.ascontiguousarray(vertices, dtype=np.float32)
+    faces = np.ascontiguousarray(faces, dtype=np.int32)
+    digest = hashlib.sha256(np.array([len(vertices), len(faces)], dtype=np.int64).tobytes())
+    digest.update(vertices.tobytes())
+    digest.update(faces.tobytes())
+    return digest.hexdigest()
+
+
+
+"""
+This function loads one sample and converts it into voxel grids at
+every box size. It returns a dict of box size -> int8 grid, or None
+if the mesh cannot be read or voxelized, together with whether the
+voxel cache had the result (None when there is no cache), the
+mesh_digest of the mesh (None if it cannot be read) and the sample
+stats: a dict with the stage times, the face count and the peak
+memory of the process.
+"""
+def voxelize_sample(address):
+    timings = {}
+    stats = {'timings': timings, 'faces': None}
+    start = time.perf_counter()
+    try:
+        vertices, faces = load_mesh(address)
+    except Exception as e:
+        # One unreadable mesh must not stop the run
+        run_report.logger.warning('Failed to read %s: %s', address, e)
+        vertices = faces = None
+    timings['load'] = time.perf_counter() - start
+    if vertices is None or faces is None:
+        stats['rss'] = run_report.peak_rss()
+        return None, None, None, stats
+    stats['faces'] = len(faces)
+    digest = mesh_digest(vertices, faces)
+    hits = worker_cache.hits if worker_cache is not None else 0
+    box_sizes = worker_config['box_sizes']
+    try:
+        voxels = mat_to_voxel_converter.convert_mat_to_voxel(vertices, faces, max(box_sizes),
+                                                             backend=worker_config['backend'],
+                                                             fill=worker_config['fill'], cache=worker_cache,
+                                                             timings=timings)
+    except Exception as e:
+        run_report.logger.warning('Failed to voxelize %s: %s', address, e)
+        stats['rss'] = run_report.peak_rss()
+        return None, None, None, stats
+    cache_hit = worker_cache.hits > hits if worker_cache is not None else None
+    pyramid = None
+    if voxels is not None and voxels.size > 0:
+        start = time.perf_counter()
+        pyramid = mat_to_voxel_converter.voxel_pyramid(voxels.astype(np.int8), box_sizes)
+        timings['pyramid'] = time.perf_counter() - start
+    stats['rss'] = run_report.peak_rss()
+    return pyramid, cache_hit, digest, stats
+
+
+
+"""
+This class owns the worker pool. imap() voxelizes a sequence of
+addresses and yields (pyramid, cache_hit, digest, stats) results in
+order. With a single worker everything runs in the calling process.
+"""
+class ParallelVoxelizer:
+
+    def __init__(self, config, workers=None, max_pending=None):
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self.workers = max(1, workers)
+        self.max_pending = max_pending or 4 * self.workers
+        if self.workers == 1:
+            self.pool = None
+            init_worker(config)
+        else:
+            self.pool = multiprocessing.Pool(self.workers, initializer=init_worker, initargs=(config,))
+
+    def imap(self, addresses):
+        if self.pool is None:
+            for address in addresses:
+                yield voxelize_sample(address)
+            return
+        pending = collections.deque()
+        for address in addresses:
+            if len(pending) >= self.max_pending:
+                yield pending.popleft().get()
+            pending.append(self.pool.apply_async(voxelize_sample, (address,)))
+        while pending:
+            yield pending.popleft().get()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None and self.pool is not None:
+            self.pool.terminate()
+        self.close()
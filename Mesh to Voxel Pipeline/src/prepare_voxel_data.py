@@ -7,185 +7,770 @@ Created on Tue Jul 16 01:02:09 2024
 
 
 """
-This program processes 3D model MAT data in a given input path, 
-converts it into voxel grids and saves it into an HDF5 file 
+This program processes 3D model MAT data in a given input path,
+converts it into voxel grids and saves it into an HDF5 file
 along with labels for training, testing, and validation datasets.
+
+The input path is either a directory tree of MAT files
+(category/train, category/test) or a directory holding the packed
+mesh stores train.meshpack and test.meshpack (see mesh_store).
+It can also be the raw ModelNet tree of OFF files, in which case
+each mesh is parsed with read_off and voxelized straight away,
+without writing any intermediate MAT files.
+
+Loading and voxelization run on a pool of worker processes (see
+parallel_voxelizer) while this process, the only writer of the
+HDF5 file, stores the results in order.
+
+The HDF5 file also records the run plan (every parameter and the
+shuffled order of each split) and, per split, a bitmap of the
+samples committed so far. An interrupted run is continued with
+
+    python prepare_voxel_data.py --resume
+
+which asks only for the file name and the number of workers and
+processes the samples that are still missing.
+
+Generation can be split over several processes or machines with
+
+    python prepare_voxel_data.py --shard 2/4
+
+which writes only shard 2 of 4 (counted from 0): a contiguous range
+of every split of the shuffled plan, into object40-00002-of-00004.hdf5
+for the file name object40. Every shard computes the same plan, so
+the shards are disjoint and together cover every sample. Once all
+shards are complete, merge_shards (or 'voxel_pipeline merge') writes
+a small file of virtual datasets that reads the shards as one
+dataset, in the same order as a single unsharded run.
+
+Every run writes a JSON run report next to the hdf5 file
+(object40.report.json): per-stage timing histograms, peak memory and
+the slowest meshes (see run_report).
+
+The same steps can be driven without prompts through make_run_plan
+and run, which the voxel_pipeline command line ('voxel_pipeline
+voxelize') uses.
 """
 
 
 import numpy as np
 import h5py
 import glob
+import json
 import os
-import scipy.io
-from random import shuffle
+import sys
 import random
-from sklearn.model_selection import train_test_split
+import time
+
+import dataset_index
+import mesh_store
+import run_report
+import voxel_cache
+import voxel_hdf5
+# sklearn, mat_to_voxel_converter (trimesh) and parallel_voxelizer are
+# slow to import, so they are imported in the functions that use them;
+# collecting the samples for a dry run does not need them.
 
-import mat_to_voxel_converter 
 
 SEED = 448
-random.seed(SEED)
-
-# Default path if user input is invalid
-default_path = 'ModelNet40/ModelNet40_Mat'
-
-# Ask the user to input the directory path
-input_path = input(f"Please enter the directory path containing MAT data (Default Path is '{default_path}'): ")
-
-# Validate the user input
-if not os.path.isdir(input_path):
-    print(f"Invalid directory. Using default path: {default_path}")
-    input_path = default_path
-    
-
-label = {}
-label_counter = 0
-
-train_addrs = []
-labels = []
-combine_train = []
-combine_test = []
-
-# Iterate through files to collect and label data addresses.
-for item in os.listdir(input_path):
-    if item != '.DS_Store':
-       
-        if item not in label:
-            # Assign the next number to the new item
-            label[item] = label_counter
-            # Increment the counter for the next item
-            label_counter += 1       
-        
-        # Retrieve the file paths and labels for training and 
-        # testing data and put them into lists for further
-        # processing.
-        current_label = label.get(item)
-        current_dir = os.path.join(input_path, item)
-        train_path = os.path.join(current_dir, 'train')
-        test_path = os.path.join(current_dir, 'test')
-        train_addrs = glob.glob(train_path + '/*.mat')
-        test_addrs = glob.glob(test_path + '/*.mat')
-        train_labels = np.full(len(train_addrs), current_label, dtype=int)
-        print('Training data for %s: %d' % (item, len(train_addrs)))
-        test_labels = np.full(len(test_addrs), current_label, dtype=int)
-        print('Testing data for %s: %d' % (item, len(test_addrs)))
-        temp_train_addrs = list(zip(train_addrs, train_labels))
-        temp_test_addrs = list(zip(test_addrs, test_labels))
-        combine_train += temp_train_addrs
-        combine_test += temp_test_addrs
-
-print(len(combine_test))
-shuffle(combine_train)
-shuffle(combine_test)
-
-mat_train, train_label = zip(*combine_train)
-mat_test, test_label = zip(*combine_test)
-
-# split test data into test data and validation data
-mat_test, mat_val, test_label, val_label = train_test_split(mat_test, test_label, test_size=0.5)
-
-print('Total training example: %d' % (len(mat_train)))
-print('Total testing example: %d' % (len(mat_test)))
-print('Total validation example: %d' % (len(mat_val)))
-
-# Create text files to store file paths and their associated labels 
-#for the training, testing, and validation datasets for future use.
-train_file = open('train40.txt', 'w')
-test_file = open('test40.txt', 'w')
-val_file = open('validation40.txt', 'w')
-
-default_box_size = 32
-try:
-    # Ask the user to input a number
-    box_size = int(float(input(f"Please enter the target voxel size (Default Value is {default_box_size}): ")))
-except ValueError:
-    # If there's any problem with the input (e.g., it's not a number), use 32 as the default value
-    print(f"Invalid input. Using default box size value of '{default_box_size}'.")
-    box_size = default_box_size
-        
-train_shape = (len(mat_train), box_size, box_size, box_size)
-test_shape = (len(mat_test), box_size, box_size, box_size)
-val_shape = (len(mat_val), box_size, box_size, box_size)
-
-# Create hdf5 file and create datasets to store training,
-# testing and validation datasets
-
-# Default file name if user input is invalid
-default_filename = "object40"
-
-# Ask the user to input the hdf5 filename to use
-try:
-    hdf5_filename = input(f"Please enter the name of hdf5 file to save dataset to without \".htf5\" (Default file name is '{default_filename}'): ").strip()
-    if not hdf5_filename:
+
+SPLITS = (("train", "Training"), ("test", "Testing"), ("val", "Validation"))
+# Number of samples between two checkpoints of the committed bitmap
+CHECKPOINT_INTERVAL = 256
+# Run parameters that may differ between the shards of one run
+LOCAL_PARAMS = ('shard', 'input_path', 'cache_path', 'cache_size', 'store_paths')
+
+
+
+"""
+This function returns the source name stored in the hdf5 file for a
+sample address: the file path, or the mesh store path and mesh name.
+"""
+def address_name(address, stores):
+    if isinstance(address, tuple):
+        split, index = address
+        return '%s:%s' % (stores[split].path, stores[split].names[index])
+    return address
+
+
+
+"""
+This function returns the dataset name for a split and box size.
+With several voxel sizes every split gets one dataset per size
+(e.g. train_mat_16, train_mat_32), otherwise just train_mat.
+"""
+def mat_dataset_name(split, size, box_sizes):
+    if len(box_sizes) == 1:
+        return split + "_mat"
+    return "%s_mat_%d" % (split, size)
+
+
+
+"""
+This function stores the run plan in the hdf5 file as a JSON string,
+with the parameters mirrored as file attributes for inspection.
+"""
+def save_run_plan(hdf5_file, plan):
+    hdf5_file.create_dataset("run_plan", data=json.dumps(plan))
+    for name, value in plan['params'].items():
+        hdf5_file.attrs[name] = json.dumps(value)
+
+
+
+"""
+This function reads the run plan back from an hdf5 file written by
+this program. Store addresses are turned back into (split, index)
+tuples.
+"""
+def load_run_plan(hdf5_file):
+    if "run_plan" not in hdf5_file:
+        raise ValueError(f"{hdf5_file.filename} has no run plan, it cannot be resumed")
+    plan = hdf5_file["run_plan"][()]
+    if isinstance(plan, bytes):
+        plan = plan.decode('utf-8')
+    plan = json.loads(plan)
+    for split_plan in plan['splits'].values():
+        split_plan['addresses'] = [tuple(address) if isinstance(address, list) else address
+                                   for address in split_plan['addresses']]
+    return plan
+
+
+
+"""
+This function reads the run plan of an hdf5 file that can be
+resumed, that is not a merged file of shards.
+"""
+def load_resumable_plan(hdf5_file):
+    if "shards" in hdf5_file:
+        raise ValueError(f"{hdf5_file.filename} is a merged file of shards, resume the shard files instead")
+    return load_run_plan(hdf5_file)
+
+
+
+"""
+This function returns the names of the per-sample datasets of a
+split: the voxel datasets, the labels, the source names and the
+mesh hashes.
+"""
+def sample_dataset_names(split, box_sizes):
+    return ([mat_dataset_name(split, size, box_sizes) for size in box_sizes] +
+            [split + "_label", split + "_source", split + "_hash"])
+
+
+
+"""
+This function converts each MAT data of one split into a voxel grid
+at the largest box size, derives the smaller box sizes from it by
+max pooling, and stores all of them in the hdf5 file. The grids
+come from the worker pool in order; grids, labels, source names and
+mesh hashes are buffered and written in contiguous slabs.
+
+Only samples that could be voxelized are written, one after the
+other, so the datasets hold no empty rows; once the split is
+complete they are trimmed to the number of samples written.
+
+Only the samples not yet marked in the split's committed bitmap
+are processed. Every CHECKPOINT_INTERVAL samples the buffers are
+written out, the processed samples (including the ones that could
+not be voxelized) are marked in the bitmap, the number of samples
+written so far is stored in its 'count' attribute and the file is
+flushed, so a crash loses at most one interval of work.
+
+The stage times of every sample, including the write, are added to
+the run report if one is given.
+"""
+def write_split(hdf5_file, split, title, split_addrs, split_labels, voxelizer, box_sizes, stores, cache,
+                report=None):
+    done_dataset = hdf5_file[split + "_done"]
+    done = done_dataset[()]
+    todo = np.flatnonzero(done == 0)
+    count = int(done_dataset.attrs.get('count', 0))
+    if len(todo) < len(done):
+        print('%s: resuming with %d of %d samples left' % (title, len(todo), len(done)))
+    voxel_writers = {size: voxel_hdf5.SlabWriter(hdf5_file[mat_dataset_name(split, size, box_sizes)])
+                     for size in box_sizes}
+    label_writer = voxel_hdf5.SlabWriter(hdf5_file[split + "_label"])
+    source_writer = voxel_hdf5.SlabWriter(hdf5_file[split + "_source"])
+    hash_writer = voxel_hdf5.SlabWriter(hdf5_file[split + "_hash"])
+    writers = list(voxel_writers.values()) + [label_writer, source_writer, hash_writer]
+
+    def checkpoint(last):
+        start = time.perf_counter()
+        for writer in writers:
+            writer.flush()
+        done[todo[:last]] = 1
+        done_dataset[...] = done
+        done_dataset.attrs['count'] = count
+        hdf5_file.flush()
+        if report is not None:
+            report.add_time('checkpoint', time.perf_counter() - start)
+
+    written = count
+    results = voxelizer.imap([split_addrs[i] for i in todo])
+    for n, (i, (pyramid, cache_hit, digest, stats)) in enumerate(zip(todo, results)):
+        if n % 50 == 0:
+            # Samples done so far, including those of an earlier run
+            run_report.logger.info('%s writing has finished: %d/%d', title, len(done) - len(todo) + n,
+                                   len(split_addrs))
+        if n > 0 and n % CHECKPOINT_INTERVAL == 0:
+            checkpoint(n)
+        if cache is not None and cache_hit is not None:
+            cache.record(cache_hit, cache.entry_bytes(max(box_sizes)) if pyramid is not None else 0)
+
+        source = address_name(split_addrs[i], stores)
+        if pyramid is not None:
+            start = time.perf_counter()
+            for size, grid in pyramid.items():
+                voxel_writers[size].write(count, grid)
+            label_writer.write(count, split_labels[i])
+            source_writer.write(count, source)
+            hash_writer.write(count, digest)
+            count += 1
+            stats['timings']['write'] = time.perf_counter() - start
+        else:
+            run_report.logger.debug('%s: %s could not be voxelized', title, source)
+        if report is not None:
+            report.add_sample(source, stats['timings'], stats['faces'], stats['rss'])
+    checkpoint(len(todo))
+    if report is not None:
+        report.count(split + '_written', count - written)
+        report.count(split + '_failed', len(todo) - (count - written))
+    for name in sample_dataset_names(split, box_sizes):
+        hdf5_file[name].resize(count, axis=0)
+    hdf5_file.flush()
+    print('%s writing has finished: %d of %d samples written' % (title, count, len(split_addrs)))
+
+
+
+"""
+This function asks for the hdf5 file name, without the suffix, and
+returns it with the suffix.
+"""
+def ask_hdf5_filename():
+    # Default file name if user input is invalid
+    default_filename = "object40"
+
+    # Ask the user to input the hdf5 filename to use
+    try:
+        hdf5_filename = input(f"Please enter the name of hdf5 file to save dataset to without \".htf5\" (Default file name is '{default_filename}'): ").strip()
+        if not hdf5_filename:
+            hdf5_filename = default_filename
+        if hdf5_filename.endswith('.hdf5'):
+            # Remove the '.hdf5' suffix
+            hdf5_filename = hdf5_filename[:-5]
+        # Validate the user input
+    except Exception as e:
+        # If there's any problem, use the default filename
+        print(f"Invalid file name. Using default file name '{default_filename}'.")
         hdf5_filename = default_filename
-    if hdf5_filename.endswith('.hdf5'):
-        # Remove the '.hdf5' suffix
-        hdf5_filename = hdf5_filename[:-5]
+
+    return hdf5_filename + ".hdf5"
+
+
+
+"""
+This function asks for the number of voxelization worker processes.
+"""
+def ask_workers():
+    default_workers = os.cpu_count() or 1
+    try:
+        # Ask the user for the number of voxelization worker processes
+        workers = int(input(f"Please enter the number of worker processes (Default Value is {default_workers}): ") or default_workers)
+        if workers < 1:
+            raise ValueError("at least one worker is needed")
+    except ValueError:
+        print(f"Invalid input. Using default number of workers '{default_workers}'.")
+        workers = default_workers
+    return workers
+
+
+
+"""
+This function collects the sample addresses and labels of the train
+and test splits in the input path, which is either a directory with
+the two packed mesh stores or a category/train, category/test tree
+of MAT or OFF files (listed through its dataset index, kept at
+index_path; read_only keeps the index file as it is). Only the
+categories selected by the category filter are collected, labelled
+in sorted order. It returns the (address, label) pairs of both
+splits, the category -> label map and the mesh store paths (empty
+for a directory tree).
+"""
+def collect_samples(input_path, category_filter=None, index_path=None, read_only=False):
+    label = {}
+
+    combine_train = []
+    combine_test = []
+
+    store_paths = {}
+    train_store_path = mesh_store.split_path(input_path, 'train')
+    test_store_path = mesh_store.split_path(input_path, 'test')
+    if os.path.isfile(train_store_path) and os.path.isfile(test_store_path):
+        # Collect (split, index) addresses and labels from the mesh stores,
+        # relabelling the selected categories
+        store_paths = {'train': train_store_path, 'test': test_store_path}
+        train_store = mesh_store.MeshStore(train_store_path)
+        test_store = mesh_store.MeshStore(test_store_path)
+        store_labels = {}
+        for store_label, item in enumerate(train_store.categories):
+            if category_filter is None or category_filter.matches(item):
+                store_labels[store_label] = label[item] = len(label)
+                print('Training data for %s: %d' % (item, np.count_nonzero(train_store.labels == store_label)))
+                print('Testing data for %s: %d' % (item, np.count_nonzero(test_store.labels == store_label)))
+        combine_train = [(('train', i), store_labels[int(l)]) for i, l in enumerate(train_store.labels)
+                         if int(l) in store_labels]
+        combine_test = [(('test', i), store_labels[int(l)]) for i, l in enumerate(test_store.labels)
+                        if int(l) in store_labels]
+    else:
+        # Collect and label data addresses from the dataset index. Its
+        # listings are sorted, so the labels and the seeded shuffle do
+        # not depend on the file system's listing order.
+        index = dataset_index.DatasetIndex(input_path, index_path, read_only=read_only)
+        index.report()
+        for current_label, item in enumerate(index.categories(category_filter)):
+            label[item] = current_label
+
+            # Retrieve the file paths and labels for training and
+            # testing data and put them into lists for further
+            # processing.
+            train_addrs = index.paths(item, 'train', '.mat') or index.paths(item, 'train', '.off')
+            test_addrs = index.paths(item, 'test', '.mat') or index.paths(item, 'test', '.off')
+            print('Training data for %s: %d' % (item, len(train_addrs)))
+            print('Testing data for %s: %d' % (item, len(test_addrs)))
+            combine_train += [(addr, current_label) for addr in train_addrs]
+            combine_test += [(addr, current_label) for addr in test_addrs]
+
+    return combine_train, combine_test, label, store_paths
+
+
+
+"""
+This function returns the sorted, distinct voxel sizes of a dataset,
+checking that every size divides the largest one.
+"""
+def check_box_sizes(box_sizes):
+    box_sizes = sorted(set(int(size) for size in box_sizes))
+    if not box_sizes or any(size <= 0 or box_sizes[-1] % size != 0 for size in box_sizes):
+        raise ValueError(f"Invalid voxel sizes {box_sizes}: every size must divide the largest one")
+    return box_sizes
+
+
+
+"""
+This function collects and splits the input data and checks the
+voxelization and storage parameters. It returns the run plan: a
+dict with the parameters under 'params' and, under 'splits', the
+shuffled addresses and labels of every split. The shuffle and the
+test/validation split are seeded, so the same input always gives
+the same plan. With shard=(i, N), only shard i of N is kept (see
+shard_run_plan).
+"""
+def make_run_plan(input_path, box_sizes=(32,), backend='trimesh', fill=False, cache_path=None, packed=False,
+                  compression=voxel_hdf5.DEFAULT_COMPRESSION, category_filter=None, index_path=None, shard=None,
+                  cache_size=voxel_cache.DEFAULT_MAX_BYTES):
+    from sklearn.model_selection import train_test_split
+    import mat_to_voxel_converter
+
+    box_sizes = check_box_sizes(box_sizes)
+    if backend not in mat_to_voxel_converter.VOXELIZERS:
+        raise ValueError(f"Unknown voxelization backend '{backend}', expected one of {sorted(mat_to_voxel_converter.VOXELIZERS)}")
+    if compression not in voxel_hdf5.COMPRESSION_FILTERS:
+        raise ValueError(f"Unknown compression filter '{compression}', expected one of {voxel_hdf5.COMPRESSION_FILTERS}")
+
+    combine_train, combine_test, label, store_paths = collect_samples(input_path, category_filter, index_path)
+    if not combine_train or not combine_test:
+        raise ValueError(f"No training or testing samples found in {input_path}")
+
+    rng = random.Random(SEED)
+    rng.shuffle(combine_train)
+    rng.shuffle(combine_test)
+
+    mat_train, train_label = zip(*combine_train)
+    mat_test, test_label = zip(*combine_test)
+
+    # split test data into test data and validation data
+    mat_test, mat_val, test_label, val_label = train_test_split(mat_test, test_label, test_size=0.5,
+                                                                random_state=SEED)
+
+    print('Total training example: %d' % (len(mat_train)))
+    print('Total testing example: %d' % (len(mat_test)))
+    print('Total validation example: %d' % (len(mat_val)))
+
+    params = {'input_path': input_path, 'seed': SEED, 'box_sizes': box_sizes, 'backend': backend, 'fill': fill,
+              'cache_path': cache_path, 'cache_size': cache_size, 'packed': packed, 'compression': compression, 'store_paths': store_paths,
+              'category_filter': category_filter.to_dict() if category_filter else None, 'categories': label}
+    splits = {split: {'addresses': list(addrs), 'labels': [int(l) for l in split_labels]}
+              for split, addrs, split_labels in (("train", mat_train, train_label), ("test", mat_test, test_label),
+                                                 ("val", mat_val, val_label))}
+    plan = {'params': params, 'splits': splits}
+    if shard is not None:
+        plan = shard_run_plan(plan, *shard)
+    return plan
+
+
+
+"""
+This function parses a shard given as 'i/N', shard i of N counted
+from 0, and returns (i, N).
+"""
+def parse_shard(value):
+    try:
+        shard, num_shards = (int(part) for part in str(value).split('/'))
+    except ValueError:
+        raise ValueError(f"Invalid shard '{value}', expected i/N, e.g. 0/4")
+    if not 0 <= shard < num_shards:
+        raise ValueError(f"Invalid shard '{value}', i must be between 0 and N-1")
+    return shard, num_shards
+
+
+
+"""
+This function returns the file name of one shard of an hdf5 file,
+e.g. object40-00002-of-00004.hdf5 for shard 2 of 4 of object40.hdf5.
+"""
+def shard_filename(hdf5_filename, shard, num_shards):
+    base = hdf5_filename[:-5] if hdf5_filename.endswith('.hdf5') else hdf5_filename
+    return '%s-%05d-of-%05d.hdf5' % (base, shard, num_shards)
+
+
+
+"""
+This function returns the sorted file names of the shards of an hdf5
+file found next to it.
+"""
+def find_shards(hdf5_filename):
+    base = hdf5_filename[:-5] if hdf5_filename.endswith('.hdf5') else hdf5_filename
+    return sorted(glob.glob(glob.escape(base) + '-[0-9][0-9][0-9][0-9][0-9]-of-[0-9][0-9][0-9][0-9][0-9].hdf5'))
+
+
+
+"""
+This function returns the plan of shard i of N of a run plan. The
+shard gets a contiguous range of every split of the shuffled plan,
+so the shards are disjoint, of nearly equal size, and concatenated
+in shard order give back the whole plan. The shard and the start of
+its range in every split are recorded under params['shard'].
+"""
+def shard_run_plan(plan, shard, num_shards):
+    params = dict(plan['params'])
+    splits = {}
+    offsets = {}
+    for split, split_plan in plan['splits'].items():
+        n_samples = len(split_plan['addresses'])
+        start, stop = n_samples * shard // num_shards, n_samples * (shard + 1) // num_shards
+        splits[split] = {'addresses': split_plan['addresses'][start:stop], 'labels': split_plan['labels'][start:stop]}
+        offsets[split] = start
+    params['shard'] = {'index': shard, 'count': num_shards, 'offsets': offsets}
+    return {'params': params, 'splits': splits}
+
+
+
+"""
+This function asks for the input path and the voxelization and
+storage parameters and returns the run plan for them, or for one
+shard of it.
+"""
+def ask_run_plan(shard=None):
+    import mat_to_voxel_converter
+
+    # Default path if user input is invalid
+    default_path = 'ModelNet40/ModelNet40_Mat'
+
+    # Ask the user to input the directory path
+    input_path = input(f"Please enter the directory path containing MAT, OFF or mesh store data (Default Path is '{default_path}'): ")
+
     # Validate the user input
-except Exception as e:
-    # If there's any problem, use the default filename
-    print(f"Invalid file name. Using default file name '{default_filename}'.")
-    hdf5_filename = default_filename
-
-hdf5_filename += ".hdf5"
-print(f"creating new hdf5 file: {hdf5_filename}")
-hdf5_file = h5py.File(hdf5_filename, "w")
-hdf5_file.create_dataset("train_mat", train_shape, np.int8)
-hdf5_file.create_dataset("test_mat", test_shape, np.int8)
-hdf5_file.create_dataset("val_mat", val_shape, np.int8)
-
-hdf5_file.create_dataset("train_label", (len(train_label), 1), np.int8)
-hdf5_file.create_dataset("test_label",  (len(test_label), 1), np.int8)
-hdf5_file.create_dataset("val_label",   (len(val_label), 1), np.int8)
-
-#voxels = np.zeros((box_size, box_size, box_size)) #32, 32, 32
-
-# Convert each training MAT data into voxel grid and store in hdf5 file
-for i in range(len(mat_train)):
-    if i % 50 == 0:
-        print('Training writing has finished: %d/%d' % (i, len(mat_train)))
-    mat = scipy.io.loadmat(mat_train[i])
-    vertices = mat['vertices']
-    faces = mat['faces']
-    
-    train_voxels = mat_to_voxel_converter.convert_mat_to_voxel(vertices, faces, box_size)   
-    
-    if train_voxels is not None and train_voxels.size > 0:
-        hdf5_file["train_mat"][i, ...] = train_voxels
-        hdf5_file["train_label"][i] = train_label[i]
-        train_file.write("%s, %d\n" % (mat_train[i], train_label[i]))
-print('Training writing has finished...')
-
-# Convert each testing MAT data into voxel grid and store in hdf5 file
-for j in range(len(mat_test)):
-    if j % 50 == 0:
-        print('Testing writing has finished: %d/%d' % (j, len(mat_test)))
-    mat = scipy.io.loadmat(mat_test[j])
-    vertices = mat['vertices']
-    faces = mat['faces']
-    
-    test_voxels = mat_to_voxel_converter.convert_mat_to_voxel(vertices, faces, box_size)
-    
-    if test_voxels is not None and test_voxels.size > 0:
-        hdf5_file["test_mat"][j, ...] = test_voxels
-        hdf5_file["test_label"][j] = test_label[j]
-        test_file.write("%s, %d\n" % (mat_test[j], test_label[j]))
-print('Testing writing has finished...')
-
-# Convert each validation MAT data into voxel grid and store in hdf5 file
-for k in range(len(mat_val)):
-    if k % 50 == 0:
-        print('Validation writing has finished: %d/%d' % (k, len(mat_val)))
-    mat = scipy.io.loadmat(mat_val[k])
-    vertices = mat['vertices']
-    faces = mat['faces']
-    
-    val_voxels = mat_to_voxel_converter.convert_mat_to_voxel(vertices, faces, box_size)
-    
-    if val_voxels is not None and val_voxels.size > 0:
-        hdf5_file["val_mat"][k, ...] = val_voxels
-        hdf5_file["val_label"][k] = val_label[k]
-        val_file.write("%s, %d\n" % (mat_val[k], val_label[k]))
-print('Validation writing has finished...')
-print("End of Program")
\ No newline at end of file
+    if not os.path.isdir(input_path):
+        print(f"Invalid directory. Using default path: {default_path}")
+        input_path = default_path
+
+    # Ask the user which categories to use
+    filter_path = input("Please enter a category filter file, a JSON file with 'include' and/or 'exclude' category lists (Default uses every category): ").strip()
+    category_filter = None
+    if filter_path:
+        try:
+            category_filter = dataset_index.CategoryFilter.from_file(filter_path)
+        except (OSError, ValueError) as e:
+            print(f"Invalid category filter file: {e}. Using every category.")
+
+    default_box_size = 32
+    try:
+        # Ask the user to input one or more numbers
+        box_sizes = input(f"Please enter the target voxel size, or several comma separated sizes for a multi-resolution dataset (Default Value is {default_box_size}): ")
+        box_sizes = sorted({int(float(size)) for size in box_sizes.split(',')})
+        box_size = box_sizes[-1]
+        if any(size <= 0 or box_size % size != 0 for size in box_sizes):
+            raise ValueError("every voxel size must divide the largest one")
+    except ValueError:
+        # If there's any problem with the input (e.g., it's not a number), use 32 as the default value
+        print(f"Invalid input. Using default box size value of '{default_box_size}'.")
+        box_sizes = [default_box_size]
+        box_size = default_box_size
+
+    default_backend = 'trimesh'
+    # Ask the user to choose the voxelization backend
+    backend = input(f"Please enter the voxelization backend, one of {sorted(mat_to_voxel_converter.VOXELIZERS)} (Default backend is '{default_backend}'): ").strip() or default_backend
+    if backend not in mat_to_voxel_converter.VOXELIZERS:
+        print(f"Invalid backend. Using default backend '{default_backend}'.")
+        backend = default_backend
+
+    # Ask the user whether the voxel grids should be solid or surface only
+    fill = input("Please enter 'y' to fill the interior of the voxel grids (Default is surface only): ").strip().lower() in ('y', 'yes')
+
+    default_cache_path = '.voxel_cache'
+    # Ask the user where to cache voxelization results between runs
+    cache_path = input(f"Please enter the voxel cache directory, or 'none' to disable caching (Default Path is '{default_cache_path}'): ").strip() or default_cache_path
+    if cache_path.lower() == 'none':
+        cache_path = None
+    cache_size = voxel_cache.DEFAULT_MAX_BYTES
+    if cache_path is not None:
+        # Ask the user for the bound of the cache size
+        default_cache_gb = voxel_cache.DEFAULT_MAX_BYTES / 1024 ** 3
+        try:
+            cache_gb = float(input(f"Please enter the voxel cache size in GB (Default size is {default_cache_gb:g}): ").strip() or default_cache_gb)
+            if cache_gb <= 0:
+                raise ValueError("the cache size must be positive")
+            cache_size = int(cache_gb * 1024 ** 3)
+        except ValueError:
+            print(f"Invalid input. Using default cache size of {default_cache_gb:g} GB.")
+
+    # Ask the user whether to store the voxel grids bit packed and compressed
+    packed = input("Please enter 'y' to store bit-packed voxel grids (Default is one byte per voxel): ").strip().lower() in ('y', 'yes')
+
+    # Ask the user for the HDF5 compression filter
+    default_compression = voxel_hdf5.DEFAULT_COMPRESSION
+    compression = input(f"Please enter the hdf5 compression filter, 'gzip', 'lzf' or 'none' (Default filter is '{default_compression}'): ").strip().lower() or default_compression
+    if compression == 'none':
+        compression = None
+    elif compression not in voxel_hdf5.COMPRESSION_FILTERS:
+        print(f"Invalid compression filter. Using default filter '{default_compression}'.")
+        compression = default_compression
+
+    return make_run_plan(input_path, box_sizes, backend, fill, cache_path, packed, compression, category_filter,
+                         shard=shard, cache_size=cache_size)
+
+
+
+"""
+This function creates a new hdf5 file for a run plan, with the voxel,
+label, source name and mesh hash datasets, an all-zero committed
+bitmap per split and the run plan itself. The per-sample datasets
+have room for every sample of the split and are trimmed when the
+split is complete.
+"""
+def create_hdf5_file(hdf5_filename, plan):
+    params = plan['params']
+    box_sizes = params['box_sizes']
+    compression = params['compression']
+    hdf5_file = h5py.File(hdf5_filename, "w")
+    for split, _ in SPLITS:
+        n_samples = len(plan['splits'][split]['addresses'])
+        for size in box_sizes:
+            voxel_hdf5.create_voxel_dataset(hdf5_file, mat_dataset_name(split, size, box_sizes), n_samples, size,
+                                            packed=params['packed'], compression=compression, resizable=True)
+        voxel_hdf5.create_sample_dataset(hdf5_file, split + "_label", n_samples, (1,), np.int8, compression,
+                                         resizable=True)
+        voxel_hdf5.create_sample_dataset(hdf5_file, split + "_source", n_samples, (), h5py.string_dtype(),
+                                         compression, resizable=True)
+        voxel_hdf5.create_sample_dataset(hdf5_file, split + "_hash", n_samples, (), 'S64', compression,
+                                         resizable=True)
+        hdf5_file.create_dataset(split + "_done", (n_samples,), np.uint8)
+    save_run_plan(hdf5_file, plan)
+    hdf5_file.flush()
+    return hdf5_file
+
+
+
+"""
+This function voxelizes a run plan into a new hdf5 file or, when no
+plan is given, resumes the interrupted run recorded in an existing
+hdf5 file.
+
+The run report is written to report_path (by default the hdf5 file
+name with the suffix .report.json; False to skip it), also when the
+run fails. profile_path and trace_memory turn on cProfile and
+tracemalloc for the calling process (see run_report.profiled), and
+log_level sets the pipeline log level of the workers as well.
+"""
+def run(hdf5_filename, plan=None, workers=None, report_path=None, profile_path=None, trace_memory=False,
+        log_level=None):
+    if log_level is not None:
+        run_report.set_log_level(log_level)
+    if report_path is None:
+        report_path = (hdf5_filename[:-5] if hdf5_filename.endswith('.hdf5') else hdf5_filename) + '.report.json'
+    report = run_report.RunReport()
+    report.extra['status'] = 'failed'
+    try:
+        with run_report.profiled(report, profile_path, trace_memory):
+            voxelize_plan(hdf5_filename, plan, workers, report, log_level)
+        report.extra['status'] = 'complete'
+    finally:
+        if report_path:
+            report.write(report_path)
+            print(f"run report written to {report_path}")
+    report.print_summary()
+
+
+
+"""
+This function does the work of run, adding to its run report.
+"""
+def voxelize_plan(hdf5_filename, plan, workers, report, log_level=None):
+    import parallel_voxelizer
+
+    if plan is None:
+        # Continue an interrupted run with the plan stored in its file
+        print(f"resuming hdf5 file: {hdf5_filename}")
+        hdf5_file = h5py.File(hdf5_filename, "r+")
+        try:
+            plan = load_resumable_plan(hdf5_file)
+        except ValueError:
+            hdf5_file.close()
+            raise
+    else:
+        # Create hdf5 file and create datasets to store training,
+        # testing and validation datasets
+        print(f"creating new hdf5 file: {hdf5_filename}")
+        hdf5_file = create_hdf5_file(hdf5_filename, plan)
+
+    params = plan['params']
+    box_sizes = params['box_sizes']
+    stores = {split: mesh_store.MeshStore(path) for split, path in params['store_paths'].items()}
+    # Plans written before the cache size was an option use the default
+    cache_size = params.get('cache_size', voxel_cache.DEFAULT_MAX_BYTES)
+    cache = voxel_cache.VoxelCache(params['cache_path'], cache_size) if params['cache_path'] else None
+
+    config = {'box_sizes': box_sizes, 'backend': params['backend'], 'fill': params['fill'],
+              'cache_path': params['cache_path'], 'store_paths': params['store_paths'], 'log_level': log_level}
+    report.extra['file'] = os.path.abspath(hdf5_filename)
+    report.extra['params'] = {name: value for name, value in params.items() if name != 'categories'}
+    try:
+        with parallel_voxelizer.ParallelVoxelizer(config, workers) as voxelizer:
+            report.extra['workers'] = voxelizer.workers
+            for split, title in SPLITS:
+                split_plan = plan['splits'][split]
+                write_split(hdf5_file, split, title, split_plan['addresses'], split_plan['labels'], voxelizer,
+                            box_sizes, stores, cache, report)
+    finally:
+        hdf5_file.close()
+    if cache is not None:
+        cache.report()
+        report.count('cache_hits', cache.hits)
+        report.count('cache_misses', cache.misses)
+
+
+
+"""
+This function reads the run plans and per-split sample counts of the
+shard files of one run, checking that they are the N complete shards
+of the same plan. It returns them sorted by shard as (file name,
+plan, counts) triples.
+"""
+def check_shards(shard_filenames):
+    if not shard_filenames:
+        raise ValueError("No shard files to merge")
+    shards = []
+    for filename in shard_filenames:
+        with h5py.File(filename, 'r') as hdf5_file:
+            plan = load_resumable_plan(hdf5_file)
+            if 'shard' not in plan['params']:
+                raise ValueError(f"{filename} is not a shard file")
+            counts = {}
+            for split, _ in SPLITS:
+                done = hdf5_file[split + "_done"]
+                if not done[()].all():
+                    raise ValueError(f"{filename} is not complete, resume it before merging")
+                counts[split] = int(done.attrs.get('count', 0))
+        shards.append((filename, plan, counts))
+    shards.sort(key=lambda shard: shard[1]['params']['shard']['index'])
+
+    num_shards = shards[0][1]['params']['shard']['count']
+    indices = [plan['params']['shard']['index'] for _, plan, _ in shards]
+    if indices != list(range(num_shards)):
+        raise ValueError(f"Expected each of the shards 0 to {num_shards - 1} once, got {indices}")
+    # Apart from the shard and the local paths, which may differ between
+    # machines, every shard must come from the same plan
+    common = [{name: value for name, value in plan['params'].items() if name not in LOCAL_PARAMS}
+              for _, plan, _ in shards]
+    for (filename, plan, _), params in zip(shards, common):
+        if plan['params']['shard']['count'] != num_shards or params != common[0]:
+            raise ValueError(f"{filename} was not written with the same parameters as {shards[0][0]}")
+    return shards
+
+
+
+"""
+This function merges the complete shard files of a run into one
+hdf5 file. Every per-sample dataset of the merged file is a virtual
+dataset concatenating the shards' datasets in shard order, so no
+voxel data is copied and the samples come in the order of a single
+unsharded run. The shard files are referenced by paths relative to
+the merged file and must stay next to it.
+
+The merged file holds the run plan of the whole run, and a
+'shards' manifest: a JSON string with, for every shard, its file
+name and the offset and number of samples of each split in the
+merged datasets.
+"""
+def merge_shards(hdf5_filename, shard_filenames):
+    shards = check_shards(shard_filenames)
+    params = {name: value for name, value in shards[0][1]['params'].items() if name != 'shard'}
+    box_sizes = params['box_sizes']
+    directory = os.path.dirname(os.path.abspath(hdf5_filename))
+    sources = [os.path.relpath(os.path.abspath(filename), directory) for filename, _, _ in shards]
+
+    manifest = [{'file': source, 'shard': plan['params']['shard']['index'], 'offsets': {}, 'counts': counts}
+                for source, (_, plan, counts) in zip(sources, shards)]
+    splits = {}
+    print(f"merging {len(shards)} shards into {hdf5_filename}")
+    with h5py.File(hdf5_filename, 'w') as hdf5_file:
+        for split, title in SPLITS:
+            offset = 0
+            for entry in manifest:
+                entry['offsets'][split] = offset
+                offset += entry['counts'][split]
+            with h5py.File(shards[0][0], 'r') as first:
+                templates = {name: (first[name].shape[1:], first[name].dtype, dict(first[name].attrs))
+                             for name in sample_dataset_names(split, box_sizes)}
+            for name, (shape, dtype, attrs) in templates.items():
+                layout = h5py.VirtualLayout((offset,) + shape, dtype)
+                for source, entry in zip(sources, manifest):
+                    count = entry['counts'][split]
+                    if count:
+                        start = entry['offsets'][split]
+                        layout[start:start + count] = h5py.VirtualSource(source, name, (count,) + shape)
+                dataset = hdf5_file.create_virtual_dataset(name, layout)
+                dataset.attrs.update(attrs)
+            splits[split] = {key: [value for _, plan, _ in shards for value in plan['splits'][split][key]]
+                             for key in ('addresses', 'labels')}
+            print('%s: %d samples' % (title, offset))
+        save_run_plan(hdf5_file, {'params': params, 'splits': splits})
+        hdf5_file.create_dataset("shards", data=json.dumps(manifest))
+
+
+
+def main():
+    run_report.set_log_level('INFO')
+    shard = None
+    if '--shard' in sys.argv[1:]:
+        position = sys.argv.index('--shard')
+        shard = parse_shard(sys.argv[position + 1] if position + 1 < len(sys.argv) else '')
+    if '--resume' in sys.argv[1:]:
+        hdf5_filename = ask_hdf5_filename()
+        workers = ask_workers()
+        if shard is not None:
+            hdf5_filename = shard_filename(hdf5_filename, *shard)
+        run(hdf5_filename, workers=workers)
+    else:
+        plan = ask_run_plan(shard)
+        workers = ask_workers()
+        hdf5_filename = ask_hdf5_filename()
+        if shard is not None:
+            hdf5_filename = shard_filename(hdf5_filename, *shard)
+        run(hdf5_filename, plan, workers)
+    print("End of Program")
+
+
+# The guard keeps worker processes from re-running the prompts
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+@author: ken
+"""
+
+
+"""
+This module instruments a voxelization run of prepare_voxel_data.
+
+RunReport collects the wall-clock time of every stage of every
+sample (load, normalize, voxelize, pad, fill, pyramid and write, or
+cache for a voxel cache hit), the peak resident memory of the
+calling process and of the workers, and the slowest meshes with
+their face counts. At the end of the run it is written as a JSON
+file with, per stage, the count, total, mean, percentiles and a
+histogram of the times over fixed logarithmic bins, so reports of
+different runs can be compared bin by bin.
+
+profiled() optionally runs the calling process under cProfile
+and/or tracemalloc and adds their results to the report. Workers
+are not profiled; run with a single worker to profile every stage
+in one process.
+
+Progress and per-sample messages of the pipeline go through the
+'voxel_pipeline' logger; set_log_level('WARNING') makes the hot
+path silent.
+"""
+
+
+import contextlib
+import cProfile
+import heapq
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak memory is then not reported
+    resource = None
+
+
+LOGGER_NAME = 'voxel_pipeline'
+LOG_LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+# Upper edges, in seconds, of the stage time histogram bins; the
+# last bin takes everything slower
+HISTOGRAM_EDGES = [1e-4 * 10 ** (k / 4) for k in range(21)]
+SLOWEST_SAMPLES = 10
+PROFILE_LINES = 25
+
+logger = logging.getLogger(LOGGER_NAME)
+
+
+
+"""
+This function sets the level of the pipeline logger, by name or
+number, and gives it a plain message handler the first time.
+"""
+def set_log_level(level):
+    if isinstance(level, str):
+        if level.upper() not in LOG_LEVELS:
+            raise ValueError(f"Unknown log level '{level}', expected one of {LOG_LEVELS}")
+        level = getattr(logging, level.upper())
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.propagate = False
+    logger.setLevel(level)
+
+
+
+"""
+This function returns the peak resident set size of this process
+in bytes, or None where it is not available.
+"""
+def peak_rss():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+
+"""
+This function summarizes a list of stage times.
+"""
+def summarize_times(times):
+    times = np.asarray(times, dtype=np.float64)
+    counts = np.bincount(np.searchsorted(HISTOGRAM_EDGES, times), minlength=len(HISTOGRAM_EDGES) + 1)
+    return {'count': len(times), 'total': float(times.sum()), 'mean': float(times.mean()),
+            'p50': float(np.percentile(times, 50)), 'p90': float(np.percentile(times, 90)),
+            'p99': float(np.percentile(times, 99)), 'max': float(times.max()),
+            'histogram': [int(count) for count in counts]}
+
+
+
+"""
+This class collects the stage times, memory peaks and slowest
+samples of a run.
+"""
+class RunReport:
+
+    def __init__(self, slowest=SLOWEST_SAMPLES):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.slowest_limit = slowest
+        self.slowest = []
+        self.worker_peak_rss = None
+        self.counters = {}
+        self.extra = {}
+
+    def add_time(self, stage, seconds):
+        self.stages.setdefault(stage, []).append(seconds)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_sample(self, name, timings, faces=None, worker_rss=None):
+        # timings is the stage -> seconds dict measured for one sample
+        for stage, seconds in timings.items():
+            self.add_time(stage, seconds)
+        if worker_rss is not None:
+            self.worker_peak_rss = max(self.worker_peak_rss or 0, worker_rss)
+        entry = (sum(timings.values()), name, faces)
+        if len(self.slowest) < self.slowest_limit:
+            heapq.heappush(self.slowest, entry)
+        elif entry[0] > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def to_dict(self):
+        return {'wall_time': time.perf_counter() - self.started,
+                'peak_rss': peak_rss(),
+                'worker_peak_rss': self.worker_peak_rss,
+                'counters': self.counters,
+                'histogram_edges': HISTOGRAM_EDGES,
+                'stages': {stage: summarize_times(times) for stage, times in self.stages.items()},
+                'slowest': [{'sample': name, 'seconds': seconds, 'faces': faces}
+                            for seconds, name, faces in sorted(self.slowest, reverse=True)],
+                **self.extra}
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=1)
+
+    def print_summary(self):
+        print("%-10s %8s %10s %10s %10s %10s" % ("stage", "count", "total", "p50", "p90", "max"))
+        for stage, summary in self.to_dict()['stages'].items():
+            print("%-10s %8d %9.1fs %8.1fms %8.1fms %8.1fms" % (stage, summary['count'], summary['total'],
+                                                                summary['p50'] * 1000, summary['p90'] * 1000,
+                                                                summary['max'] * 1000))
+        for seconds, name, faces in sorted(self.slowest, reverse=True)[:5]:
+            print("slow: %.2fs %s (%s faces)" % (seconds, name, faces))
+
+
+
+"""
+This context manager runs its body under cProfile (writing the
+stats to profile_path) and/or tracemalloc, and adds the top
+functions and the traced memory peak and top allocation sites to
+the report.
+"""
+@contextlib.contextmanager
+def profiled(report, profile_path=None, trace_memory=False):
+    profiler = cProfile.Profile() if profile_path else None
+    if trace_memory:
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+            text = io.StringIO()
+            pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(PROFILE_LINES)
+            report.extra['profile'] = {'path': os.path.abspath(profile_path), 'top': text.getvalue()}
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            report.extra['tracemalloc'] = {
+                'current': current, 'peak': peak,
+                'top': [str(stat) for stat in snapshot.statistics('lineno')[:PROFILE_LINES]]}
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+@author: ken
+"""
+
+
+"""
+This module implements a persistent on-disk cache of voxelization
+results, so that re-running prepare_voxel_data with a different
+split seed, output file or category set does not voxelize every
+mesh again.
+
+Entries are content addressed: the key is a SHA-256 hash of the
+mesh vertices and faces together with the voxel size and the
+voxelizer options. Each entry stores the occupancy grid bit packed
+(one bit per voxel) in its own file, sharded into subdirectories
+by the first two hex digits of the key. Meshes that could not be
+voxelized are cached too, as empty entries.
+
+The total size of the cache is bounded; when new entries push it
+over the bound, the least recently used entries (by file mtime,
+which is refreshed on every hit) are evicted. With several worker
+processes sharing one directory, only the owner instance (in the
+process writing the HDF5 file) keeps the total and evicts: workers
+report their misses to it with record(), so the bound holds for the
+cache as a whole.
+"""
+
+
+import hashlib
+import os
+import tempfile
+import numpy as np
+
+
+# Bumped whenever the voxelizers change in a way that alters results
+CACHE_VERSION = 1
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+
+
+"""
+This class is the voxel cache. get() returns a (found, voxels) pair,
+where voxels may be None for a mesh that could not be voxelized;
+an entry of the wrong size (truncated or corrupt) counts as a miss
+and is deleted. put() stores a result. Hit and miss counts are kept
+for report(). An instance with owner=False (a worker) neither scans
+the directory nor evicts.
+"""
+class VoxelCache:
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES, owner=True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.owner = owner
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self.total_bytes = sum(size for _, size, _ in self.entries()) if owner else 0
+
+    @staticmethod
+    def entry_bytes(voxel_size):
+        # Size of the entry of a voxelized mesh, bit packed
+        return -(-voxel_size ** 3 // 8)
+
+    def key(self, vertices, faces, voxel_size, **options):
+        digest = hashlib.sha256()
+        digest.update(repr((CACHE_VERSION, voxel_size, sorted(options.items()))).encode('utf-8'))
+        for array in (vertices, faces):
+            array = np.ascontiguousarray(array)
+            digest.update(repr((array.dtype.str, array.shape)).encode('utf-8'))
+            digest.update(array.tobytes())
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.vox')
+
+    def get(self, key, voxel_size):
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            self.misses += 1
+            return False, None
+        shape = (voxel_size, voxel_size, voxel_size)
+        if data and len(data) != self.entry_bytes(voxel_size):
+            self.discard(path, len(data))
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        # Refresh the mtime so the entry counts as recently used
+        os.utime(path)
+        if not data:
+            return True, None
+        bits = np.frombuffer(data, dtype=np.uint8)
+        return True, np.unpackbits(bits)[:np.prod(shape)].reshape(shape).astype(np.float32)
+
+    def discard(self, path, size):
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        self.total_bytes -= size
+
+    def put(self, key, voxels):
+        data = b'' if voxels is None else np.packbits(voxels > 0).tobytes()
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # An overwritten entry no longer counts towards the total
+        try:
+            old_size = os.path.getsize(path)
+        except OSError:
+            old_size = 0
+        # Write to a temporary file first so concurrent readers never see
+        # a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self.total_bytes += len(data) - old_size
+        if self.owner and self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def entries(self):
+        for shard in os.scandir(self.directory):
+            if shard.is_dir():
+                for entry in os.scandir(shard.path):
+                    if entry.name.endswith('.vox'):
+                        stat = entry.stat()
+                        yield entry.path, stat.st_size, stat.st_mtime
+
+    def evict(self):
+        # Evict down to 90% of the bound so eviction does not run on
+        # every put once the cache is full
+        target = int(self.max_bytes * 0.9)
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        self.total_bytes = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self.total_bytes <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.total_bytes -= size
+            self.evictions += 1
+
+    def record(self, hit, entry_bytes=0):
+        # Counts a lookup made by another process using the same
+        # directory; a miss means that process added an entry
+        if hit:
+            self.hits += 1
+            return
+        self.misses += 1
+        self.total_bytes += entry_bytes
+        if self.owner and self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def report(self):
+        self.total_bytes = sum(size for _, size, _ in self.entries())
+        lookups = self.hits + self.misses
+        hit_rate = 100.0 * self.hits / lookups if lookups else 0.0
+        print(f"Voxel cache {self.directory}: {self.hits} hits, {self.misses} misses "
+              f"({hit_rate:.1f}% hit rate), {self.evictions} evictions, "
+              f"{self.total_bytes / 1024 ** 2:.1f} MB on disk")
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+@author: ken
+"""
+
+
+"""
+This module handles the layout of the voxel datasets in the HDF5
+files written by prepare_voxel_data.
+
+Two layouts are supported:
+
+    dense   (n_samples, size, size, size) int8, one byte per voxel,
+            the original layout
+    packed  (n_samples, size, size, ceil(size / 8)) uint8, the
+            occupancy bits of each sample packed along the last
+            axis
+
+Both layouts are chunked in whole samples (about CHUNK_BYTES per
+chunk) and compressed with a configurable filter (gzip, lzf or none).
+Packed datasets carry the attributes packed=True and voxel_size, so
+readers can tell the layouts apart; read_voxels always returns dense
+arrays whichever layout is stored.
+
+SlabWriter buffers consecutive samples in memory and writes them to
+a dataset in contiguous, chunk-aligned slabs, instead of one h5py
+call per sample.
+"""
+
+
+import numpy as np
+
+
+DEFAULT_COMPRESSION = 'gzip'
+COMPRESSION_FILTERS = ('gzip', 'lzf', None)
+# Target size of one HDF5 chunk and of one SlabWriter buffer
+CHUNK_BYTES = 1024 ** 2
+SLAB_BYTES = 32 * 1024 ** 2
+
+
+
+"""
+This function creates a dataset of n_samples rows of the given 
+sample shape, chunked in whole samples and compressed. An empty 
+dataset is created unchunked, since HDF5 cannot chunk it. With 
+resizable=True the number of rows can be changed later with 
+dataset.resize (e.g. to trim the rows left unused).
+"""
+def create_sample_dataset(hdf5_file, name, n_samples, sample_shape, dtype, compression=DEFAULT_COMPRESSION,
+                          resizable=False):
+    if compression not in COMPRESSION_FILTERS:
+        raise ValueError(f"Unknown compression filter '{compression}', expected one of {COMPRESSION_FILTERS}")
+    shape = (n_samples,) + tuple(sample_shape)
+    if n_samples == 0 and not resizable:
+        return hdf5_file.create_dataset(name, shape, dtype)
+    sample_bytes = int(np.prod(sample_shape)) * np.dtype(dtype).itemsize
+    chunk_samples = max(1, min(n_samples, CHUNK_BYTES // sample_bytes))
+    maxshape = (None,) + tuple(sample_shape) if resizable else None
+    return hdf5_file.create_dataset(name, shape, dtype, chunks=(chunk_samples,) + tuple(sample_shape),
+                                    maxshape=maxshape, compression=compression)
+
+
+
+"""
+This function creates a voxel dataset of n_samples grids of the
+given size, in the dense or the packed layout.
+"""
+def create_voxel_dataset(hdf5_file, name, n_samples, voxel_size, packed=False, compression=DEFAULT_COMPRESSION,
+                         resizable=False):
+    if not packed:
+        return create_sample_dataset(hdf5_file, name, n_samples, (voxel_size, voxel_size, voxel_size), np.int8,
+                                     compression, resizable)
+    sample_shape = (voxel_size, voxel_size, (voxel_size + 7) // 8)
+    dataset = create_sample_dataset(hdf5_file, name, n_samples, sample_shape, np.uint8, compression, resizable)
+    dataset.attrs['packed'] = True
+    dataset.attrs['voxel_size'] = voxel_size
+    return dataset
+
+
+
+"""
+This function reports whether a voxel dataset uses the packed layout.
+"""
+def is_packed(dataset):
+    return bool(dataset.attrs.get('packed', False))
+
+
+
+"""
+This function packs the occupancy bits of one or more voxel grids
+along their last axis.
+"""
+def pack_voxels(voxels):
+    return np.packbits(np.asarray(voxels) > 0, axis=-1)
+
+
+
+"""
+This function unpacks grids packed by pack_voxels back into dense
+int8 occupancy grids of the given size.
+"""
+def unpack_voxels(packed_voxels, voxel_size):
+    voxels = np.unpackbits(packed_voxels, axis=-1)
+    if voxels.shape[-1] != voxel_size:
+        voxels = voxels[..., :voxel_size]
+    return voxels.view(np.int8)
+
+
+
+"""
+This function writes one voxel grid (or a batch of grids, if index
+is a slice) into a voxel dataset, packing it if the dataset uses
+the packed layout.
+"""
+def write_voxels(dataset, index, voxels):
+    dataset[index] = pack_voxels(voxels) if is_packed(dataset) else voxels
+
+
+
+"""
+This function reads a batch of samples (an index, slice or sorted
+index list) from a voxel dataset and returns dense int8 grids,
+unpacking them if the dataset uses the packed layout.
+"""
+def read_voxels(dataset, index=slice(None)):
+    data = dataset[index]
+    if is_packed(dataset):
+        return unpack_voxels(data, int(dataset.attrs['voxel_size']))
+    return data
+
+
+
+"""
+This class buffers samples written to a dataset and flushes them in 
+contiguous slab writes. The buffer covers a window of consecutive 
+indices aligned to the dataset chunks; writing an index outside the 
+window flushes it first. Only the rows that were actually written 
+are flushed, so skipped samples never overwrite data in the file. 
+Voxel grids are packed on the way in for packed datasets. Call 
+flush() (or use the writer as a context manager) when done.
+"""
+class SlabWriter:
+
+    def __init__(self, dataset, slab_bytes=SLAB_BYTES):
+        self.dataset = dataset
+        self.packed = is_packed(dataset)
+        chunk_samples = dataset.chunks[0] if dataset.chunks else 1
+        sample_bytes = max(1, int(np.prod(dataset.shape[1:])) * dataset.dtype.itemsize)
+        chunks_per_slab = max(1, slab_bytes // (sample_bytes * chunk_samples))
+        batch_size = max(1, min(len(dataset), chunk_samples * chunks_per_slab))
+        self.buffer = np.zeros((batch_size,) + dataset.shape[1:], dtype=dataset.dtype)
+        self.filled = np.zeros(batch_size, dtype=bool)
+        self.start = 0
+
+    def write(self, index, value):
+        batch_size = len(self.buffer)
+        if not self.start <= index < self.start + batch_size:
+            self.flush()
+            self.start = index - index % batch_size
+        self.buffer[index - self.start] = pack_voxels(value) if self.packed else value
+        self.filled[index - self.start] = True
+
+    def flush(self):
+        if not self.filled.any():
+            return
+        # Write each run of consecutive filled rows as one slab
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], self.filled.view(np.int8), [0]))))
+        for run_start, run_end in zip(edges[0::2], edges[1::2]):
+            self.dataset[self.start + run_start:self.start + run_end] = self.buffer[run_start:run_end]
+        self.buffer[:] = 0
+        self.filled[:] = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+@author: ken
+"""
+
+
+"""
+This module reads the HDF5 datasets written by prepare_voxel_data
+for training.
+
+Instead of one read per sample, VoxelLoader reads each split in
+contiguous blocks of whole HDF5 chunks, so every chunk is read and
+decompressed exactly once per epoch. Blocks are read on background
+threads, a few blocks ahead of the consumer. For shuffling, the
+order of the blocks is shuffled each epoch and the samples of
+consecutive blocks are mixed in a shuffle buffer before being cut
+into batches; a larger buffer gives a better shuffle at the cost of
+memory.
+
+With several worker processes (e.g. data parallel training), each
+process creates its own loader with its rank and the number of
+processes. The samples are split into disjoint contiguous ranges of
+whole chunks, one per rank (of single samples when there are fewer
+chunks than ranks), and each range is read in blocks. Shorter ranges
+are padded by repeating some of their own samples, so every rank
+yields the same number of batches and no rank waits on another at
+the end of an epoch. The file is opened on first iteration, so
+loaders can be created before forking.
+
+    loader = VoxelLoader('object40.hdf5', 'train', batch_size=32, seed=0)
+    for epoch in range(epochs):
+        loader.set_epoch(epoch)
+        for voxels, labels in loader:
+            ...
+"""
+
+
+import collections
+import concurrent.futures
+import h5py
+import numpy as np
+
+import voxel_hdf5
+
+
+# Target size of one block read, rounded to whole chunks
+BLOCK_BYTES = 8 * 1024 ** 2
+DEFAULT_BUFFER_SIZE = 2048
+
+
+
+"""
+This function returns the name of the voxel dataset of a split in an
+hdf5 file: split_mat for a single voxel size, split_mat_<size> for a
+multi-resolution file (the largest size if none is given).
+"""
+def voxel_dataset_name(hdf5_file, split, voxel_size=None):
+    single = split + "_mat"
+    if single in hdf5_file and (voxel_size is None or hdf5_file[single].shape[1] == voxel_size):
+        return single
+    sizes = sorted(int(name[len(single) + 1:]) for name in hdf5_file
+                   if name.startswith(single + "_") and name[len(single) + 1:].isdigit())
+    if voxel_size is None and sizes:
+        voxel_size = sizes[-1]
+    if voxel_size not in sizes:
+        raise KeyError(f"{hdf5_file.filename} has no {split} voxel dataset of size {voxel_size}")
+    return "%s_%d" % (single, voxel_size)
+
+
+
+"""
+This function returns the (start, stop) sample range of one rank out
+of world_size in a dataset of n_samples rows stored in chunks of
+chunk_size rows. The ranges are disjoint and contiguous, made of
+whole chunks when every rank can have one and of single samples
+otherwise, and their lengths differ by at most one chunk.
+"""
+def rank_range(n_samples, chunk_size, rank=0, world_size=1):
+    unit = chunk_size if -(-n_samples // chunk_size) >= world_size else 1
+    n_units = -(-n_samples // unit)
+    return (min(n_units * rank // world_size * unit, n_samples),
+            min(n_units * (rank + 1) // world_size * unit, n_samples))
+
+
+
+"""
+This function returns the (start, stop) sample ranges of the blocks
+that belong to one rank out of world_size (see rank_range), each at
+most block_size rows long, a multiple of chunk_size. The ranges of a
+rank shorter than the longest one are followed by repeats of its
+own first samples, so every rank gets the same number of samples.
+"""
+def block_ranges(n_samples, block_size, rank=0, world_size=1, chunk_size=1):
+    if 0 < n_samples < world_size:
+        raise ValueError(f"Cannot split {n_samples} samples between {world_size} processes")
+    start, stop = rank_range(n_samples, chunk_size, rank, world_size)
+    ranges = [(first, min(first + block_size, stop)) for first in range(start, stop, block_size)]
+    longest = max(b - a for a, b in (rank_range(n_samples, chunk_size, r, world_size) for r in range(world_size)))
+    missing = longest - (stop - start)
+    while missing > 0:
+        for first, last in list(ranges):
+            last = min(last, first + missing)
+            ranges.append((first, last))
+            missing -= last - first
+            if missing == 0:
+                break
+    return ranges
+
+
+
+"""
+This class is the loader. Iterating over it yields one epoch of
+(voxels, labels) batches: dense int8 grids of shape (n, size, size,
+size) and int64 labels of shape (n,), whatever layout the file uses.
+"""
+class VoxelLoader:
+
+    def __init__(self, path, split='train', batch_size=32, voxel_size=None, shuffle=True,
+                 buffer_size=DEFAULT_BUFFER_SIZE, block_bytes=BLOCK_BYTES, threads=2, prefetch=4, seed=None,
+                 rank=0, world_size=1, drop_last=False):
+        if not 0 <= rank < world_size:
+            raise ValueError(f"Invalid rank {rank} for {world_size} processes")
+        self.path = path
+        self.split = split
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.buffer_size = max(buffer_size, 2 * batch_size)
+        self.threads = threads
+        self.prefetch = max(1, prefetch)
+        self.seed = seed
+        self.epoch = 0
+        self.drop_last = drop_last
+        self.hdf5_file = None
+        with h5py.File(path, 'r') as hdf5_file:
+            self.dataset_name = voxel_dataset_name(hdf5_file, split, voxel_size)
+            dataset = hdf5_file[self.dataset_name]
+            chunk_samples = dataset.chunks[0] if dataset.chunks else 1
+            sample_bytes = max(1, int(np.prod(dataset.shape[1:])) * dataset.dtype.itemsize)
+            self.block_size = chunk_samples * max(1, block_bytes // (sample_bytes * chunk_samples))
+            self.ranges = block_ranges(len(dataset), self.block_size, rank, world_size, chunk_samples)
+        self.n_samples = sum(stop - start for start, stop in self.ranges)
+
+    def __len__(self):
+        if self.drop_last:
+            return self.n_samples // self.batch_size
+        return (self.n_samples + self.batch_size - 1) // self.batch_size
+
+    def set_epoch(self, epoch):
+        # Each epoch gets its own block order and shuffle, reproducible
+        # from the seed
+        self.epoch = epoch
+
+    def open(self):
+        if self.hdf5_file is None:
+            self.hdf5_file = h5py.File(self.path, 'r')
+            self.voxels = self.hdf5_file[self.dataset_name]
+            self.labels = self.hdf5_file[self.split + "_label"]
+        return self
+
+    def close(self):
+        if self.hdf5_file is not None:
+            self.hdf5_file.close()
+            self.hdf5_file = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def read_block(self, block):
+        start, stop = block
+        voxels = voxel_hdf5.read_voxels(self.voxels, slice(start, stop))
+        labels = self.labels[start:stop].reshape(stop - start).astype(np.int64)
+        return voxels, labels
+
+    def blocks(self, ranges):
+        if self.threads <= 0:
+            for block in ranges:
+                yield self.read_block(block)
+            return
+        # Keep up to prefetch blocks in flight on the reader threads
+        with concurrent.futures.ThreadPoolExecutor(self.threads) as executor:
+            pending = collections.deque()
+            for block in ranges:
+                if len(pending) >= self.prefetch:
+                    yield pending.popleft().result()
+                pending.append(executor.submit(self.read_block, block))
+            while pending:
+                yield pending.popleft().result()
+
+    def __iter__(self):
+        self.open()
+        rng = np.random.default_rng(None if self.seed is None else (self.seed, self.epoch))
+        ranges = list(self.ranges)
+        if self.shuffle:
+            ranges = [ranges[i] for i in rng.permutation(len(ranges))]
+        buffer_voxels, buffer_labels = [], []
+        buffered = 0
+        for voxels, labels in self.blocks(ranges):
+            buffer_voxels.append(voxels)
+            buffer_labels.append(labels)
+            buffered += len(labels)
+            if buffered < self.buffer_size:
+                continue
+            voxels = np.concatenate(buffer_voxels)
+            labels = np.concatenate(buffer_labels)
+            if self.shuffle:
+                order = rng.permutation(len(labels))
+                voxels, labels = voxels[order], labels[order]
+            # Emit whole batches, keeping about half a buffer to mix with
+            # the next blocks
+            n_out = (len(labels) - self.buffer_size // 2) // self.batch_size * self.batch_size
+            for first in range(0, n_out, self.batch_size):
+                yield voxels[first:first + self.batch_size], labels[first:first + self.batch_size]
+            buffer_voxels, buffer_labels = [voxels[n_out:]], [labels[n_out:]]
+            buffered = len(labels) - n_out
+        if buffered:
+            voxels = np.concatenate(buffer_voxels)
+            labels = np.concatenate(buffer_labels)
+            if self.shuffle:
+                order = rng.permutation(len(labels))
+                voxels, labels = voxels[order], labels[order]
+            for first in range(0, len(labels), self.batch_size):
+                if self.drop_last and first + self.batch_size > len(labels):
+                    break
+                yield voxels[first:first + self.batch_size], labels[first:first + self.batch_size]
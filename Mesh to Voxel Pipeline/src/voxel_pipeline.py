@@ -0,0 +1,512 @@
+# -*- coding: utf-8 -*-
+"""
+@author: ken
+"""
+
+
+"""
+This module is the non-interactive command line of the pipeline.
+Installed, it is the voxel-pipeline command; from the source tree
+it runs as python voxel_pipeline.py. Subcommands:
+
+    convert         convert a tree of OFF files to MAT files or
+                    packed mesh stores (step 1)
+    voxelize        voxelize MAT, OFF or mesh store data into an
+                    HDF5 dataset, or resume an interrupted run (step 2);
+                    with --shard i/N, only shard i of N
+    merge           merge the shard files of a voxelize run into one
+                    HDF5 file of virtual datasets
+    preview         render a PNG contact sheet of the samples of an
+                    HDF5 file or of an EMNIST target set
+    emnist-simple   create the simple EMNIST extrusion targets
+    emnist-complex  create the complex EMNIST mashup targets
+
+Every option can be given as a flag or in a JSON config file passed
+with --config. The file holds either the options of one subcommand,
+e.g. {"box_sizes": "16,32", "backend": "numpy"}, or a section per
+subcommand, e.g. {"voxelize": {...}, "convert": {...}}. Flags given
+on the command line override the file. --dry-run checks the options
+and the input, and prints what would be done without doing it.
+
+Invalid options are reported as usage errors (exit status 2) by the
+subcommand handlers, before any work is done. Errors found in the
+data while running (a truncated file, a mismatched HDF5 file) are
+printed without the usage message and exit with status 1.
+
+Only the standard library is imported at start up. Each subcommand
+imports the modules it needs, so trimesh and sklearn are loaded only
+by the subcommands that use them and --help or a dry run start
+quickly (see
+benchmarks/benchmark_cli_startup.py).
+"""
+
+
+import argparse
+import json
+import os
+import sys
+
+
+COMMANDS = ('convert', 'voxelize', 'merge', 'preview', 'emnist-simple', 'emnist-complex')
+
+
+
+"""
+This function parses a comma separated list of voxel sizes, also
+accepting a single number or a list (as found in config files).
+"""
+def parse_sizes(value):
+    try:
+        if isinstance(value, (list, tuple)):
+            return [int(size) for size in value]
+        return [int(float(size)) for size in str(value).split(',')]
+    except (TypeError, ValueError):
+        raise argparse.ArgumentTypeError(f"invalid voxel sizes {value!r}, expected e.g. 16,32")
+
+
+
+"""
+This function parses a comma separated list of names, also
+accepting a list (as found in config files).
+"""
+def parse_names(value):
+    if value is None or isinstance(value, (list, tuple)):
+        return value
+    return [name.strip() for name in str(value).split(',') if name.strip()]
+
+
+
+"""
+This function returns function(*args), reporting a ValueError it
+raises as a usage error of the subcommand. It is meant for the
+parsing and checking of option values only.
+"""
+def checked(subparser, function, *args):
+    try:
+        return function(*args)
+    except ValueError as e:
+        subparser.error(str(e))
+
+
+
+"""
+This function builds the category filter and the dataset index path
+from the --include, --exclude, --categories and --index options.
+"""
+def category_options(args, subparser):
+    import dataset_index
+
+    try:
+        category_filter = dataset_index.CategoryFilter.from_options(args.include, args.exclude, args.categories)
+    except (OSError, ValueError) as e:
+        subparser.error(f"cannot read category filter {args.categories}: {e}")
+    if category_filter.include is None and not category_filter.exclude:
+        category_filter = None
+    index_path = False if args.index == 'none' else args.index
+    return category_filter, index_path
+
+
+
+"""
+This function reads the options for a subcommand from a JSON config
+file: the subcommand's own section if the file has one, otherwise
+the whole file. Keys may use dashes or underscores.
+"""
+def load_config(path, command):
+    with open(path) as f:
+        config = json.load(f)
+    if not isinstance(config, dict):
+        raise ValueError(f"{path} must hold a JSON object")
+    if any(name in config for name in COMMANDS):
+        config = config.get(command, {})
+    return {key.replace('-', '_'): value for key, value in config.items()}
+
+
+
+"""
+This function converts a tree of OFF files (step 1).
+"""
+def run_convert(args, subparser):
+    import dataset_index
+    import mesh_store
+    import off_to_mat_converter
+
+    if not os.path.isdir(args.input):
+        subparser.error(f"input directory {args.input} does not exist")
+    category_filter, index_path = category_options(args, subparser)
+    if args.dry_run:
+        # A dry run reads the index file but does not write it
+        index = dataset_index.DatasetIndex(args.input, index_path, read_only=True)
+        index.report()
+        if args.format == 'pack':
+            for split in dataset_index.SPLIT_DIRS:
+                entries, categories = off_to_mat_converter.collect_store_entries(index, split, category_filter)
+                print(f"Would pack {len(entries)} {split} meshes of {len(categories)} categories into "
+                      f"{mesh_store.split_path(args.output, split)}")
+            return
+        jobs = off_to_mat_converter.collect_conversion_jobs(index, args.output, category_filter)
+        pending = sum(not off_to_mat_converter.is_up_to_date(off_file, mat_file) for off_file, mat_file in jobs)
+        print(f"Would convert {pending} of {len(jobs)} OFF files into {args.output} "
+              f"({len(jobs) - pending} up to date)")
+        return
+    off_to_mat_converter.convert_directory_tree(args.input, args.output, args.format, args.workers, category_filter,
+                                                index_path)
+
+
+
+"""
+This function returns the run report, profiling and log level
+arguments of prepare_voxel_data.run from the voxelize options.
+"""
+def instrumentation_options(args, subparser):
+    import run_report
+
+    if args.log_level.upper() not in run_report.LOG_LEVELS:
+        subparser.error(f"unknown log level '{args.log_level}', expected one of {run_report.LOG_LEVELS}")
+    report_path = False if args.report == 'none' else args.report
+    return {'report_path': report_path, 'profile_path': args.profile, 'trace_memory': args.trace_memory,
+            'log_level': args.log_level.upper()}
+
+
+
+"""
+This function renders the preview of the train split of a voxelize
+output, if --preview was given.
+"""
+def write_hdf5_preview(args, hdf5_filename):
+    if args.preview:
+        import voxel_preview
+        voxel_preview.preview_hdf5(hdf5_filename, args.preview, mode=args.preview_mode)
+
+
+
+"""
+This function voxelizes a dataset, or one shard of it, into an HDF5
+file (step 2), or resumes the interrupted run recorded in it.
+"""
+def run_voxelize(args, subparser):
+    import prepare_voxel_data
+
+    hdf5_filename = args.output if args.output.endswith('.hdf5') else args.output + '.hdf5'
+    shard = checked(subparser, prepare_voxel_data.parse_shard, args.shard) if args.shard else None
+    if shard is not None:
+        hdf5_filename = prepare_voxel_data.shard_filename(hdf5_filename, *shard)
+    instrumentation = instrumentation_options(args, subparser)
+    if args.resume:
+        if not os.path.isfile(hdf5_filename):
+            subparser.error(f"cannot resume, {hdf5_filename} does not exist")
+        if args.dry_run:
+            import h5py
+            with h5py.File(hdf5_filename, 'r') as hdf5_file:
+                prepare_voxel_data.load_resumable_plan(hdf5_file)
+                for split, title in prepare_voxel_data.SPLITS:
+                    done = hdf5_file[split + "_done"][()]
+                    print(f"{title}: {len(done) - int(done.sum())} of {len(done)} samples left")
+            return
+        prepare_voxel_data.run(hdf5_filename, workers=args.workers, **instrumentation)
+        write_hdf5_preview(args, hdf5_filename)
+        return
+
+    if not os.path.isdir(args.input):
+        subparser.error(f"input directory {args.input} does not exist")
+    box_sizes = checked(subparser, prepare_voxel_data.check_box_sizes, args.box_sizes)
+    compression = None if args.compression == 'none' else args.compression
+    cache_path = None if args.cache.lower() == 'none' else args.cache
+    if args.cache_size <= 0:
+        subparser.error("--cache-size must be positive")
+    category_filter, index_path = category_options(args, subparser)
+    if args.dry_run:
+        combine_train, combine_test, _, _ = prepare_voxel_data.collect_samples(args.input, category_filter, index_path,
+                                                                               read_only=True)
+        per_sample = sum((size * size * ((size + 7) // 8) if args.packed else size ** 3) for size in box_sizes)
+        total = len(combine_train) + len(combine_test)
+        n_train, n_test = len(combine_train), len(combine_test)
+        if shard is not None:
+            n_train, n_test = (n * (shard[0] + 1) // shard[1] - n * shard[0] // shard[1] for n in (n_train, n_test))
+            total = n_train + n_test
+            print(f"Shard {shard[0]} of {shard[1]} (sample counts are approximate)")
+        print(f"Would voxelize {n_train} training and {n_test} testing/validation samples "
+              f"at sizes {box_sizes} with the {args.backend} backend into {hdf5_filename}")
+        print(f"Uncompressed voxel data: {total * per_sample / 1024 ** 2:.1f} MB")
+        return
+    plan = prepare_voxel_data.make_run_plan(args.input, box_sizes, args.backend, args.fill, cache_path, args.packed,
+                                            compression, category_filter, index_path, shard,
+                                            cache_size=int(args.cache_size * 1024 ** 3))
+    prepare_voxel_data.run(hdf5_filename, plan, args.workers, **instrumentation)
+    write_hdf5_preview(args, hdf5_filename)
+
+
+
+"""
+This function merges the shard files of a voxelize run into one HDF5
+file of virtual datasets.
+"""
+def run_merge(args, subparser):
+    import prepare_voxel_data
+
+    hdf5_filename = args.output if args.output.endswith('.hdf5') else args.output + '.hdf5'
+    shard_filenames = args.shards or prepare_voxel_data.find_shards(hdf5_filename)
+    if not shard_filenames:
+        subparser.error(f"no shard files of {hdf5_filename} found")
+    if args.dry_run:
+        shards = prepare_voxel_data.check_shards(shard_filenames)
+        for filename, _, counts in shards:
+            print(f"{filename}: " + ", ".join(f"{counts[split]} {split}" for split, _ in prepare_voxel_data.SPLITS))
+        print(f"Would merge {len(shards)} shards into {hdf5_filename}")
+        return
+    prepare_voxel_data.merge_shards(hdf5_filename, shard_filenames)
+
+
+
+"""
+This function creates the simple or complex EMNIST targets.
+"""
+def run_emnist(args, subparser):
+    import emnist_targets
+
+    if min(args.train_size, args.test_size, args.box_size) <= 0:
+        subparser.error("sample counts and box size must be positive")
+    if args.command == 'emnist-complex' and (args.k < 2 or args.max_shift < 0 or
+                                             (args.pairing == 'cross-axis' and args.k > 3)):
+        subparser.error("--k must be at least 2 (at most 3 for cross-axis pairing) and --max-shift not negative")
+    complex_targets = args.command == 'emnist-complex'
+    output = args.output or (emnist_targets.COMPLEX_TARGETS_DIR if complex_targets
+                             else emnist_targets.SIMPLE_TARGETS_DIR)
+    if args.dry_run:
+        import idx_dataset
+        data_dir = args.data_dir or idx_dataset.DEFAULT_DATA_DIR
+        for split, n_samples in (('train', args.train_size), ('test', args.test_size)):
+            try:
+                path = idx_dataset.idx_path(data_dir, args.dataset, split, 'images')
+            except FileNotFoundError as e:
+                subparser.error(str(e))
+            n_images = idx_dataset.idx_shape(path)[0]
+            if n_images < n_samples:
+                subparser.error(f"only {n_images} {split} images in {path} for {n_samples} samples")
+            print(f"Would read {split} images from {path} ({n_images} images)")
+        n_train, n_test = ((args.train_size // args.k, args.test_size // args.k) if complex_targets
+                           else (args.train_size, args.test_size))
+        sample_bytes = args.box_size ** 2 * ((args.box_size + 7) // 8 if args.packed else args.box_size)
+        print(f"Would create {n_train} train and {n_test} test {'complex' if complex_targets else 'simple'} "
+              f"targets of {args.box_size}^3 voxels into {output} "
+              f"({(n_train + n_test) * sample_bytes / 1024 ** 2:.1f} MB{', packed' if args.packed else ''})")
+        return
+    if not complex_targets:
+        emnist_targets.create_simple_targets(args.train_size, args.test_size, args.box_size, output, seed=args.seed,
+                                             packed=args.packed, data_dir=args.data_dir, dataset=args.dataset,
+                                             preview=args.preview, preview_mode=args.preview_mode)
+        return
+    emnist_targets.create_complex_targets(args.train_size, args.test_size, args.box_size, output, seed=args.seed,
+                                          packed=args.packed, k=args.k, pairing=args.pairing, max_shift=args.max_shift,
+                                          data_dir=args.data_dir, dataset=args.dataset, preview=args.preview,
+                                          preview_mode=args.preview_mode)
+
+
+
+"""
+This function renders a contact sheet PNG of the samples of an HDF5
+output of voxelize (or merge) or of an EMNIST target set.
+"""
+def run_preview(args, subparser):
+    import voxel_preview
+
+    if args.samples <= 0 or args.columns <= 0:
+        subparser.error("--samples and --columns must be positive")
+    if os.path.isdir(args.input):
+        if args.dry_run:
+            import emnist_store
+            manifest = emnist_store.read_manifest(args.input)
+            name = args.split or next(iter(manifest['arrays']))
+            print(f"Would render {args.samples} of the {manifest['arrays'][name]['n_samples']} {name} targets "
+                  f"of {args.input} to {args.output}")
+            return
+        voxel_preview.preview_targets(args.input, args.output, args.split, args.samples, args.preview_mode,
+                                      args.columns)
+        return
+    if not os.path.isfile(args.input):
+        subparser.error(f"{args.input} is neither an HDF5 file nor a target set directory")
+    if args.dry_run:
+        print(f"Would render {args.samples} {args.split or 'train'} samples of {args.input} to {args.output}")
+        return
+    voxel_preview.preview_hdf5(args.input, args.output, args.split or 'train', args.box_size, args.samples,
+                               args.preview_mode, args.columns)
+
+
+
+"""
+This function adds the --preview and --preview-mode options to a
+subcommand parser.
+"""
+def add_preview_options(subparser, what):
+    subparser.add_argument('--preview', metavar='PNG', help=f'render a contact sheet of some {what} to this PNG file '
+                                                            '(default: no preview)')
+    subparser.add_argument('--preview-mode', choices=('mip', 'depth'), default='mip',
+                           help='maximum intensity projections or depth shading (default: %(default)s)')
+
+
+
+"""
+This function builds the argument parser and returns it together
+with the subcommand parsers, by name.
+"""
+def build_parser():
+    parser = argparse.ArgumentParser(prog='voxel-pipeline',
+                                     description='Prepare voxelized 3D datasets from ModelNet meshes and EMNIST images.')
+    subparsers = parser.add_subparsers(dest='command', metavar='command', required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--config', help='JSON file with option values; flags given here override it')
+    common.add_argument('--dry-run', action='store_true', help='check the options and input and print what would be done')
+
+    categories = argparse.ArgumentParser(add_help=False)
+    categories.add_argument('--include', type=parse_names, help='comma separated categories (or shell patterns) to use (default: all)')
+    categories.add_argument('--exclude', type=parse_names, help='comma separated categories (or shell patterns) to leave out')
+    categories.add_argument('--categories', help="JSON category filter file with 'include' and/or 'exclude' lists")
+    categories.add_argument('--index', help="dataset index file, or 'none' to keep it in memory "
+                                            "(default: .dataset_index.json in the input directory)")
+
+    convert = subparsers.add_parser('convert', parents=[common, categories], help='convert OFF meshes to MAT files or mesh stores')
+    convert.add_argument('--input', default='ModelNet40/ModelNet40_off', help='directory tree of OFF files (default: %(default)s)')
+    convert.add_argument('--output', default='ModelNet40/ModelNet40_Mat', help='output directory (default: %(default)s)')
+    convert.add_argument('--format', choices=('mat', 'pack'), default='mat',
+                         help="'mat' for one MAT file per mesh, 'pack' for one mesh store per split (default: %(default)s)")
+    convert.add_argument('--workers', type=int, help='number of worker processes (default: number of CPUs)')
+    convert.set_defaults(handler=run_convert)
+
+    voxelize = subparsers.add_parser('voxelize', parents=[common, categories], help='voxelize meshes into an HDF5 dataset')
+    voxelize.add_argument('--input', default='ModelNet40/ModelNet40_Mat',
+                          help='MAT, OFF or mesh store directory (default: %(default)s)')
+    voxelize.add_argument('--output', default='object40.hdf5', help='HDF5 file to write (default: %(default)s)')
+    voxelize.add_argument('--box-sizes', type=parse_sizes, default='32', help='voxel size, or comma separated sizes (default: %(default)s)')
+    voxelize.add_argument('--backend', choices=('numpy', 'trimesh'), default='trimesh',
+                          help='voxelization backend (default: %(default)s)')
+    voxelize.add_argument('--fill', action='store_true', help='fill the interior of the voxel grids')
+    voxelize.add_argument('--cache', default='.voxel_cache', help="voxel cache directory, or 'none' (default: %(default)s)")
+    voxelize.add_argument('--cache-size', metavar='GB', type=float, default=2.0,
+                          help='bound of the voxel cache size, in GB (default: %(default)g)')
+    voxelize.add_argument('--packed', action='store_true', help='store bit-packed voxel grids')
+    voxelize.add_argument('--compression', choices=('gzip', 'lzf', 'none'), default='gzip',
+                          help='HDF5 compression filter (default: %(default)s)')
+    voxelize.add_argument('--workers', type=int, help='number of worker processes (default: number of CPUs)')
+    voxelize.add_argument('--resume', action='store_true', help='continue the interrupted run recorded in --output')
+    voxelize.add_argument('--shard', metavar='I/N',
+                          help='write only shard I of N (counted from 0) to <output>-0000I-of-0000N.hdf5')
+    voxelize.add_argument('--report', help="JSON run report to write, or 'none' (default: <output>.report.json)")
+    voxelize.add_argument('--profile', help='run the main process under cProfile and write the stats to this file')
+    voxelize.add_argument('--trace-memory', action='store_true',
+                          help='trace the allocations of the main process with tracemalloc')
+    voxelize.add_argument('--log-level', default='INFO',
+                          help='DEBUG, INFO, WARNING or ERROR; WARNING silences the progress messages '
+                               '(default: %(default)s)')
+    add_preview_options(voxelize, 'train samples')
+    voxelize.set_defaults(handler=run_voxelize)
+
+    merge = subparsers.add_parser('merge', parents=[common], help='merge the shard files of a voxelize run')
+    merge.add_argument('shards', nargs='*', help='shard files (default: the shard files of --output)')
+    merge.add_argument('--output', default='object40.hdf5', help='merged HDF5 file to write (default: %(default)s)')
+    merge.set_defaults(handler=run_merge)
+
+    preview = subparsers.add_parser('preview', parents=[common], help='render a PNG contact sheet of voxel samples')
+    preview.add_argument('input', help='HDF5 file of voxelize or merge, or EMNIST target set directory')
+    preview.add_argument('--output', default='preview.png', help='PNG file to write (default: %(default)s)')
+    preview.add_argument('--split', help='HDF5 split (default: train) or target set array (default: the first)')
+    preview.add_argument('--box-size', type=int, help='voxel size of a multi-resolution HDF5 file (default: largest)')
+    preview.add_argument('--samples', type=int, default=100, help='number of samples, spread over the set '
+                                                                  '(default: %(default)s)')
+    preview.add_argument('--columns', type=int, default=10, help='samples per row (default: %(default)s)')
+    preview.add_argument('--preview-mode', choices=('mip', 'depth'), default='mip',
+                         help='maximum intensity projections or depth shading (default: %(default)s)')
+    preview.set_defaults(handler=run_preview)
+
+    subcommands = {'convert': convert, 'voxelize': voxelize, 'merge': merge, 'preview': preview}
+    for name, kind in (('emnist-simple', 'simple extrusion'), ('emnist-complex', 'complex mashup')):
+        emnist = subparsers.add_parser(name, parents=[common], help=f'create the {kind} EMNIST targets')
+        emnist.add_argument('--train-size', type=int, default=27000, help='number of train samples (default: %(default)s)')
+        emnist.add_argument('--test-size', type=int, default=3000, help='number of test samples (default: %(default)s)')
+        emnist.add_argument('--box-size', type=int, default=28, help='voxel box size (default: %(default)s)')
+        emnist.add_argument('--data-dir', help='directory of the MNIST/EMNIST IDX files '
+                                               '(default: $EMNIST_DATA_DIR or emnist_data)')
+        emnist.add_argument('--dataset', choices=('mnist', 'letters', 'balanced', 'byclass', 'bymerge', 'digits'),
+                            default='mnist', help='images to extrude (default: %(default)s)')
+        emnist.add_argument('--output', help='target set directory to write')
+        emnist.add_argument('--packed', action='store_true', help='store the occupancy bits packed, 8 voxels per byte')
+        emnist.add_argument('--seed', type=int, help='random seed (default: unseeded)')
+        add_preview_options(emnist, 'train targets')
+        if name == 'emnist-complex':
+            emnist.add_argument('--k', type=int, default=2, help='simple targets per complex target (default: %(default)s)')
+            emnist.add_argument('--pairing', choices=('halves', 'random', 'cross-axis'), default='halves',
+                                help='how the combined simple targets are chosen (default: %(default)s)')
+            emnist.add_argument('--max-shift', type=int, default=0,
+                                help='translate each simple target by up to this many voxels per axis (default: 0)')
+        emnist.set_defaults(handler=run_emnist)
+        subcommands[name] = emnist
+    return parser, subcommands
+
+
+
+"""
+This function checks and converts the values of a config file like
+the same options given as flags: through the option's type, against
+its choices, and as a boolean for a switch. It returns the converted
+values, or reports a usage error of the subcommand.
+"""
+def check_config(subparser, config, path):
+    actions = {action.dest: action for action in subparser._actions}
+    unknown = sorted(set(config) - set(actions) | set(config) & {'command', 'handler', 'config', 'help'})
+    if unknown:
+        subparser.error(f"unknown options in {path}: {', '.join(unknown)}")
+    checked_config = {}
+    for key, value in config.items():
+        action = actions[key]
+        if action.nargs == 0:
+            if not isinstance(value, bool):
+                subparser.error(f"{key} in {path} must be true or false")
+        elif isinstance(value, list) and action.nargs in ('*', '+'):
+            value = [str(item) for item in value]
+        elif value is not None and action.type is not None:
+            try:
+                value = action.type(value)
+            except (TypeError, ValueError, argparse.ArgumentTypeError):
+                subparser.error(f"invalid value {value!r} for {key} in {path}")
+        elif value is not None and not isinstance(value, str):
+            subparser.error(f"{key} in {path} must be a string")
+        if action.choices is not None and value is not None and value not in action.choices:
+            subparser.error(f"invalid choice {value!r} for {key} in {path} "
+                            f"(choose from {', '.join(map(str, action.choices))})")
+        checked_config[key] = value
+    return checked_config
+
+
+
+"""
+This function parses the command line, applying the config file
+values, checked like flags, as defaults so the flags override them.
+"""
+def parse_args(argv=None):
+    parser, subcommands = build_parser()
+    args = parser.parse_args(argv)
+    if args.config:
+        subparser = subcommands[args.command]
+        try:
+            config = load_config(args.config, args.command)
+        except (OSError, ValueError) as e:
+            subparser.error(f"cannot read config file {args.config}: {e}")
+        subparser.set_defaults(**check_config(subparser, config, args.config))
+        args = parser.parse_args(argv)
+    return args, subcommands[args.command]
+
+
+
+def main(argv=None):
+    args, subparser = parse_args(argv)
+    try:
+        args.handler(args, subparser)
+    except (OSError, ValueError) as e:
+        # Options were checked by the handler; this is a data error
+        print(f"{subparser.prog}: error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+# The guard keeps worker processes from re-running the command
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+@author: ken
+"""
+
+
+"""
+Tests of the rank split of voxel_loader.VoxelLoader.
+"""
+
+
+import os
+import sys
+import h5py
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import voxel_hdf5
+import voxel_loader
+
+
+
+"""
+This function writes a test split of n_samples 8^3 grids, whose
+labels are the sample indices, in chunks of chunk_samples rows.
+"""
+def write_split(path, n_samples, chunk_samples):
+    with h5py.File(path, 'w') as f:
+        voxels = np.zeros((n_samples, 8, 8, 8), dtype=np.int8)
+        voxels[:, 0, 0, 0] = 1
+        f.create_dataset('test_mat', data=voxels, chunks=(chunk_samples, 8, 8, 8))
+        labels = voxel_hdf5.create_sample_dataset(f, 'test_label', n_samples, (1,), np.int64, None)
+        labels[:] = np.arange(n_samples).reshape(-1, 1)
+
+
+@pytest.mark.parametrize('world_size', [2, 3, 5])
+def test_more_ranks_than_blocks(tmp_path, world_size):
+    # 50 samples in chunks of 16 fit in one read block
+    path = str(tmp_path / 'split.hdf5')
+    write_split(path, 50, 16)
+    loaders = [voxel_loader.VoxelLoader(path, 'test', batch_size=4, seed=0, rank=rank, world_size=world_size)
+               for rank in range(world_size)]
+    assert len(loaders[0]) > 0
+    assert len({len(loader) for loader in loaders}) == 1
+
+    seen = []
+    for loader in loaders:
+        with loader:
+            batches = [labels for _, labels in loader]
+        assert len(batches) == len(loader)
+        seen.append(set(np.concatenate(batches).tolist()))
+    # Every sample is read, and no two ranks share one
+    assert set.union(*seen) == set(range(50))
+    assert sum(len(labels) for labels in seen) == 50
+
+
+def test_fewer_samples_than_ranks(tmp_path):
+    path = str(tmp_path / 'split.hdf5')
+    write_split(path, 2, 1)
+    with pytest.raises(ValueError):
+        voxel_loader.VoxelLoader(path, 'test', rank=0, world_size=3)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+@author: ken
+"""
+
+
+"""
+Tests of the config file handling of the voxel_pipeline command line.
+"""
+
+
+import json
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import voxel_pipeline
+
+
+
+"""
+This function writes a config file and returns the arguments parsed
+with it for the voxelize subcommand.
+"""
+def parse_with_config(tmp_path, config, *argv):
+    path = str(tmp_path / 'config.json')
+    with open(path, 'w') as f:
+        json.dump(config, f)
+    args, _ = voxel_pipeline.parse_args(['voxelize', '--config', path] + list(argv))
+    return args
+
+
+@pytest.mark.parametrize('config', [{'backend': 'bogus'}, {'compression': 'zstd'},
+                                    {'voxelize': {'preview_mode': 'xray'}}])
+def test_config_bad_choice_is_usage_error(tmp_path, config, capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        parse_with_config(tmp_path, config)
+    assert exit_info.value.code == 2
+    assert 'invalid choice' in capsys.readouterr().err
+
+
+@pytest.mark.parametrize('config', [{'box_sizes': 'x,32'}, {'workers': 'many'}, {'fill': 'yes'}])
+def test_config_bad_value_is_usage_error(tmp_path, config):
+    with pytest.raises(SystemExit) as exit_info:
+        parse_with_config(tmp_path, config)
+    assert exit_info.value.code == 2
+
+
+def test_config_values_are_converted_like_flags(tmp_path):
+    args = parse_with_config(tmp_path, {'box_sizes': '16,32', 'workers': '3', 'include': 'chair, sofa',
+                                        'backend': 'numpy', 'fill': True})
+    assert args.box_sizes == [16, 32]
+    assert args.workers == 3
+    assert args.include == ['chair', 'sofa']
+    assert args.backend == 'numpy' and args.fill is True
+    assert parse_with_config(tmp_path, {'box_sizes': [16, 32]}).box_sizes == [16, 32]
+
+
+def test_flags_override_config(tmp_path):
+    args = parse_with_config(tmp_path, {'box_sizes': '16,32', 'backend': 'numpy'}, '--box-sizes', '64')
+    assert args.box_sizes == [64]
+    assert args.backend == 'numpy'